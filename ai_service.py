@@ -1,8 +1,36 @@
 import json
+import time
 import logging
-from typing import List, Optional
-from openai import OpenAI
+import threading
+from typing import Dict, List, Optional
 from config_manager import ConfigManager
+import re
+from token_budget import LatencyTracker, estimate_tokens, request_tokens
+from llm_router import create_router
+import tracing
+import llm_usage
+from metrics import LLM_COST, LLM_IN_FLIGHT, LLM_REQUEST_DURATION, LLM_REQUEST_ERRORS, LLM_TOKENS
+
+# 批量翻译结果中每条的开头，允许编号前有模型附加的非数字前缀
+_NUMBERED_LINE = re.compile(r'^\D*?\[(\d+)\]\s?(.*)$')
+
+def _parse_numbered(content: str, count: int) -> Optional[List[str]]:
+    """
+    解析以 [编号] 开头的批量结果，没有编号的行属于上一条（多行字幕）
+    :return: 按编号排列的结果，条数或编号不符时返回None
+    """
+    items: List[List[str]] = []
+    for line in content.strip().split('\n'):
+        match = _NUMBERED_LINE.match(line)
+        if match and int(match.group(1)) == len(items) + 1:
+            items.append([match.group(2)])
+        elif items:
+            items[-1].append(line)
+        else:
+            return None
+    if len(items) != count:
+        return None
+    return ['\n'.join(item).strip() for item in items]
 
 class AIService:
     _instance = None
@@ -16,13 +44,78 @@ class AIService:
     def _initialize(self):
         """初始化AI服务"""
         config = ConfigManager()
-        self.client = OpenAI(
-            api_key=config.get_api_key(),
-            base_url=config.get_api_base()
-        )
-        self.model = config.get_translation_config().get('default_model')
+        self.router = create_router(config)
+        # 各处理步骤的模型、路由和生成参数，首次使用时解析
+        self._stages: Dict[str, Dict] = {}
+        self._stages_lock = threading.Lock()
+        # 各模型每百万 token 的价格
+        self.pricing = config.get_config('api').get('pricing', {})
+        self.latency_tracker = LatencyTracker()
         print("初始化AI服务")
 
+    def get_stage(self, stage: str) -> Dict:
+        """
+        获取处理步骤使用的模型、路由和生成参数
+        :param stage: 处理步骤（correct / translate / ...）
+        :return: {'model', 'router', 'params'}
+        """
+        with self._stages_lock:
+            settings = self._stages.get(stage)
+            if settings is None:
+                config = ConfigManager().get_llm_stage_config(stage)
+                # 指定了接口的步骤单独路由，延迟和错误率统计与其他步骤分开
+                router = create_router(ConfigManager(), config['endpoints']) if config['endpoints'] else self.router
+                settings = {'model': config['model'], 'router': router, 'params': config['params']}
+                self._stages[stage] = settings
+                logging.info(f"{stage} 步骤使用模型 {config['model']}，接口: "
+                             f"{', '.join(endpoint.name for endpoint in router.endpoints)}")
+            return settings
+
+    def stage_model(self, stage: str) -> str:
+        """处理步骤使用的模型名称"""
+        return self.get_stage(stage)['model']
+
+    def _cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """按 api.pricing 中模型每百万 token 的输入、输出价格计算费用，未配置价格的模型为0"""
+        price = self.pricing.get(model) or {}
+        return (prompt_tokens * price.get('input', 0) + completion_tokens * price.get('output', 0)) / 1_000_000
+
+    def _create_completion(self, stage: str, messages: List[dict]):
+        """
+        使用处理步骤配置的模型发送对话请求，记录请求耗时、失败次数、并发请求数、token 用量和费用
+        :param stage: 请求所属的处理步骤（correct / translate）
+        :return: 响应对象
+        """
+        settings = self.get_stage(stage)
+        model = settings['model']
+        LLM_IN_FLIGHT.labels(stage=stage).inc()
+        start_time = time.time()
+        prompt_tokens = sum(estimate_tokens(message['content']) for message in messages)
+        try:
+            with tracing.span('llm_request', stage=stage, model=model, prompt_tokens=prompt_tokens) as llm_span:
+                response = settings['router'].complete(stage, model, messages, **settings['params'])
+                usage = getattr(response, 'usage', None)
+                if usage is not None:
+                    prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+                else:
+                    # 接口未返回用量时按响应文本估算
+                    completion_tokens = estimate_tokens(response.choices[0].message.content or '')
+                llm_span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        except Exception:
+            LLM_REQUEST_ERRORS.labels(stage=stage, model=model).inc()
+            llm_usage.add(stage, model, 0, 0, time.time() - start_time, 0.0, error=True)
+            raise
+        finally:
+            LLM_IN_FLIGHT.labels(stage=stage).dec()
+        seconds = time.time() - start_time
+        cost = self._cost(model, prompt_tokens, completion_tokens)
+        LLM_REQUEST_DURATION.labels(stage=stage, model=model).observe(seconds)
+        LLM_TOKENS.labels(stage=stage, model=model, kind='prompt').inc(prompt_tokens)
+        LLM_TOKENS.labels(stage=stage, model=model, kind='completion').inc(completion_tokens)
+        LLM_COST.labels(stage=stage, model=model).inc(cost)
+        llm_usage.add(stage, model, prompt_tokens, completion_tokens, seconds, cost)
+        return response
+
     def correct_subtitles(self, text: str, context_before: Optional[List[str]] = None, context_after: Optional[List[str]] = None) -> str:
         """
         纠正字幕文本
@@ -46,17 +139,16 @@ class AIService:
 
             请只返回纠正后的文本，不要包含任何解释或额外的文本。如果文本已经正确，直接返回原文。"""
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是一个专业的语音识别后处理助手。你的任务是纠正语音识别的错误，确保文本通顺、准确，并与上下文保持一致。只返回纠正后的文本，不要添加任何解释。"
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False
-            )
+            start_time = time.time()
+            response = self._create_completion('correct', [
+                {
+                    "role": "system",
+                    "content": "你是一个专业的语音识别后处理助手。你的任务是纠正语音识别的错误，确保文本通顺、准确，并与上下文保持一致。只返回纠正后的文本，不要添加任何解释。"
+                },
+                {"role": "user", "content": prompt}
+            ])
+            self.latency_tracker.record(self.stage_model('correct'), request_tokens(text, context_before, context_after),
+                                        time.time() - start_time)
             if response.choices[0].message.content.strip() != text:
                 print(f"需要纠正的文本: {text}")
                 print(f"纠正后的文本: {response.choices[0].message.content.strip()}")
@@ -94,17 +186,16 @@ class AIService:
 
 请只返回翻译结果，不要包含任何解释或额外的文本。"""
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是一个专业的翻译助手，请直接提供翻译结果，不要添加任何解释或额外的文本。翻译时要考虑上下文，确保语义连贯。"
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False
-            )
+            start_time = time.time()
+            response = self._create_completion('translate', [
+                {
+                    "role": "system",
+                    "content": "你是一个专业的翻译助手，请直接提供翻译结果，不要添加任何解释或额外的文本。翻译时要考虑上下文，确保语义连贯。"
+                },
+                {"role": "user", "content": prompt}
+            ])
+            self.latency_tracker.record(self.stage_model('translate'), request_tokens(text, context_before, context_after),
+                                        time.time() - start_time)
 
             return response.choices[0].message.content.strip()
 
@@ -112,6 +203,54 @@ class AIService:
             logging.error(f"文本翻译失败: {str(e)}")
             raise
 
+    def translate_batch(self, texts: List[str], target_lang: str, context_before: Optional[List[str]] = None,
+                        context_after: Optional[List[str]] = None) -> Optional[List[str]]:
+        """
+        在一个请求中翻译多条字幕，各条以 [编号] 标记
+        :param texts: 需要翻译的字幕文本
+        :param target_lang: 目标语言
+        :param context_before: 第一条字幕之前的上下文
+        :param context_after: 最后一条字幕之后的上下文
+        :return: 与 texts 一一对应的翻译结果；返回的条目与原文对不上时返回None，由调用方逐条重新翻译
+        """
+        if len(texts) == 1:
+            return [self.translate_text(texts[0], target_lang, context_before, context_after)]
+        try:
+            context_prompt = ""
+            if context_before:
+                context_prompt += f"前文：\n{'\n'.join(context_before)}\n\n"
+            if context_after:
+                context_prompt += f"后文：\n{'\n'.join(context_after)}\n\n"
+            numbered_text = '\n'.join(f"[{i}] {text}" for i, text in enumerate(texts, 1))
+
+            prompt = f"""请将以下文本翻译成{target_lang}，共{len(texts)}条字幕，注意保持原文的语气和风格，并确保与上下文保持连贯：
+
+{context_prompt}需要翻译的文本：
+{numbered_text}
+
+请只返回翻译结果，每条以原来的 [编号] 开头，不要合并或拆分条目，不要包含任何解释或额外的文本。"""
+
+            start_time = time.time()
+            response = self._create_completion('translate', [
+                {
+                    "role": "system",
+                    "content": "你是一个专业的翻译助手，请直接提供翻译结果，不要添加任何解释或额外的文本。翻译时要考虑上下文，确保语义连贯。"
+                },
+                {"role": "user", "content": prompt}
+            ])
+            self.latency_tracker.record(self.stage_model('translate'),
+                                        request_tokens(numbered_text, context_before, context_after),
+                                        time.time() - start_time)
+
+            translated = _parse_numbered(response.choices[0].message.content, len(texts))
+            if translated is None:
+                logging.warning(f"批量翻译返回的条目与原文不一致，逐条重新翻译 {len(texts)} 条字幕")
+            return translated
+
+        except Exception as e:
+            logging.error(f"批量翻译失败: {str(e)}")
+            raise
+
     def batch_process(self, texts: List[str], process_type: str, **kwargs) -> List[str]:
         """
         批量处理文本（纠错或翻译）
@@ -1,11 +1,17 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, render_template, request, send_file, jsonify, Response
 import os
 from werkzeug.utils import secure_filename
 import logging
-import time
-from task_processor import TaskProcessor
-import genSrt
+from datetime import datetime
+from task_processor import TaskProcessor, parse_target_langs, generate_task_id, public_task_view
+from ingest import create_folder_watcher, collect_media_files, get_file_type, is_within
+import whisper_models
 from config_manager import ConfigManager
+from metrics import REGISTRY
+from events import create_event_stream
+from retention import create_retention_sweeper
+from subtitle_formats import EXPORT_FORMATS, RenderCache, export_filename
+from llm_usage import summarize
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -24,70 +30,200 @@ if not OPENAI_API_KEY or not OPENAI_API_BASE:
     logging.error(error_msg)
     raise ValueError(error_msg)
 
-# 支持的文件类型
-ALLOWED_VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mkv', '.mov'}
-ALLOWED_AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.aac', '.flac'}
+# 可下载的字幕文件类型（按下载优先级排序）
+SUBTITLE_FILE_TYPES = ['subtitle_translated', 'subtitle_corrected', 'subtitle']
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# 导出的其他格式字幕和打包文件按源文件校验值缓存在上传目录下
+render_cache = RenderCache(os.path.join(app.config['UPLOAD_FOLDER'], '.render_cache'))
+
 # 创建任务处理器
+# embedded_workers 为 false 时 Web 进程只负责提交任务和查询状态，由独立的 worker.py 进程处理任务
 task_processor = TaskProcessor(
-    num_workers=config_manager.get_translation_config().get('max_workers', 2)
+    num_workers=config_manager.get_translation_config().get('max_workers', 2),
+    run_workers=config_manager.get_config('task_processor').get('embedded_workers', True)
 )
 
-# 如果启用了词典，加载词典
-word_dict_config = config_manager.get_word_dict_config()
-if word_dict_config.get('enabled', True):
-    dict_path = word_dict_config.get('path', 'word_dict.txt')
-    if os.path.exists(dict_path):
-        task_processor.translator.set_word_dict(dict_path)
-    else:
-        logging.warning(f"词典文件 {dict_path} 不存在")
+# 任务状态通过 Server-Sent Events 推送给页面，事件服务运行在独立端口上
+# 端口被占用（如同一台机器上的另一个 Web 进程）时不推送，页面退回轮询
+event_stream = create_event_stream(task_processor, config_manager.get_config('events'))
+if event_stream and not event_stream.start():
+    event_stream = None
+
+# 批量登记配置
+ingest_config = config_manager.get_config('ingest')
+
+# 在 Web 进程内处理任务时，同时由本进程监视投放目录并定期清理上传目录
+if config_manager.get_config('task_processor').get('embedded_workers', True):
+    folder_watcher = create_folder_watcher(task_processor, ingest_config, app.config['UPLOAD_FOLDER'])
+    if folder_watcher:
+        folder_watcher.start()
+    retention_sweeper = create_retention_sweeper(task_processor, config_manager.get_config('retention'),
+                                                 app.config['UPLOAD_FOLDER'])
+    if retention_sweeper:
+        retention_sweeper.start()
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', events_port=event_stream.port if event_stream else None)
+
+@app.route('/task/<task_id>')
+def task_detail(task_id):
+    """任务详情页：各阶段及其中每个操作的时间线"""
+    return render_template('task.html', task_id=task_id)
 
 @app.route('/models')
 def get_models():
     """获取可用的 Whisper 模型列表"""
-    return jsonify(genSrt.get_available_models())
+    return jsonify(whisper_models.get_available_models())
+
+def conditional_json(data):
+    """返回带 ETag 的 JSON 响应，内容未变化时返回 304"""
+    response = jsonify(data)
+    response.add_etag()
+    return response.make_conditional(request)
+
+def versioned_json(etag: str, build):
+    """
+    以状态版本号作为 ETag，与客户端的 If-None-Match 相同时直接返回 304，不生成响应内容
+    :param build: 生成响应数据的函数
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    return response
 
 @app.route('/status/<task_id>')
 def get_status(task_id):
-    status = task_processor.get_status(task_id)
-    if status:
-        return jsonify(status)
-    return jsonify({'error': '任务不存在'}), 404
+    etag = task_processor.get_status_etag(task_id)
+    if etag is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return versioned_json(etag, lambda: public_task_view(task_processor.get_status(task_id) or {}))
 
 @app.route('/status/all')
 def get_all_status():
-    """获取所有任务的状态"""
-    return jsonify(task_processor.get_all_status())
+    """
+    获取所有任务的状态
+    指定 since=<version> 时只返回状态版本号大于该值的任务：{'version': ..., 'tasks': [...]}
+    """
+    since = request.args.get('since')
+    version = task_processor.get_all_status_version()
+    if since is None:
+        return versioned_json(f"v{version}",
+                              lambda: [public_task_view(task) for task in task_processor.get_all_status()])
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'error': 'since 必须是整数'}), 400
 
-@app.route('/download/<task_id>')
-def download_file(task_id):
+    def build_changes():
+        changes = task_processor.get_status_changes(since)
+        changes['tasks'] = [public_task_view(task) for task in changes['tasks']]
+        return changes
+    return versioned_json(f"v{version}-{since}", build_changes)
+
+def parse_date_param(value):
+    """将日期参数规范为与 created_at 可比较的格式（YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS）"""
+    if not value:
+        return None
+    value = value.strip().replace('T', ' ')
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f'无效的日期: {value}')
+
+@app.route('/tasks')
+def list_tasks():
+    """
+    分页查询任务列表
+    参数：status（可用逗号分隔多个）、model、lang、since、until（创建时间，UTC）、limit、cursor
+    """
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'limit 必须是整数'}), 400
+    statuses = [status.strip() for status in ','.join(request.args.getlist('status')).split(',')
+                if status.strip()]
+    try:
+        result = task_processor.list_tasks(
+            limit=min(max(limit, 1), 200),
+            cursor=request.args.get('cursor'),
+            statuses=statuses,
+            model_name=request.args.get('model') or None,
+            lang=request.args.get('lang') or None,
+            created_after=parse_date_param(request.args.get('since')),
+            created_before=parse_date_param(request.args.get('until'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    result['tasks'] = [public_task_view(task) for task in result['tasks']]
+    return jsonify(result)
+
+@app.route('/files/<task_id>')
+def list_task_files(task_id):
+    """获取任务可下载的字幕文件列表"""
     task = task_processor.get_status(task_id)
-    if not task or task['status'] != 'completed':
-        return jsonify({'error': '文件不存在或任务未完成'}), 404
-    
-    # 获取任务的所有文件
+    if not task:
+        return jsonify({'error': '任务不存在'}), 404
+
     files = task_processor.db.get_task_files(task_id)
+    return jsonify([
+        {
+            'file_type': file['file_type'],
+            'lang': file['lang'],
+            'filename': file['original_filename']
+        }
+        for file in files
+        if file['file_type'] in SUBTITLE_FILE_TYPES
+    ])
+
+def completed_subtitle_files(task_id):
+    """
+    获取已完成任务的字幕文件记录
+    :return: (文件记录列表, 错误响应)，任务不存在或未完成时文件记录为None
+    """
+    task = task_processor.get_status(task_id)
+    if not task or task['status'] != 'completed':
+        return None, (jsonify({'error': '文件不存在或任务未完成'}), 404)
+    files = [file for file in task_processor.db.get_task_files(task_id)
+             if file['file_type'] in SUBTITLE_FILE_TYPES and os.path.exists(file['file_path'])]
     if not files:
-        return jsonify({'error': '找不到任务相关的文件'}), 404
-    
-    # 获取最终的字幕文件（优先使用翻译后的文件，其次是纠正后的文件，最后是原始字幕文件）
-    subtitle_file = None
-    for file_type in ['subtitle_translated', 'subtitle_corrected', 'subtitle']:
+        return None, (jsonify({'error': '找不到任务相关的文件'}), 404)
+    return files, None
+
+def select_subtitle_file(files, lang=None):
+    """
+    选择要下载的字幕文件：优先使用翻译后的文件，其次是纠正后的文件，最后是原始字幕文件
+    :param lang: 指定时只选择该语言的翻译文件
+    :return: 文件记录，没有符合条件的文件时返回None
+    """
+    if lang:
+        files = [file for file in files
+                 if file['file_type'] == 'subtitle_translated' and file['lang'] == lang]
+    for file_type in SUBTITLE_FILE_TYPES:
         for file in files:
             if file['file_type'] == file_type:
-                subtitle_file = file
-                break
-        if subtitle_file:
-            break
-    
-    if not subtitle_file or not os.path.exists(subtitle_file['file_path']):
+                return file
+    return None
+
+@app.route('/download/<task_id>')
+def download_file(task_id):
+    files, error = completed_subtitle_files(task_id)
+    if error:
+        return error
+
+    # 指定语言时只下载该语言的翻译文件
+    lang = request.args.get('lang')
+    subtitle_file = select_subtitle_file(files, lang)
+    if not subtitle_file:
+        if lang:
+            return jsonify({'error': f'没有{lang}的翻译文件'}), 404
         return jsonify({'error': '字幕文件不存在'}), 404
     
     # 使用原始文件名作为下载文件名
@@ -99,19 +235,180 @@ def download_file(task_id):
         download_name=download_name
     )
 
-def get_file_type(filename):
-    """判断文件类型"""
-    ext = os.path.splitext(filename.lower())[1]
-    if ext in ALLOWED_VIDEO_EXTENSIONS:
-        return 'video'
-    elif ext in ALLOWED_AUDIO_EXTENSIONS:
-        return 'audio'
-    return None
+@app.route('/export/<task_id>')
+def export_file(task_id):
+    """
+    以指定格式（srt、vtt、ass、json）下载字幕，文件选择规则与 /download 相同
+    转换结果按源文件校验值缓存，支持 ETag 和 Range 请求
+    """
+    output_format = request.args.get('format', 'srt').lower()
+    if output_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'不支持的字幕格式: {output_format}，可选: {", ".join(EXPORT_FORMATS)}'}), 400
+    files, error = completed_subtitle_files(task_id)
+    if error:
+        return error
+
+    lang = request.args.get('lang')
+    subtitle_file = select_subtitle_file(files, lang)
+    if not subtitle_file:
+        if lang:
+            return jsonify({'error': f'没有{lang}的翻译文件'}), 404
+        return jsonify({'error': '字幕文件不存在'}), 404
+
+    path, key = render_cache.render(subtitle_file['file_path'], output_format)
+    return send_file(
+        path,
+        mimetype=EXPORT_FORMATS[output_format]['mimetype'],
+        as_attachment=True,
+        download_name=export_filename(subtitle_file['original_filename'], output_format),
+        etag=key,
+        conditional=True
+    )
+
+@app.route('/export/<task_id>/bundle')
+def export_bundle(task_id):
+    """
+    将任务的所有字幕文件（原始、纠正后及各语言翻译）按指定格式打包为 zip 下载
+    格式通过 formats 参数指定，多个格式用逗号分隔，默认 srt
+    """
+    formats = [value.strip().lower() for value in request.args.get('formats', 'srt').split(',') if value.strip()]
+    unsupported = [value for value in formats if value not in EXPORT_FORMATS]
+    if not formats or unsupported:
+        return jsonify({'error': f'不支持的字幕格式: {", ".join(unsupported)}，可选: {", ".join(EXPORT_FORMATS)}'}), 400
+    files, error = completed_subtitle_files(task_id)
+    if error:
+        return error
+
+    # 纠正后的字幕与原始字幕同名，包内加上 _corrected 后缀区分
+    entries = []
+    for file in sorted(files, key=lambda file: (SUBTITLE_FILE_TYPES[::-1].index(file['file_type']), file['lang'] or '')):
+        filename = file['original_filename']
+        if file['file_type'] == 'subtitle_corrected':
+            filename = export_filename(filename, 'srt').replace('.srt', '_corrected.srt')
+        entries.append((file['file_path'], filename))
+    path, key = render_cache.bundle(entries, formats)
+    task = task_processor.get_status(task_id)
+    return send_file(
+        path,
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=export_filename(task['original_filename'], 'zip'),
+        etag=key,
+        conditional=True
+    )
+
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    """取消排队中或处理中的任务"""
+    success, message = task_processor.cancel_task(task_id)
+    if success:
+        return jsonify({'message': message})
+    return jsonify({'error': message}), 400
+
+@app.route('/tasks/<task_id>/trace')
+def get_task_trace(task_id):
+    """
+    获取任务的追踪记录
+    span 包括排队等待、各阶段、ffmpeg、模型加载、转录窗口、纠正场景、翻译批次和每个大模型请求，
+    字段为 {id, parent_id, name, start, end, attrs}，时间为 Unix 时间戳（秒）
+    """
+    task = task_processor.get_status(task_id)
+    if not task:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'task_id': task_id, 'spans': task_processor.db.get_task_trace(task_id)})
+
+@app.route('/tasks/<task_id>/usage')
+def get_task_usage(task_id):
+    """
+    获取任务各大模型处理步骤的用量：请求数、失败数、token 数、总耗时、平均耗时和费用（按 api.pricing 计算），
+    包括被中断后重新执行的阶段
+    """
+    task = task_processor.get_status(task_id)
+    if not task:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'task_id': task_id, **summarize(task_processor.db.get_task_llm_usage(task_id))})
+
+@app.route('/tasks/<task_id>/profile', methods=['POST'])
+def set_task_profile(task_id):
+    """
+    为未结束的任务开启或关闭性能分析（请求体为 JSON：{"enabled": true}），从下一个开始的处理阶段起生效
+    """
+    data = request.get_json(silent=True) or {}
+    enabled = str(data.get('enabled', True)).lower() in ('true', '1')
+    success, message = task_processor.set_task_profile(task_id, enabled)
+    if success:
+        return jsonify({'message': message, 'enabled': enabled})
+    return jsonify({'error': message}), 404 if message == '任务不存在' else 400
+
+@app.route('/tasks/<task_id>/profile')
+def download_task_profile(task_id):
+    """
+    下载任务的性能分析结果
+    采样分析为折叠栈格式（.folded，可用 flamegraph.pl 或 speedscope 查看），cProfile 分析为 .pstats 文件
+    """
+    profile_file = next((file for file in task_processor.db.get_task_files(task_id)
+                         if file['file_type'] == 'profile'), None)
+    if not profile_file or not os.path.exists(profile_file['file_path']):
+        return jsonify({'error': '该任务没有性能分析结果'}), 404
+    return send_file(
+        profile_file['file_path'],
+        as_attachment=True,
+        download_name=profile_file['original_filename'],
+        mimetype='text/plain' if profile_file['file_path'].endswith('.folded') else 'application/octet-stream'
+    )
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 格式的运行指标"""
+    task_processor.update_queue_metrics()
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/queue/info')
 def get_queue_info():
     """获取队列信息"""
-    return jsonify(task_processor.get_queue_info())
+    return conditional_json(task_processor.get_queue_info())
+
+def parse_task_options(values):
+    """
+    解析任务选项（翻译语言、是否保留原文、模型、优先级、是否进行性能分析）
+    :param values: 表单（request.form）或 JSON 字典
+    :return: (选项, 错误信息)
+    """
+    if hasattr(values, 'getlist'):
+        target_langs = values.getlist('target_lang')
+        keep_original = values.get('keep_original', 'false').lower() == 'true'
+    else:
+        target_langs = values.get('target_lang') or values.get('target_langs')
+        keep_original = str(values.get('keep_original', 'false')).lower() == 'true'
+    model_name = values.get('model_name')
+    profile = str(values.get('profile', 'false')).lower() in ('true', '1')
+    try:
+        priority = int(values.get('priority', 0))
+    except (TypeError, ValueError):
+        return None, '优先级必须是整数'
+
+    # 检查模型是否有效
+    if model_name not in whisper_models.AVAILABLE_MODELS:
+        return None, f'不支持的模型: {model_name}'
+
+    return {
+        'target_langs': parse_target_langs(target_langs),
+        'keep_original': keep_original,
+        'model_name': model_name,
+        'priority': priority,
+        'profile': profile
+    }, None
+
+def save_upload(file, task_id):
+    """将上传的文件保存到以任务ID区分的临时路径，避免同名文件并发上传时互相覆盖"""
+    filename = secure_filename(file.filename)
+    # secure_filename 会去掉非ASCII字符，确保保留扩展名
+    ext = os.path.splitext(file.filename)[1].lower()
+    if not filename.lower().endswith(ext):
+        filename = f"{os.path.splitext(filename)[0] or 'upload'}{ext}"
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f'.upload_{task_id}_{filename}')
+    file.save(file_path)
+    return file_path, filename
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -127,23 +424,17 @@ def upload_file():
     if not file_type:
         return jsonify({'error': '不支持的文件格式'}), 400
 
+    # 获取翻译设置（可多选，也支持以逗号分隔）
+    options, error = parse_task_options(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+
     try:
         # 生成任务ID
-        task_id = str(int(time.time() * 1000))
+        task_id = generate_task_id()
 
         # 保存文件
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
-        # 获取翻译设置
-        target_lang = request.form.get('target_lang')
-        keep_original = request.form.get('keep_original', 'false').lower() == 'true'
-        model_name = request.form.get('model_name')
-
-        # 检查模型是否有效
-        if model_name not in genSrt.AVAILABLE_MODELS:
-            return jsonify({'error': f'不支持的模型: {model_name}'}), 400
+        file_path, filename = save_upload(file, task_id)
 
         # 添加任务到处理队列
         success, message = task_processor.add_task(
@@ -151,9 +442,8 @@ def upload_file():
             file_path=file_path,
             output_dir=app.config['UPLOAD_FOLDER'],
             file_type=file_type,
-            target_lang=target_lang,
-            keep_original=keep_original,
-            model_name=model_name
+            original_filename=filename,
+            **options
         )
 
         if not success:
@@ -171,5 +461,79 @@ def upload_file():
         logging.error(f"处理过程中出错: {str(e)}")
         return jsonify({'error': f'处理失败: {str(e)}'}), 500
 
+@app.route('/upload/bulk', methods=['POST'])
+def upload_bulk():
+    """一次上传多个文件，所有任务在同一个事务中创建"""
+    files = [file for file in request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({'error': '没有上传文件'}), 400
+
+    options, error = parse_task_options(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+
+    # 临时文件路径 -> 用户上传的文件名，返回结果中不暴露服务器路径
+    uploads, errors = {}, []
+    try:
+        for file in files:
+            if not get_file_type(file.filename):
+                errors.append({'file': file.filename, 'error': '不支持的文件格式'})
+                continue
+            file_path, filename = save_upload(file, generate_task_id())
+            uploads[file_path] = (file.filename, filename)
+        saved_paths = list(uploads)
+
+        success, message, tasks, add_errors = task_processor.add_tasks_bulk(
+            saved_paths, app.config['UPLOAD_FOLDER'], move=True,
+            original_filenames=[uploads[path][1] for path in saved_paths], **options
+        )
+        for item in tasks + add_errors:
+            item['file'] = uploads[item['file']][0]
+        # 登记失败的文件不会被移动，删除上传的临时文件
+        for path in saved_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if not success:
+            return jsonify({'error': message, 'errors': errors + add_errors}), 500
+        return jsonify({'message': message, 'tasks': tasks, 'errors': errors + add_errors})
+
+    except Exception as e:
+        logging.error(f"批量上传出错: {str(e)}")
+        return jsonify({'error': f'处理失败: {str(e)}'}), 500
+
+@app.route('/tasks/register', methods=['POST'])
+def register_tasks():
+    """
+    登记服务器本地（或挂载的共享存储）上的文件，无需通过 HTTP 上传
+    请求体为 JSON：{"paths": [...], "model_name": ..., "target_lang": [...], "keep_original": false,
+    "priority": 0, "move": false}，目录会被递归扫描；路径必须位于 ingest.allowed_roots 之内
+    """
+    data = request.get_json(silent=True) or {}
+    allowed_roots = ingest_config.get('allowed_roots') or []
+    if not allowed_roots:
+        return jsonify({'error': '未配置允许登记的目录（ingest.allowed_roots）'}), 403
+
+    paths = data.get('paths') or []
+    if not isinstance(paths, list) or not paths:
+        return jsonify({'error': '请提供要登记的文件或目录'}), 400
+    denied = [path for path in paths if not is_within(path, allowed_roots)]
+    if denied:
+        return jsonify({'error': '路径不在允许登记的目录中', 'paths': denied}), 403
+
+    options, error = parse_task_options(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    media_files, errors = collect_media_files(paths)
+    if not media_files:
+        return jsonify({'error': '没有找到支持的媒体文件', 'errors': errors}), 400
+
+    success, message, tasks, add_errors = task_processor.add_tasks_bulk(
+        media_files, app.config['UPLOAD_FOLDER'], move=bool(data.get('move', False)), **options
+    )
+    if not success:
+        return jsonify({'error': message, 'errors': errors + add_errors}), 500
+    return jsonify({'message': message, 'tasks': tasks, 'errors': errors + add_errors})
+
 if __name__ == '__main__':
     app.run(debug=False, port=5000,host="0.0.0.0") 
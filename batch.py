@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, List, Tuple
+from config_manager import ConfigManager
+from database import TERMINAL_STATUSES
+from ingest import collect_media_files
+from llm_usage import summarize
+from task_processor import TaskProcessor, parse_target_langs, STAGES, STAGE_EXTRACT, STAGE_ASR, STAGE_LLM
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='离线批量生成字幕：不启动 Web 服务，直接在本进程内运行提取、转录、纠正和翻译流程')
+    parser.add_argument('inputs', nargs='+', help='媒体文件或目录，目录会被递归扫描')
+    parser.add_argument('-o', '--output-dir', required=True,
+                        help='字幕输出目录，输入目录下的子目录结构会被保留')
+    parser.add_argument('--model', default='large-v3-turbo', help='Whisper 模型名称')
+    parser.add_argument('--target-lang', action='append', default=[],
+                        help='翻译目标语言，可重复指定或用逗号分隔')
+    parser.add_argument('--keep-original', action='store_true', help='翻译时保留原文（双语字幕）')
+    parser.add_argument('--extract-workers', type=int, help='音频提取线程数')
+    parser.add_argument('--asr-workers', type=int, help='语音识别线程数')
+    parser.add_argument('--llm-workers', type=int, help='字幕纠正与翻译线程数')
+    parser.add_argument('--db', help='任务数据库文件，默认为输出目录下的 batch.db；中断后重新运行会继续未完成的任务')
+    parser.add_argument('--report', help='JSON 报告路径，默认为输出目录下的 batch_report.json')
+    parser.add_argument('--force', action='store_true', help='即使输出文件已存在也重新处理')
+    return parser.parse_args()
+
+def plan_outputs(inputs: List[str], output_dir: str, target_langs: List[str]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    收集输入文件并确定各自的输出文件
+    输出文件名由输入文件相对于其所在输入目录的路径决定，重复运行时可据此判断是否已处理
+    :return: (条目列表 [{'input', 'outputs': {'subtitle': 路径, 语言: 路径}}], 错误列表)
+    """
+    entries = []
+    errors = []
+    for path in inputs:
+        media_files, path_errors = collect_media_files([path])
+        errors.extend(path_errors)
+        root = path if os.path.isdir(path) else os.path.dirname(path)
+        for media_file in media_files:
+            stem = os.path.splitext(os.path.relpath(media_file, root))[0]
+            outputs = {'subtitle': os.path.join(output_dir, f"{stem}.srt")}
+            for lang in target_langs:
+                outputs[lang] = os.path.join(output_dir, f"{stem}_{lang}.srt")
+            entries.append({'input': os.path.abspath(media_file), 'outputs': outputs})
+    return entries, errors
+
+def collect_outputs(processor: TaskProcessor, task_id: str, outputs: Dict[str, str]) -> List[str]:
+    """
+    将任务的最终字幕复制到确定的输出路径
+    :return: 已写入的输出文件
+    """
+    files = processor.db.get_task_files(task_id)
+    sources = {}
+    # 优先使用纠正后的字幕
+    for file_type in ('subtitle', 'subtitle_corrected'):
+        for file in files:
+            if file['file_type'] == file_type:
+                sources['subtitle'] = file['file_path']
+    for file in files:
+        if file['file_type'] == 'subtitle_translated' and file['lang']:
+            sources[file['lang']] = file['file_path']
+
+    written = []
+    for key, output_path in outputs.items():
+        source = sources.get(key)
+        if not source or not os.path.exists(source):
+            logging.warning(f"任务 {task_id} 缺少输出 {key}")
+            continue
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        shutil.copyfile(source, output_path)
+        written.append(output_path)
+    return written
+
+def stage_seconds(processor: TaskProcessor, task_id: str) -> Dict[str, float]:
+    """任务各阶段的实际耗时（秒），被中断后重新领取的阶段没有记录"""
+    timings = {}
+    for timing in processor.db.get_task_stage_timings(task_id):
+        timings[timing['stage']] = timings.get(timing['stage'], 0) + timing['seconds']
+    return timings
+
+def wait_for_tasks(processor: TaskProcessor, task_ids: List[str], stop, poll_interval: float = 2) -> Dict[str, Dict]:
+    """
+    等待任务全部结束
+    :param stop: 收到退出信号时置位的 threading.Event
+    :return: {任务ID: 最后的任务状态}
+    """
+    pending = set(task_ids)
+    results = {}
+    last_log = 0
+    while pending and not stop.is_set():
+        for task_id in list(pending):
+            task = processor.db.get_task(task_id)
+            if task is None or task['status'] in TERMINAL_STATUSES:
+                pending.discard(task_id)
+                results[task_id] = task
+        if time.time() - last_log >= 30:
+            last_log = time.time()
+            logging.info(f"已完成 {len(task_ids) - len(pending)}/{len(task_ids)} 个文件")
+        stop.wait(poll_interval)
+    for task_id in pending:
+        results[task_id] = processor.db.get_task(task_id)
+    return results
+
+def main():
+    args = parse_args()
+    target_langs = parse_target_langs([lang for value in args.target_lang for lang in value.split(',')])
+    output_dir = os.path.abspath(args.output_dir)
+    work_dir = os.path.join(output_dir, '.work')
+    os.makedirs(work_dir, exist_ok=True)
+    report_path = args.report or os.path.join(output_dir, 'batch_report.json')
+    started_at = datetime.now()
+
+    entries, errors = plan_outputs(args.inputs, output_dir, target_langs)
+    for error in errors:
+        logging.warning(f"跳过 {error['file']}: {error['error']}")
+    for entry in entries:
+        entry['skipped'] = not args.force and all(os.path.exists(path) for path in entry['outputs'].values())
+    todo = [entry for entry in entries if not entry['skipped']]
+    logging.info(f"共 {len(entries)} 个文件，{len(entries) - len(todo)} 个已有输出，待处理 {len(todo)} 个")
+
+    pool_sizes = {
+        stage: size for stage, size in [
+            (STAGE_EXTRACT, args.extract_workers),
+            (STAGE_ASR, args.asr_workers),
+            (STAGE_LLM, args.llm_workers)
+        ] if size is not None
+    }
+    processor = TaskProcessor(
+        num_workers=ConfigManager().get_translation_config().get('max_workers', 2),
+        run_workers=bool(todo),
+        pool_sizes=pool_sizes,
+        db_file=args.db or os.path.join(output_dir, 'batch.db')
+    )
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logging.info(f"收到信号 {signum}，停止等待，未完成的任务在下次运行时继续")
+        stop.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    # 上次运行中断时未完成的任务由本次的工作线程继续处理，不重复添加
+    resumed = {}
+    for task in processor.db.get_incomplete_tasks():
+        try:
+            file_path = json.loads(task['task_data'] or '{}').get('file_path')
+        except ValueError:
+            continue
+        if file_path:
+            resumed[file_path] = task['task_id']
+    new_entries = [entry for entry in todo if entry['input'] not in resumed]
+    for entry in todo:
+        entry['task_id'] = resumed.get(entry['input'])
+    if resumed:
+        logging.info(f"继续上次未完成的 {len(todo) - len(new_entries)} 个任务")
+
+    if new_entries:
+        success, message, tasks, add_errors = processor.add_tasks_bulk(
+            [entry['input'] for entry in new_entries], work_dir, target_langs=target_langs,
+            keep_original=args.keep_original, model_name=args.model, move=False
+        )
+        logging.info(message)
+        added = {task['file']: task['task_id'] for task in tasks}
+        for entry in new_entries:
+            entry['task_id'] = added.get(entry['input'])
+        errors.extend(add_errors)
+
+    task_ids = [entry['task_id'] for entry in todo if entry.get('task_id')]
+    results = wait_for_tasks(processor, task_ids, stop)
+    processor.shutdown()
+
+    error_messages = {error['file']: error['error'] for error in errors}
+    files = []
+    usage_rows = []
+    for entry in entries:
+        item = {'input': entry['input'], 'task_id': entry.get('task_id'), 'outputs': [], 'stage_seconds': {}}
+        if entry['skipped']:
+            item['status'] = 'skipped'
+            item['outputs'] = list(entry['outputs'].values())
+        elif not entry.get('task_id'):
+            item['status'] = 'error'
+            item['error'] = error_messages.get(entry['input'], '任务创建失败')
+        else:
+            task = results.get(entry['task_id']) or {}
+            item['status'] = task.get('status', 'error')
+            item['process_time'] = task.get('process_time')
+            item['stage_seconds'] = stage_seconds(processor, entry['task_id'])
+            usage = processor.db.get_task_llm_usage(entry['task_id'])
+            usage_rows.extend(usage)
+            item['llm_usage'] = summarize(usage)
+            if item['status'] == 'completed':
+                item['outputs'] = collect_outputs(processor, entry['task_id'], entry['outputs'])
+            elif task.get('error_message'):
+                item['error'] = task['error_message']
+        files.append(item)
+    processor.db.close()
+
+    summary = {}
+    for item in files:
+        summary[item['status']] = summary.get(item['status'], 0) + 1
+    stage_totals = {stage: round(sum(item['stage_seconds'].get(stage, 0) for item in files), 2) for stage in STAGES}
+    report = {
+        'started_at': started_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'wall_seconds': round((datetime.now() - started_at).total_seconds(), 2),
+        'options': {'model': args.model, 'target_langs': target_langs, 'keep_original': args.keep_original,
+                    'pool_sizes': processor.pool_sizes},
+        'summary': summary,
+        'stage_seconds': stage_totals,
+        # 各大模型处理步骤的请求数、token 数、耗时和费用
+        'llm_usage': summarize(usage_rows),
+        'files': files,
+        # 不支持或不存在的输入
+        'errors': [error for error in errors if error['file'] not in {entry['input'] for entry in entries}]
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logging.info(f"处理结果: {summary}，大模型费用 {report['llm_usage']['cost']}，报告已保存到 {report_path}")
+    return 0 if all(item['status'] in ('completed', 'skipped') for item in files) and not stop.is_set() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
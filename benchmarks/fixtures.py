@@ -0,0 +1,45 @@
+import random
+from typing import List
+
+# 生成字幕文本的词表（中文为主，混入少量英文和标点，覆盖场景切分中的语义分隔符）
+_WORDS = ['我们', '今天', '讨论', '一下', '这个', '问题', '模型', '数据', '训练', '结果', '其实', '那么',
+          '首先', '然后', '最后', '就是', '可以', '需要', '看到', '大家', 'GPU', 'API', 'Python', 'OK']
+_ENDINGS = ['。', '，', '？', '！', '...', '']
+
+def _timestamp(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    return '%02d:%02d:%02d,%03d' % (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
+
+def make_srt_blocks(line_count: int, seed: int = 0) -> List[str]:
+    """
+    生成确定的SRT字幕块，相同参数每次生成相同的内容
+    :param line_count: 字幕条数
+    :param seed: 随机种子
+    :return: 字幕块列表（不含块之间的空行）
+    """
+    rng = random.Random(seed)
+    blocks = []
+    position = 0.0
+    for index in range(1, line_count + 1):
+        # 偶尔出现较长的停顿，使场景检测的时间间隔条件生效
+        position += rng.choice([0.1, 0.2, 0.3, 0.5, 2.5])
+        duration = rng.uniform(1.0, 4.0)
+        text = ''.join(rng.choice(_WORDS) for _ in range(rng.randint(3, 12))) + rng.choice(_ENDINGS)
+        if rng.random() < 0.1:
+            text += '\n' + ''.join(rng.choice(_WORDS) for _ in range(rng.randint(2, 6)))
+        blocks.append(f"{index}\n{_timestamp(position)} --> {_timestamp(position + duration)}\n{text}")
+        position += duration
+    return blocks
+
+def make_srt(line_count: int, seed: int = 0) -> str:
+    """生成确定的SRT文件内容"""
+    return '\n\n'.join(make_srt_blocks(line_count, seed)) + '\n'
+
+def make_word_dict(entry_count: int, seed: int = 0) -> dict:
+    """生成确定的替换词典 {原文: 替换文}"""
+    rng = random.Random(seed)
+    entries = {}
+    while len(entries) < entry_count:
+        source = ''.join(rng.choice(_WORDS) for _ in range(rng.randint(1, 2)))
+        entries[source] = source.upper() + '*'
+    return entries
@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from benchmarks.fixtures import make_srt
+from benchmarks.stubs import install_ai_clients
+from benchmarks.mock_openai import add_server_arguments, server_from_args
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='大模型阶段的负载测试：用真实字幕文件经由 correct_srt / translate_srt 请求 OpenAI 兼容接口，'
+                    '统计吞吐量、延迟分位数和失败情况')
+    parser.add_argument('inputs', nargs='*', help='SRT 文件；不指定时使用 --synthetic 条合成字幕')
+    parser.add_argument('--synthetic', type=int, default=500, help='未指定输入文件时合成字幕的条数')
+    parser.add_argument('--stage', choices=['correct', 'translate', 'both'], default='both', help='测试的处理步骤')
+    parser.add_argument('--target-lang', default='英文', help='翻译目标语言')
+    parser.add_argument('--concurrency', type=int, default=5, help='每个文件的并发请求数（纠正和翻译的 max_workers）')
+    parser.add_argument('--files-parallel', type=int, default=1, help='同时处理的文件数')
+    parser.add_argument('--repeat', type=int, default=1, help='每个输入文件重复处理的次数')
+    parser.add_argument('--base-url', action='append',
+                        help='被测接口地址，可重复指定以测试多接口路由；不指定时在本进程内启动模拟服务')
+    parser.add_argument('--mock-endpoints', type=int, default=1, help='未指定 --base-url 时启动的模拟服务数')
+    parser.add_argument('--degraded-latency', help='第一个模拟服务使用的延迟分布（模拟变慢的接口）')
+    parser.add_argument('--no-hedge', action='store_true', help='多接口时不发送对冲请求')
+    parser.add_argument('--hedge-percentile', type=float, default=95, help='发送对冲请求的延迟分位数')
+    parser.add_argument('--api-key', default='mock', help='被测接口的 API Key')
+    parser.add_argument('--model', default='mock-model', help='请求中的模型名称')
+    parser.add_argument('--max-retries', type=int, default=2, help='openai 客户端的重试次数（429/5xx 时重试）')
+    parser.add_argument('--timeout', type=float, default=60, help='单个请求的超时时间（秒）')
+    parser.add_argument('--output', help='JSON 结果文件路径')
+    add_server_arguments(parser)
+    return parser.parse_args()
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩法计算分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class RequestRecorder:
+    """包装 AIService._create_completion，记录每个请求（含客户端重试）的耗时和结果"""
+
+    def __init__(self, service):
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+        create_completion = service._create_completion
+
+        def recorded(stage, messages):
+            start = time.perf_counter()
+            try:
+                response = create_completion(stage, messages)
+            except Exception as e:
+                self._add(stage, start, type(e).__name__, getattr(e, 'status_code', None))
+                raise
+            self._add(stage, start, None, None)
+            return response
+
+        service._create_completion = recorded
+
+    def _add(self, stage: str, start: float, error: Optional[str], status_code: Optional[int]):
+        with self._lock:
+            self.records.append({'stage': stage, 'seconds': time.perf_counter() - start,
+                                 'error': error, 'status_code': status_code})
+
+    def summary(self, stage: Optional[str] = None) -> Dict:
+        with self._lock:
+            records = [record for record in self.records if stage is None or record['stage'] == stage]
+        latencies = [record['seconds'] for record in records if not record['error']]
+        errors = {}
+        for record in records:
+            if record['error']:
+                key = f"{record['error']}({record['status_code']})" if record['status_code'] else record['error']
+                errors[key] = errors.get(key, 0) + 1
+
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            'requests': len(records),
+            'succeeded': len(latencies),
+            'failed': len(records) - len(latencies),
+            'errors': errors,
+            'p50_ms': ms(percentile(latencies, 50)),
+            'p90_ms': ms(percentile(latencies, 90)),
+            'p99_ms': ms(percentile(latencies, 99)),
+            'max_ms': ms(max(latencies) if latencies else None)
+        }
+
+def count_blocks(path: str) -> int:
+    with open(path, 'r', encoding='utf-8') as f:
+        return len([block for block in f.read().strip().split('\n\n') if block.strip()])
+
+def run_file(path: str, stages: List[str], target_lang: str, corrector, translator) -> Dict:
+    """依次运行纠正和翻译（翻译使用纠正后的字幕），失败时记录错误并停止该文件"""
+    result = {'input': path, 'lines': count_blocks(path), 'stages': {}}
+    current = path
+    for stage in stages:
+        start = time.perf_counter()
+        try:
+            if stage == 'correct':
+                current = corrector.correct_srt(current)
+            else:
+                current = translator.translate_srt(current, target_lang)
+            result['stages'][stage] = {'status': 'completed', 'seconds': round(time.perf_counter() - start, 3)}
+        except Exception as e:
+            result['stages'][stage] = {'status': 'failed', 'seconds': round(time.perf_counter() - start, 3),
+                                       'error': f"{type(e).__name__}: {e}"}
+            break
+    result['status'] = 'completed' if all(
+        item['status'] == 'completed' for item in result['stages'].values()) and \
+        len(result['stages']) == len(stages) else 'failed'
+    return result
+
+def fetch_server_stats(base_url: str) -> Optional[Dict]:
+    """读取模拟服务的 /stats，被测接口不是模拟服务时返回None"""
+    url = base_url.rstrip('/')
+    if url.endswith('/v1'):
+        url = url[:-3]
+    try:
+        with urllib.request.urlopen(url + '/stats', timeout=5) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+def main():
+    args = parse_args()
+    # 纠正和翻译按场景/批次输出日志，负载测试中只保留警告
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    from openai import OpenAI
+    from subtitle_corrector import SubtitleCorrector
+    from translator import Translator
+
+    servers = []
+    base_urls = args.base_url
+    if not base_urls:
+        for i in range(max(1, args.mock_endpoints)):
+            if i == 0 and args.degraded_latency:
+                server_args = argparse.Namespace(**{**vars(args), 'latency': args.degraded_latency})
+            else:
+                server_args = args
+            if args.seed is not None:
+                server_args = argparse.Namespace(**{**vars(server_args), 'seed': args.seed + i})
+            servers.append(server_from_args(server_args).start())
+        base_urls = [server.base_url for server in servers]
+
+    # 多接口时由路由切换接口，与应用中的默认设置相同，客户端不再对同一个接口重试
+    max_retries = args.max_retries if len(base_urls) == 1 else 0
+    clients = {
+        base_url: OpenAI(api_key=args.api_key, base_url=base_url, max_retries=max_retries, timeout=args.timeout)
+        for base_url in base_urls
+    }
+    service = install_ai_clients(clients, args.model, {
+        'hedge': not args.no_hedge,
+        'hedge_percentile': args.hedge_percentile,
+        'max_concurrent_requests': max(64, args.concurrency * args.files_parallel * 3)
+    })
+    recorder = RequestRecorder(service)
+
+    corrector = SubtitleCorrector()
+    translator = Translator()
+    corrector.max_workers = args.concurrency
+    translator.max_workers = args.concurrency
+    stages = ['correct', 'translate'] if args.stage == 'both' else [args.stage]
+
+    # 输出文件写在输入文件旁边，先复制到临时目录避免污染输入目录
+    work_dir = tempfile.mkdtemp()
+    try:
+        inputs = args.inputs
+        if not inputs:
+            synthetic = os.path.join(work_dir, f'synthetic_{args.synthetic}.srt')
+            with open(synthetic, 'w', encoding='utf-8') as f:
+                f.write(make_srt(args.synthetic))
+            inputs = [synthetic]
+        copies = []
+        for round_index in range(args.repeat):
+            for i, path in enumerate(inputs):
+                copy = os.path.join(work_dir, f'{round_index}_{i}_{os.path.basename(path)}')
+                shutil.copyfile(path, copy)
+                copies.append((path, copy))
+
+        start = time.perf_counter()
+        # 纠正和翻译过程中会打印每个请求的文本，运行期间不输出到终端
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                ThreadPoolExecutor(max_workers=args.files_parallel) as executor:
+            files = list(executor.map(
+                lambda item: {**run_file(item[1], stages, args.target_lang, corrector, translator), 'input': item[0]},
+                copies
+            ))
+        wall_seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    server_stats = {base_url: fetch_server_stats(base_url) for base_url in base_urls}
+    for server in servers:
+        server.stop()
+
+    overall = recorder.summary()
+    lines = sum(item['lines'] for item in files if item['status'] == 'completed')
+    report = {
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'options': {'stages': stages, 'concurrency': args.concurrency, 'files_parallel': args.files_parallel,
+                    'max_retries': max_retries, 'base_urls': args.base_url or ['embedded-mock'] * len(base_urls),
+                    'hedge': not args.no_hedge and len(base_urls) > 1,
+                    'latency': None if args.base_url else args.latency,
+                    'degraded_latency': None if args.base_url else args.degraded_latency,
+                    'rate_429': None if args.base_url else args.rate_429,
+                    'rate_5xx': None if args.base_url else args.rate_5xx},
+        'wall_seconds': round(wall_seconds, 3),
+        'requests_per_second': round(overall['requests'] / wall_seconds, 2) if wall_seconds else None,
+        'lines_per_second': round(lines / wall_seconds, 2) if wall_seconds else None,
+        'files_completed': sum(1 for item in files if item['status'] == 'completed'),
+        'files_failed': sum(1 for item in files if item['status'] != 'completed'),
+        'requests': overall,
+        'requests_by_stage': {stage: recorder.summary(stage) for stage in stages},
+        'endpoints': service.router.stats(),
+        'server_stats': server_stats,
+        'files': files
+    }
+
+    print(f"耗时 {report['wall_seconds']}s，请求 {overall['requests']} 个（失败 {overall['failed']}），"
+          f"{report['requests_per_second']} 请求/秒，{report['lines_per_second']} 条字幕/秒")
+    print(f"延迟 p50 {overall['p50_ms']}ms，p90 {overall['p90_ms']}ms，p99 {overall['p99_ms']}ms")
+    if overall['errors']:
+        print(f"请求错误: {overall['errors']}")
+    for base_url, stats in server_stats.items():
+        if stats:
+            print(f"服务端 {base_url}: 收到 {stats['requests']} 个请求，429 {stats['status_429']} 次，"
+                  f"5xx {stats['status_5xx']} 次，最大并发 {stats['max_in_flight']}")
+    if len(report['endpoints']) > 1:
+        for endpoint in report['endpoints']:
+            print(f"接口 {endpoint['name']}: 平均延迟 {endpoint['latency']}s，错误率 {endpoint['error_rate']}")
+    print(f"文件: 完成 {report['files_completed']}，失败 {report['files_failed']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0 if report['files_failed'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+from token_budget import estimate_tokens
+from benchmarks.stubs import parse_prompt
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    解析延迟分布
+    :param spec: fixed:<秒>、uniform:<最小>,<最大>、normal:<均值>,<标准差> 或 lognormal:<均值>,<标准差>
+                 （lognormal 的参数为延迟秒数的均值和标准差，而不是对数空间的参数）
+    :return: 以随机数生成器为参数、返回延迟秒数的函数
+    """
+    kind, _, values = spec.partition(':')
+    params = [float(value) for value in values.split(',') if value.strip()]
+    if kind == 'fixed' and len(params) == 1:
+        return lambda rng: params[0]
+    if kind == 'uniform' and len(params) == 2:
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == 'normal' and len(params) == 2:
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == 'lognormal' and len(params) == 2 and params[0] > 0:
+        import math
+        mean, std = params
+        sigma = math.sqrt(math.log(1 + (std / mean) ** 2))
+        mu = math.log(mean) - sigma ** 2 / 2
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"无法解析的延迟分布: {spec}")
+
+class MockOpenAIServer:
+    """
+    本地的 OpenAI 兼容对话接口（POST /v1/chat/completions），用于在不消耗 API 配额的情况下调整并发和批次参数
+    - 延迟 = 按分布抽样的首包延迟 + 输出token数 / tokens_per_second
+    - 按比例注入 429（带 Retry-After）和 5xx 错误
+    - echo 模式原样返回需要处理的文本；transform 模式逐行加上标记（翻译请求加上目标语言），行数保持不变
+    GET /stats 返回请求数、注入的错误数和最大并发数
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: str = 'fixed:0.2',
+                 tokens_per_second: float = 0, rate_429: float = 0, rate_5xx: float = 0,
+                 retry_after: float = 1, mode: str = 'echo', seed: Optional[int] = None):
+        """
+        :param port: 监听端口，0表示自动选择
+        :param latency: 延迟分布，格式见 parse_latency
+        :param tokens_per_second: 模拟的输出速度，0表示不按输出长度增加延迟
+        :param rate_429: 返回 429 的比例
+        :param rate_5xx: 返回 500/502/503 的比例
+        :param retry_after: 429 响应的 Retry-After（秒）
+        :param mode: echo 或 transform
+        :param seed: 随机种子，指定后延迟和错误注入可复现
+        """
+        if mode not in ('echo', 'transform'):
+            raise ValueError(f"不支持的响应模式: {mode}")
+        self.latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.mode = mode
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'completed': 0, 'status_429': 0, 'status_5xx': 0, 'in_flight': 0,
+                      'max_in_flight': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _respond_text(self, text: str, target_lang: Optional[str]) -> str:
+        if self.mode == 'echo':
+            return text
+        tag = f"[{target_lang}]" if target_lang else '[mock]'
+        return '\n'.join(f"{tag}{line}" for line in text.split('\n'))
+
+    def _draw(self):
+        """抽取本次请求的结果：(HTTP 状态码, 首包延迟)"""
+        with self._lock:
+            roll = self._rng.random()
+            delay = self.latency(self._rng)
+            status = 200
+            if roll < self.rate_429:
+                status = 429
+            elif roll < self.rate_429 + self.rate_5xx:
+                status = self._rng.choice([500, 502, 503])
+        return status, delay
+
+    def _complete(self, body: Dict):
+        """
+        处理一个对话请求
+        :return: (HTTP 状态码, 响应体, 额外的响应头)
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+        try:
+            status, delay = self._draw()
+            if status == 429:
+                with self._lock:
+                    self.stats['status_429'] += 1
+                time.sleep(min(delay, 0.05))
+                return 429, {'error': {'message': 'Rate limit exceeded (mock)', 'type': 'rate_limit_error'}}, \
+                    {'Retry-After': str(self.retry_after)}
+            if status != 200:
+                with self._lock:
+                    self.stats['status_5xx'] += 1
+                time.sleep(delay)
+                return status, {'error': {'message': 'Upstream error (mock)', 'type': 'server_error'}}, {}
+
+            messages = body.get('messages') or []
+            prompt = messages[-1]['content'] if messages else ''
+            text, target_lang = parse_prompt(prompt)
+            content = self._respond_text(text, target_lang)
+            prompt_tokens = sum(estimate_tokens(message.get('content') or '') for message in messages)
+            completion_tokens = estimate_tokens(content)
+            if self.tokens_per_second:
+                delay += completion_tokens / self.tokens_per_second
+            time.sleep(delay)
+            with self._lock:
+                self.stats['completed'] += 1
+                self.stats['prompt_tokens'] += prompt_tokens
+                self.stats['completion_tokens'] += completion_tokens
+            return 200, {
+                'id': f"chatcmpl-{uuid.uuid4().hex}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model') or 'mock',
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens}
+            }, {}
+        finally:
+            with self._lock:
+                self.stats['in_flight'] -= 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send_json(self, status: int, data: Dict, headers: Optional[Dict] = None):
+                payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length)
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': f'未实现的接口: {self.path}'}})
+                    return
+                try:
+                    body = json.loads(raw or b'{}')
+                except ValueError:
+                    self._send_json(400, {'error': {'message': '请求体不是有效的 JSON'}})
+                    return
+                if body.get('stream'):
+                    self._send_json(400, {'error': {'message': '不支持流式响应'}})
+                    return
+                self._send_json(*server._complete(body))
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/stats':
+                    with server._lock:
+                        self._send_json(200, dict(server.stats))
+                else:
+                    self._send_json(404, {'error': {'message': f'未实现的接口: {self.path}'}})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'MockOpenAIServer':
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"模拟大模型服务已启动: {self.base_url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    """模拟服务的命令行参数（负载测试脚本内嵌服务时复用）"""
+    parser.add_argument('--latency', default='fixed:0.2',
+                        help='延迟分布：fixed:<秒>、uniform:<最小>,<最大>、normal:<均值>,<标准差>、lognormal:<均值>,<标准差>')
+    parser.add_argument('--tokens-per-second', type=float, default=0, help='模拟的输出速度（token/秒），0表示不限')
+    parser.add_argument('--rate-429', type=float, default=0, help='返回 429 的比例')
+    parser.add_argument('--rate-5xx', type=float, default=0, help='返回 5xx 的比例')
+    parser.add_argument('--retry-after', type=float, default=1, help='429 响应的 Retry-After（秒）')
+    parser.add_argument('--mode', choices=['echo', 'transform'], default='echo', help='响应内容')
+    parser.add_argument('--seed', type=int, help='随机种子')
+
+def server_from_args(args, host: str = '127.0.0.1', port: int = 0) -> MockOpenAIServer:
+    return MockOpenAIServer(host=host, port=port, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                            rate_429=args.rate_429, rate_5xx=args.rate_5xx, retry_after=args.retry_after,
+                            mode=args.mode, seed=args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 OpenAI 兼容的模拟对话接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    server = server_from_args(args, host=args.host, port=args.port).start()
+    print(f"将 OPENAI_API_BASE 设置为 {server.base_url} 即可使用，按 Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
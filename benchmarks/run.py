@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.fixtures import make_srt, make_srt_blocks, make_word_dict
+from benchmarks.stubs import install_stub_ai, install_stub_asr
+
+DEFAULT_SIZES = [100, 1000, 10000]
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='离线性能基准：不访问网络、不需要 GPU，结果保存为 JSON 以便与基线比较')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='字幕条数')
+    parser.add_argument('--repeat', type=int, default=5, help='每项基准的重复次数，取中位数')
+    parser.add_argument('--filter', help='只运行名称包含该字符串的基准')
+    parser.add_argument('--e2e-tasks', type=int, default=20, help='端到端基准的任务数')
+    parser.add_argument('--output', help='结果文件路径，默认为 benchmarks/results/<时间>.json')
+    parser.add_argument('--baseline', help='与之比较的基线结果文件')
+    parser.add_argument('--max-regression', type=float, default=1.2,
+                        help='相对基线的最大耗时倍数，超过时返回非零退出码')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='耗时增加少于该值（毫秒）时不视为退化，避免极短基准的测量噪声')
+    return parser.parse_args()
+
+def measure(func: Callable, repeat: int, setup: Optional[Callable] = None) -> Dict:
+    """
+    重复执行并统计耗时
+    :param setup: 每次执行前调用，返回值作为 func 的参数，不计入耗时
+    """
+    samples = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        func(argument) if setup else func()
+        samples.append(time.perf_counter() - start)
+    return {
+        'median_seconds': statistics.median(samples),
+        'min_seconds': min(samples),
+        'max_seconds': max(samples),
+        'repeat': repeat
+    }
+
+def bench_parsing(sizes: List[int], repeat: int) -> List[Dict]:
+    from subtitle_formats import parse_srt
+    from eta_predictor import srt_statistics
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            content = make_srt(size)
+            path = os.path.join(temp_dir, f'{size}.srt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            results.append({'name': 'srt_parse', 'size': size, **measure(lambda: parse_srt(content), repeat)})
+            results.append({'name': 'srt_statistics', 'size': size, **measure(lambda: srt_statistics(path), repeat)})
+    return results
+
+def bench_scenes(sizes: List[int], repeat: int) -> List[Dict]:
+    from subtitle_corrector import SubtitleCorrector
+
+    corrector = SubtitleCorrector()
+    results = []
+    for size in sizes:
+        blocks = make_srt_blocks(size)
+        results.append({'name': 'detect_scenes', 'size': size,
+                        **measure(lambda: corrector._detect_scenes(blocks, 600), repeat)})
+        scenes = corrector._detect_scenes(blocks, 600)
+        # 合并会修改场景列表，每次使用副本
+        results.append({'name': 'merge_small_scenes', 'size': size,
+                        **measure(lambda copied: corrector._merge_small_scenes(copied, token_budget=600), repeat,
+                                  setup=lambda: [list(scene) for scene in scenes])})
+    return results
+
+def bench_translator(sizes: List[int], repeat: int) -> List[Dict]:
+    from translator import Translator
+
+    translator = Translator()
+    translator.word_dict = make_word_dict(200)
+    results = []
+    for size in sizes:
+        blocks = make_srt_blocks(size)
+        results.append({'name': 'prepare_batch', 'size': size,
+                        **measure(lambda: translator._prepare_batch(blocks, 0, blocks), repeat)})
+        texts = ['\n'.join(block.split('\n')[2:]) for block in blocks]
+        results.append({'name': 'apply_word_dict', 'size': size,
+                        **measure(lambda: [translator.apply_word_dict(text) for text in texts], repeat)})
+    return results
+
+def bench_database(sizes: List[int], repeat: int) -> List[Dict]:
+    from database import Database
+
+    results = []
+    for size in sizes:
+        def setup():
+            temp_dir = tempfile.mkdtemp()
+            db = Database(os.path.join(temp_dir, 'bench.db'))
+            task_ids = [f'task{i}' for i in range(max(1, size // 100))]
+            for task_id in task_ids:
+                db.add_task(task_id, f'{task_id}.mp3', f'{task_id}.mp3', 'audio', model_name='tiny')
+            return temp_dir, db, task_ids
+
+        def status_writes(context):
+            # 与处理流程相同的写入模式：大量进度更新，少量状态变化
+            temp_dir, db, task_ids = context
+            try:
+                for i in range(size):
+                    task_id = task_ids[i % len(task_ids)]
+                    if i % 50 == 0:
+                        db.update_task_status(task_id, 'processing', i % 100, '处理中')
+                    else:
+                        db.update_task_progress(task_id, 'processing', i % 100, f'进度 {i}')
+                db.flush()
+            finally:
+                db.close()
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+        results.append({'name': 'db_status_writes', 'size': size,
+                        **measure(status_writes, repeat, setup=setup)})
+    return results
+
+def bench_end_to_end(task_count: int, line_count: int = 200) -> List[Dict]:
+    """提交一批音频任务并等待全部完成，转录和大模型请求均为桩实现"""
+    import task_processor as tp
+
+    install_stub_asr(line_count)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        media_dir = os.path.join(temp_dir, 'media')
+        output_dir = os.path.join(temp_dir, 'output')
+        os.makedirs(media_dir)
+        os.makedirs(output_dir)
+        paths = []
+        for i in range(task_count):
+            path = os.path.join(media_dir, f'clip{i}.mp3')
+            with open(path, 'wb') as f:
+                f.write(b'\0')
+            paths.append(path)
+
+        processor = tp.TaskProcessor(num_workers=2, db_file=os.path.join(temp_dir, 'bench.db'))
+        start = time.perf_counter()
+        success, message, tasks, errors = processor.add_tasks_bulk(
+            paths, output_dir, target_langs=['英文'], model_name='tiny', move=False
+        )
+        pending = {task['task_id'] for task in tasks}
+        while pending:
+            for task_id in list(pending):
+                task = processor.db.get_task(task_id)
+                if task and task['status'] in tp.TERMINAL_STATUSES:
+                    pending.discard(task_id)
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        completed = sum(1 for task in tasks if processor.db.get_task(task['task_id'])['status'] == 'completed')
+        processor.shutdown()
+        processor.db.close()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return [{
+        'name': 'pipeline_end_to_end', 'size': task_count, 'lines_per_task': line_count,
+        'median_seconds': elapsed, 'min_seconds': elapsed, 'max_seconds': elapsed, 'repeat': 1,
+        'completed': completed, 'tasks_per_second': round(task_count / elapsed, 3) if elapsed else None
+    }]
+
+def compare(results: List[Dict], baseline: Dict, max_regression: float, min_delta_ms: float) -> List[str]:
+    """
+    与基线比较
+    :return: 超出允许倍数的基准说明
+    """
+    baseline_results = {(item['name'], item['size']): item for item in baseline.get('results', [])}
+    regressions = []
+    print(f"\n{'基准':<24}{'规模':>8}{'基线(ms)':>12}{'本次(ms)':>12}{'倍数':>8}")
+    for item in results:
+        base = baseline_results.get((item['name'], item['size']))
+        if not base or not base['median_seconds']:
+            continue
+        ratio = item['median_seconds'] / base['median_seconds']
+        item['baseline_ratio'] = round(ratio, 3)
+        print(f"{item['name']:<24}{item['size']:>8}{base['median_seconds'] * 1000:>12.2f}"
+              f"{item['median_seconds'] * 1000:>12.2f}{ratio:>8.2f}")
+        if ratio > max_regression and (item['median_seconds'] - base['median_seconds']) * 1000 >= min_delta_ms:
+            regressions.append(f"{item['name']}[{item['size']}] 耗时为基线的 {ratio:.2f} 倍")
+    return regressions
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    # 场景检测等函数会按条输出日志，基准中只保留警告
+    logging.disable(logging.INFO)
+    install_stub_ai()
+
+    suites = [
+        ('srt_parse srt_statistics', lambda: bench_parsing(args.sizes, args.repeat)),
+        ('detect_scenes merge_small_scenes', lambda: bench_scenes(args.sizes, args.repeat)),
+        ('prepare_batch apply_word_dict', lambda: bench_translator(args.sizes, args.repeat)),
+        ('db_status_writes', lambda: bench_database(args.sizes, args.repeat)),
+        ('pipeline_end_to_end', lambda: bench_end_to_end(args.e2e_tasks)),
+    ]
+    results = []
+    for names, run in suites:
+        if args.filter and args.filter not in names:
+            continue
+        for item in run():
+            if args.filter and args.filter not in item['name']:
+                continue
+            print(f"{item['name']:<24}{item['size']:>8}{item['median_seconds'] * 1000:>12.2f} ms")
+            results.append(item)
+
+    regressions = compare(results, baseline, args.max_regression, args.min_delta_ms) if baseline else []
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+    for regression in regressions:
+        print(f"性能退化: {regression}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
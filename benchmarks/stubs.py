@@ -0,0 +1,113 @@
+import os
+import re
+import time
+import types
+import threading
+from typing import Dict, Optional
+from benchmarks.fixtures import make_srt
+
+# 从提示词中取出需要处理的文本（与 AIService 中的提示词格式对应）
+_TEXT_PATTERN = re.compile(r'需要(?:纠正|翻译)的文本：\s*\n(.*?)\n\s*\n\s*请只返回', re.S)
+_TARGET_LANG_PATTERN = re.compile(r'请将以下文本翻译成(.+?)，')
+
+def parse_prompt(content: str):
+    """
+    解析 AIService 生成的提示词
+    :return: (需要处理的文本, 翻译目标语言；纠正请求为None)
+    """
+    match = _TEXT_PATTERN.search(content)
+    text = match.group(1).strip() if match else ''
+    lang_match = _TARGET_LANG_PATTERN.search(content)
+    return text, lang_match.group(1) if lang_match else None
+
+class _StubCompletions:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, messages, **kwargs):
+        """原样返回需要处理的文本，可模拟固定的请求延迟"""
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        content, _ = parse_prompt(messages[-1]['content'])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+class StubClient:
+    """替代 openai.OpenAI 的客户端，不访问网络"""
+
+    def __init__(self, latency: float = 0):
+        self.chat = types.SimpleNamespace(completions=_StubCompletions(latency))
+
+def install_ai_client(client, model: str = 'stub-model'):
+    """
+    将 AIService 单例替换为使用指定客户端的实例，提示词构建、延迟统计和指标记录仍走原有代码
+    :param client: 与 openai.OpenAI 接口相同的客户端
+    :return: 新的 AIService 实例
+    """
+    return install_ai_clients({'default': client}, model)
+
+def install_ai_clients(clients: Dict, model: str = 'stub-model', routing_config: Optional[Dict] = None):
+    """
+    将 AIService 单例替换为在多个客户端之间路由请求的实例
+    :param clients: {接口名称: 客户端}
+    :param routing_config: llm_routing 配置
+    :return: 新的 AIService 实例
+    """
+    from ai_service import AIService
+    from token_budget import LatencyTracker
+    from llm_router import Endpoint, LLMRouter
+
+    service = object.__new__(AIService)
+    service.router = LLMRouter([Endpoint(name, client) for name, client in clients.items()], routing_config)
+    # 纠正和翻译都使用指定的模型，不读取配置文件中各步骤的模型
+    service._stages = {stage: {'model': model, 'router': service.router, 'params': {}}
+                       for stage in ('correct', 'translate')}
+    service._stages_lock = threading.Lock()
+    service.pricing = {}
+    service.latency_tracker = LatencyTracker()
+    AIService._instance = service
+    return service
+
+def install_stub_ai(latency: float = 0) -> StubClient:
+    """
+    使用不访问网络的 StubClient 替换 AIService 单例
+    :param latency: 每个请求的模拟延迟（秒）
+    :return: 使用的 StubClient，可读取请求次数
+    """
+    client = StubClient(latency)
+    install_ai_client(client)
+    return client
+
+def install_stub_asr(line_count: int = 200, seconds_per_task: float = 0):
+    """
+    替换 genSrt 中的音频提取、时长探测、模型加载和转录，不需要 ffmpeg、whisper 和 GPU
+    转录结果为确定的合成字幕
+    :param line_count: 每个任务生成的字幕条数
+    :param seconds_per_task: 每次转录的模拟耗时（秒）
+    """
+    import genSrt
+
+    srt_content = make_srt(line_count)
+
+    def extract_audio(video_file, output_audio_file, cancel_token=None):
+        with open(output_audio_file, 'wb') as f:
+            f.write(b'\0')
+
+    def extract_subtitles(audio_file, output_dir, output_filename=None, cancel_token=None,
+                          progress_callback=None, **kwargs):
+        if seconds_per_task:
+            time.sleep(seconds_per_task)
+        if progress_callback:
+            progress_callback(1.0)
+        output_path = os.path.join(output_dir, output_filename or os.path.basename(audio_file) + '.srt')
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(srt_content)
+        return output_path
+
+    genSrt.extract_audio = extract_audio
+    genSrt.extract_subtitles = extract_subtitles
+    genSrt.probe_duration = lambda media_file: 60.0
+    genSrt.load_model = lambda model_name, device=None: object()
@@ -0,0 +1,67 @@
+import threading
+import logging
+from typing import Callable, List, Optional
+
+class TaskCancelled(Exception):
+    """任务已被取消"""
+
+class CancelToken:
+    """
+    任务取消令牌，在处理流程的各个环节之间共享
+    取消时依次执行注册的回调（如结束 ffmpeg 进程、取消线程池中尚未开始的请求），
+    长时间运行的循环通过 check() 在合适的边界处中止
+    """
+
+    def __init__(self, task_id: Optional[str] = None):
+        self.task_id = task_id
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """取消任务并执行所有回调"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        logging.info(f"任务 {self.task_id} 收到取消请求")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"执行取消回调失败: {str(e)}")
+
+    def check(self) -> None:
+        """已取消时抛出 TaskCancelled"""
+        if self._event.is_set():
+            raise TaskCancelled(f"任务 {self.task_id} 已取消")
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """注册取消回调，已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        """移除取消回调"""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+def cancel_futures(futures) -> Callable[[], None]:
+    """
+    生成取消回调：取消线程池中尚未开始执行的任务
+    正在执行的请求无法中断，会在完成后被丢弃
+    """
+    def callback():
+        cancelled = sum(1 for future in list(futures) if future.cancel())
+        if cancelled:
+            logging.info(f"已取消 {cancelled} 个尚未开始的请求")
+    return callback
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Web 进程在启动时导入的模块
+WEB_MODULES = ['flask', 'config_manager', 'metrics', 'whisper_models', 'task_processor', 'ingest',
+               'events', 'retention']
+
+# Web 进程不应导入的重量级模块（只在处理任务的进程中按需导入）
+HEAVY_MODULES = ['torch', 'whisper', 'numpy', 'openai']
+
+# 在全新的解释器中导入模块并报告耗时和已加载的重量级模块
+_PROBE = '''
+import sys, json, time
+start = time.perf_counter()
+for name in sys.argv[2:]:
+    __import__(name)
+elapsed = time.perf_counter() - start
+heavy = json.loads(sys.argv[1])
+print(json.dumps({
+    'seconds': elapsed,
+    'heavy': [name for name in heavy if name in sys.modules],
+    'module_count': len(sys.modules)
+}))
+'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='检查 Web 进程的导入耗时，并确认没有导入 torch、whisper 等重量级模块')
+    parser.add_argument('--budget-ms', type=float, default=500, help='导入耗时上限（毫秒），取多次测量的最小值比较')
+    parser.add_argument('--runs', type=int, default=3, help='测量次数')
+    parser.add_argument('--modules', nargs='+', default=WEB_MODULES, help='要检查的模块')
+    parser.add_argument('--verbose', action='store_true', help='超出预算时输出导入耗时最长的模块')
+    return parser.parse_args()
+
+def measure(modules):
+    """在子进程中导入模块，返回测量结果"""
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE, json.dumps(HEAVY_MODULES)] + modules,
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def slowest_imports(modules, limit=15):
+    """用 -X importtime 找出累计导入耗时最长的模块"""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', ';'.join(f'import {name}' for name in modules)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = [part.strip() for part in line[len('import time:'):].split('|')]
+        if parts[1].isdigit():
+            rows.append((int(parts[1]), parts[2]))
+    return sorted(rows, reverse=True)[:limit]
+
+def main():
+    args = parse_args()
+    results = [measure(args.modules) for _ in range(args.runs)]
+    best_ms = min(result['seconds'] for result in results) * 1000
+    heavy = sorted({name for result in results for name in result['heavy']})
+
+    print(f"导入耗时: {best_ms:.0f} ms（预算 {args.budget_ms:.0f} ms），已加载模块数: {results[0]['module_count']}")
+    failed = False
+    if heavy:
+        print(f"错误: 导入了重量级模块 {', '.join(heavy)}")
+        failed = True
+    if best_ms > args.budget_ms:
+        print("错误: 导入耗时超出预算")
+        failed = True
+    if failed and args.verbose:
+        for cumulative_us, name in slowest_imports(args.modules):
+            print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
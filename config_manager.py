@@ -1,7 +1,16 @@
 import json
 import os
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
+
+# 各大模型处理步骤的配置段，其他步骤（如以后的摘要）使用与步骤同名的配置段
+LLM_STAGE_SECTIONS = {
+    'correct': 'subtitle_correction',
+    'translate': 'translation'
+}
+
+# 可按步骤配置的生成参数，未配置的参数不传给接口（使用接口的默认值）
+LLM_GENERATION_PARAMS = ('max_tokens', 'temperature', 'top_p')
 
 class ConfigManager:
     _instance = None
@@ -87,6 +96,32 @@ class ConfigManager:
         """获取API基础URL"""
         return os.getenv('OPENAI_API_BASE') or self.get_config('api').get('openai_api_base')
 
+    def get_api_endpoints(self) -> List[Dict]:
+        """
+        获取大模型接口列表：api.endpoints 中的每一项为 {name, base_url, api_key, weight}，未填写 api_key 时使用默认密钥
+        未配置 endpoints 时只有 openai_api_base 一个接口
+        """
+        endpoints = self.get_config('api').get('endpoints') or []
+        if not endpoints:
+            return [{'name': 'default', 'base_url': self.get_api_base(), 'api_key': self.get_api_key(), 'weight': 1}]
+        return [{**endpoint, 'api_key': endpoint.get('api_key') or self.get_api_key()} for endpoint in endpoints]
+
+    def get_llm_stage_config(self, stage: str) -> Dict:
+        """
+        获取大模型处理步骤的模型、接口和生成参数
+        模型依次取该步骤配置段的 model、default_model，translation.default_model 和 api.default_model
+        :param stage: 处理步骤（correct / translate / ...）
+        :return: {'model', 'endpoints', 'params'}，endpoints 为 api.endpoints 中的接口名称，为空表示使用所有接口
+        """
+        section = self.get_config(LLM_STAGE_SECTIONS.get(stage, stage))
+        model = (section.get('model') or section.get('default_model') or
+                 self.get_translation_config().get('default_model') or self.get_config('api').get('default_model'))
+        return {
+            'model': model,
+            'endpoints': section.get('endpoints') or [],
+            'params': {key: section[key] for key in LLM_GENERATION_PARAMS if section.get(key) is not None}
+        }
+
     def get_word_dict_config(self) -> Dict:
         """获取词典配置"""
         return self.get_config('word_dict')
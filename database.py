@@ -1,19 +1,83 @@
 import sqlite3
 import os
 import json
+import zlib
+import uuid
+import time
+import atexit
 import logging
+import threading
 from datetime import datetime
 from typing import Optional, Dict, List, Tuple
+from metrics import SQLITE_WRITE_DURATION, timed
+
+# 终止状态，处于这些状态的任务不再被调度
+TERMINAL_STATUSES = ('completed', 'error', 'cancelled')
+TERMINAL_SQL = '(' + ', '.join(f"'{status}'" for status in TERMINAL_STATUSES) + ')'
+
+# 变化时需要递增状态版本号的列（租约续期等不影响任务可见状态的更新不会递增）
+VERSIONED_COLUMNS = ('status', 'progress', 'message', 'stage', 'stage_progress',
+                     'lease_owner', 'model_name', 'cancel_requested', 'priority')
+NEXT_STATUS_VERSION_SQL = '''
+    UPDATE tasks SET status_version = (SELECT COALESCE(MAX(status_version), 0) + 1 FROM tasks)
+    WHERE task_id = NEW.task_id;
+'''
+
+def _timed_write(func):
+    """记录写操作的耗时（按方法名区分）"""
+    return timed(SQLITE_WRITE_DURATION, operation=func.__name__)(func)
 
 class Database:
-    def __init__(self, db_file='tasks.db'):
+    def __init__(self, db_file='tasks.db', journal_mode: str = 'WAL', synchronous: str = 'NORMAL',
+                 flush_interval: float = 0.5):
+        """
+        :param db_file: 数据库文件
+        :param journal_mode: 日志模式，WAL 下读写互不阻塞；数据库位于网络文件系统时需使用 DELETE
+        :param synchronous: 同步级别，WAL 下 NORMAL 只在检查点时 fsync，断电最多丢失最近提交的事务
+        :param flush_interval: 进度更新的缓冲写入间隔（秒），为0时同步写入
+        """
         self.db_file = db_file
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.flush_interval = flush_interval
+        # 每个线程复用一个连接
+        self._local = threading.local()
+        # 待写入的进度更新 {任务ID: {列名: 值}}
+        self._pending: Dict[str, Dict] = {}
+        self._pending_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
         self.init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        """
+        获取当前线程的数据库连接，首次使用时创建
+        连接以 with 语句使用时，正常退出提交事务，异常时回滚
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA busy_timeout = 30000')
+            conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+            conn.execute('PRAGMA temp_store = MEMORY')
+            conn.execute('PRAGMA cache_size = -8000')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """写入缓冲的进度并关闭当前线程的连接"""
+        self.flush()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
     def init_db(self):
         """初始化数据库表"""
-        with sqlite3.connect(self.db_file) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
+            # 日志模式保存在数据库文件中，对所有连接生效
+            cursor.execute(f'PRAGMA journal_mode = {self.journal_mode}')
             
             # 创建任务表
             cursor.execute('''
@@ -32,7 +96,22 @@ class Database:
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     completed_at TIMESTAMP,
                     error_message TEXT,
-                    process_time REAL
+                    process_time REAL,
+                    priority INTEGER DEFAULT 0,
+                    media_duration REAL,
+                    expected_cost REAL,
+                    stage TEXT,
+                    task_data TEXT,
+                    stage_cost REAL,
+                    enqueued_at REAL,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    stage_started_at REAL,
+                    attempts INTEGER DEFAULT 0,
+                    cancel_requested INTEGER DEFAULT 0,
+                    stage_progress REAL,
+                    status_version INTEGER DEFAULT 0,
+                    profile INTEGER DEFAULT 0
                 )
             ''')
             
@@ -46,45 +125,223 @@ class Database:
                     stored_filename TEXT NOT NULL,
                     file_path TEXT NOT NULL,
                     is_temporary BOOLEAN DEFAULT 0,
+                    lang TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (task_id) REFERENCES tasks(task_id)
                 )
             ''')
+
+            # 创建检查点表，记录每个阶段完成后的产物及其校验值
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    task_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    artifact_path TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (task_id, name),
+                    FOREIGN KEY (task_id) REFERENCES tasks(task_id)
+                )
+            ''')
+
+            # 创建阶段耗时表，用于训练耗时预测模型
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stage_timings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    model_name TEXT,
+                    media_duration REAL,
+                    line_count INTEGER,
+                    token_count INTEGER,
+                    lang_count INTEGER,
+                    seconds REAL NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # 创建任务追踪表，每次阶段执行的所有 span 压缩后存为一行
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS task_traces (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL,
+                    spans BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # 创建大模型用量表，每次阶段执行按 (步骤, 模型) 汇总为一行，任务归档后保留用于统计费用
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS llm_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    requests INTEGER NOT NULL,
+                    errors INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    seconds REAL NOT NULL,
+                    cost REAL NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # 旧数据库补齐新增的列
+            self._add_missing_columns(cursor, 'tasks', {
+                'priority': 'INTEGER DEFAULT 0',
+                'media_duration': 'REAL',
+                'expected_cost': 'REAL',
+                'stage': 'TEXT',
+                'task_data': 'TEXT',
+                'stage_cost': 'REAL',
+                'enqueued_at': 'REAL',
+                'lease_owner': 'TEXT',
+                'lease_expires_at': 'REAL',
+                'stage_started_at': 'REAL',
+                'attempts': 'INTEGER DEFAULT 0',
+                'cancel_requested': 'INTEGER DEFAULT 0',
+                'stage_progress': 'REAL',
+                'status_version': 'INTEGER DEFAULT 0',
+                'profile': 'INTEGER DEFAULT 0'
+            })
+            self._add_missing_columns(cursor, 'files', {'lang': 'TEXT'})
+
+            # 索引（在补齐列之后创建，旧数据库升级时这些列才存在）
+            # 未结束任务的部分索引：查询条件需与索引的 WHERE 子句一致（status NOT IN 终止状态）才会被使用
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_tasks_incomplete_stage
+                ON tasks(stage, enqueued_at) WHERE status NOT IN {TERMINAL_SQL}
+            ''')
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_tasks_incomplete_created
+                ON tasks(created_at) WHERE status NOT IN {TERMINAL_SQL}
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_lease_owner ON tasks(lease_owner)')
+            # 任务列表按 (created_at, task_id) 倒序分页
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at, task_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_at, task_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_model_created ON tasks(model_name, created_at, task_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_task_id ON files(task_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_stage_timings_stage ON stage_timings(stage, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_traces_task_id ON task_traces(task_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_usage_task_id ON llm_usage(task_id)')
+
+            # 状态版本号：任务的可见状态每次变化时取全局最大版本号加一，
+            # 客户端和状态缓存据此只获取变化的任务（写操作由数据库串行化，版本号按提交顺序递增）
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_version ON tasks(status_version)')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_tasks_version_insert AFTER INSERT ON tasks
+                BEGIN
+                    {NEXT_STATUS_VERSION_SQL}
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_tasks_version_update
+                AFTER UPDATE OF {', '.join(VERSIONED_COLUMNS)} ON tasks
+                BEGIN
+                    {NEXT_STATUS_VERSION_SQL}
+                END
+            ''')
+
+            # 归档表：长期保留的已结束任务及其文件记录，不参与调度和查询
+            for table in ('tasks', 'files'):
+                cursor.execute(f'CREATE TABLE IF NOT EXISTS {table}_archive AS SELECT * FROM {table} WHERE 0')
+                self._add_missing_columns(cursor, f'{table}_archive', self._column_types(cursor, table))
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_archive_task_id ON files_archive(task_id)')
             
             conn.commit()
 
+    def _column_types(self, cursor, table: str) -> Dict[str, str]:
+        """表的列名及类型"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        return {row[1]: row[2] for row in cursor.fetchall()}
+
+    def _add_missing_columns(self, cursor, table: str, columns: Dict[str, str]):
+        """为已存在的表补齐缺失的列（用于旧版本数据库升级）"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, column_type in columns.items():
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
     def generate_stored_filename(self, original_filename: str) -> str:
-        """生成存储文件名，避免冲突"""
+        """生成存储文件名，附加随机后缀，同一秒内提交的同名文件也不会冲突"""
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         name, ext = os.path.splitext(original_filename)
-        return f"{name}_{timestamp}{ext}"
+        return f"{name}_{timestamp}_{uuid.uuid4().hex[:8]}{ext}"
 
+    @_timed_write
     def add_task(self, task_id: str, original_filename: str, stored_filename: str,
                 file_type: str, target_lang: Optional[str] = None,
-                keep_original: bool = False, model_name: str = 'large-v3') -> bool:
+                keep_original: bool = False, model_name: str = 'large-v3',
+                priority: int = 0, media_duration: Optional[float] = None,
+                expected_cost: Optional[float] = None) -> bool:
         """添加新任务"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO tasks (
                         task_id, original_filename, stored_filename, file_type,
-                        status, target_lang, keep_original, model_name
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        status, target_lang, keep_original, model_name,
+                        priority, media_duration, expected_cost
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (task_id, original_filename, stored_filename, file_type,
-                      'queued', target_lang, keep_original, model_name))
+                      'queued', target_lang, keep_original, model_name,
+                      priority, media_duration, expected_cost))
                 conn.commit()
                 return True
         except Exception as e:
             logging.error(f"添加任务失败: {str(e)}")
             return False
 
+    @_timed_write
+    def add_tasks_bulk(self, tasks: List[Dict], files: List[Dict]) -> bool:
+        """
+        在同一个事务中批量添加任务及其文件记录，任一记录失败时全部回滚
+        :param tasks: tasks 表的行（列名到值的映射），task_data 为字典时自动序列化
+        :param files: files 表的行（列名到值的映射）
+        :return: 是否添加成功
+        """
+        if not tasks:
+            return True
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                for table, rows in (('tasks', tasks), ('files', files)):
+                    if not rows:
+                        continue
+                    columns = list(rows[0].keys())
+                    values = [
+                        [json.dumps(row[column], ensure_ascii=False)
+                         if column == 'task_data' and isinstance(row[column], dict) else row[column]
+                         for column in columns]
+                        for row in rows
+                    ]
+                    cursor.executemany(f'''
+                        INSERT INTO {table} ({', '.join(columns)})
+                        VALUES ({', '.join('?' for _ in columns)})
+                    ''', values)
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"批量添加任务失败: {str(e)}")
+            return False
+
+    @_timed_write
     def update_task_status(self, task_id: str, status: str, progress: int,
                           message: str, error_message: Optional[str] = None,
-                          process_time: Optional[float] = None) -> bool:
-        """更新任务状态"""
+                          process_time: Optional[float] = None,
+                          lease_owner: Optional[str] = None) -> bool:
+        """
+        更新任务状态（同步写入，并丢弃该任务尚未写入的缓冲进度）
+        :param lease_owner: 若指定，仅当任务仍由该持有者租用时才更新，防止租约被回收后覆盖新持有者的状态
+        :return: 是否更新成功
+        """
+        self._discard_pending(task_id)
         try:
-            with sqlite3.connect(self.db_file) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 update_fields = {
                     'status': status,
@@ -96,6 +353,11 @@ class Database:
                 if status == 'completed':
                     update_fields['completed_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                     update_fields['process_time'] = process_time
+
+                if status in TERMINAL_STATUSES:
+                    # 任务结束后释放租约
+                    update_fields['lease_owner'] = None
+                    update_fields['lease_expires_at'] = None
                 
                 if error_message:
                     update_fields['error_message'] = error_message
@@ -104,27 +366,97 @@ class Database:
                 values = list(update_fields.values())
                 values.append(task_id)
 
-                cursor.execute(f'''
+                sql = f'''
                     UPDATE tasks
                     SET {set_clause}
                     WHERE task_id = ?
-                ''', values)
+                '''
+                if lease_owner:
+                    sql += ' AND lease_owner = ?'
+                    values.append(lease_owner)
+                cursor.execute(sql, values)
                 
                 conn.commit()
-                return True
+                return cursor.rowcount > 0 if lease_owner else True
         except Exception as e:
             logging.error(f"更新任务状态失败: {str(e)}")
             return False
 
+    def update_task_progress(self, task_id: str, status: str, progress: int, message: str) -> bool:
+        """
+        更新任务的处理进度（缓冲写入）
+        同一任务在写入间隔内的多次更新合并为一次，终止状态等关键变更请使用 update_task_status
+        """
+        if not self.flush_interval:
+            return self.update_task_status(task_id, status, progress, message)
+        self._buffer(task_id, {
+            'status': status,
+            'progress': progress,
+            'message': message,
+            'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        return True
+
+    def _buffer(self, task_id: str, fields: Dict) -> None:
+        with self._pending_lock:
+            self._pending.setdefault(task_id, {}).update(fields)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _discard_pending(self, task_id: str) -> None:
+        """丢弃任务尚未写入的缓冲进度（被随后的同步更新取代）"""
+        with self._pending_lock:
+            self._pending.pop(task_id, None)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    @_timed_write
+    def flush(self) -> int:
+        """
+        将缓冲的进度更新在一个事务中写入
+        写入期间持有缓冲锁，保证同步更新不会被较早的缓冲进度覆盖；已结束的任务不会被更新
+        :return: 写入的任务数
+        """
+        with self._pending_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            try:
+                with self._connect() as conn:
+                    cursor = conn.cursor()
+                    for task_id, fields in pending.items():
+                        set_clause = ', '.join(f"{column} = ?" for column in fields)
+                        cursor.execute(f'''
+                            UPDATE tasks SET {set_clause}
+                            WHERE task_id = ? AND status NOT IN {TERMINAL_SQL}
+                        ''', list(fields.values()) + [task_id])
+                    conn.commit()
+                return len(pending)
+            except Exception as e:
+                logging.error(f"写入缓冲的任务进度失败: {str(e)}")
+                return 0
+
+    def _with_pending(self, task: Dict) -> Dict:
+        """合并尚未写入的缓冲进度"""
+        with self._pending_lock:
+            fields = self._pending.get(task['task_id'])
+            if fields and task['status'] not in TERMINAL_STATUSES:
+                task.update(fields)
+        return task
+
     def get_task(self, task_id: str) -> Optional[Dict]:
         """获取任务信息"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM tasks WHERE task_id = ?', (task_id,))
                 row = cursor.fetchone()
-                return dict(row) if row else None
+                return self._with_pending(dict(row)) if row else None
         except Exception as e:
             logging.error(f"获取任务信息失败: {str(e)}")
             return None
@@ -132,44 +464,166 @@ class Database:
     def get_all_tasks(self, limit: int = 100) -> List[Dict]:
         """获取所有任务信息"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT * FROM tasks 
                     ORDER BY created_at DESC 
                     LIMIT ?
                 ''', (limit,))
-                return [dict(row) for row in cursor.fetchall()]
+                return [self._with_pending(dict(row)) for row in cursor.fetchall()]
         except Exception as e:
             logging.error(f"获取所有任务失败: {str(e)}")
             return []
 
+    def get_status_version(self) -> int:
+        """当前最大的状态版本号"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COALESCE(MAX(status_version), 0) FROM tasks')
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logging.error(f"获取状态版本号失败: {str(e)}")
+            return 0
+
+    def get_tasks_since(self, version: int, limit: Optional[int] = None) -> List[Dict]:
+        """获取状态版本号大于 version 的任务，按版本号升序"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM tasks WHERE status_version > ?
+                    ORDER BY status_version ASC LIMIT ?
+                ''', (version, limit if limit is not None else -1))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"获取变化的任务失败: {str(e)}")
+            return []
+
+    def _task_filters(self, statuses: Optional[List[str]] = None, model_name: Optional[str] = None,
+                      lang: Optional[str] = None, created_after: Optional[str] = None,
+                      created_before: Optional[str] = None) -> Tuple[List[str], List]:
+        """生成任务查询的过滤条件和参数"""
+        conditions, params = [], []
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            params.extend(statuses)
+        if model_name:
+            conditions.append('model_name = ?')
+            params.append(model_name)
+        if lang:
+            # target_lang 以逗号分隔保存多个目标语言
+            conditions.append("(',' || target_lang || ',') LIKE ?")
+            params.append(f'%,{lang},%')
+        if created_after:
+            conditions.append('created_at >= ?')
+            params.append(created_after)
+        if created_before:
+            conditions.append('created_at < ?')
+            params.append(created_before)
+        return conditions, params
+
+    def query_tasks(self, limit: int = 50, cursor: Optional[Tuple[str, str]] = None,
+                    **filters) -> Tuple[List[Dict], Optional[Tuple[str, str]]]:
+        """
+        按创建时间倒序分页查询任务（键集分页，翻页开销与页码无关）
+        :param limit: 每页任务数
+        :param cursor: 上一页最后一个任务的 (created_at, task_id)，为None时从最新的任务开始
+        :param filters: statuses、model_name、lang、created_after、created_before
+        :return: (任务列表, 下一页的游标；没有下一页时为None)
+        """
+        try:
+            conditions, params = self._task_filters(**filters)
+            if cursor:
+                conditions.append('(created_at, task_id) < (?, ?)')
+                params.extend(cursor)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            with self._connect() as conn:
+                cur = conn.cursor()
+                # 多取一条用于判断是否还有下一页
+                cur.execute(f'''
+                    SELECT * FROM tasks {where}
+                    ORDER BY created_at DESC, task_id DESC
+                    LIMIT ?
+                ''', params + [limit + 1])
+                tasks = [self._with_pending(dict(row)) for row in cur.fetchall()]
+            next_cursor = None
+            if len(tasks) > limit:
+                tasks = tasks[:limit]
+                next_cursor = (tasks[-1]['created_at'], tasks[-1]['task_id'])
+            return tasks, next_cursor
+        except Exception as e:
+            logging.error(f"查询任务失败: {str(e)}")
+            return [], None
+
+    def count_tasks_by_status(self, **filters) -> Dict[str, int]:
+        """
+        按状态统计满足过滤条件的任务数
+        :param filters: 同 query_tasks（不含 statuses，各状态分别计数）
+        """
+        try:
+            conditions, params = self._task_filters(**filters)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(f'SELECT status, COUNT(*) FROM tasks {where} GROUP BY status', params)
+                return {row[0]: row[1] for row in cur.fetchall()}
+        except Exception as e:
+            logging.error(f"统计任务失败: {str(e)}")
+            return {}
+
+    @_timed_write
     def add_file(self, file_id: str, task_id: str, file_type: str,
                 original_filename: str, stored_filename: str,
-                file_path: str, is_temporary: bool = False) -> bool:
+                file_path: str, is_temporary: bool = False,
+                lang: Optional[str] = None) -> bool:
         """添加文件记录"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO files (
                         file_id, task_id, file_type, original_filename,
-                        stored_filename, file_path, is_temporary
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                        stored_filename, file_path, is_temporary, lang
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (file_id, task_id, file_type, original_filename,
-                      stored_filename, file_path, is_temporary))
+                      stored_filename, file_path, is_temporary, lang))
                 conn.commit()
                 return True
         except Exception as e:
             logging.error(f"添加文件记录失败: {str(e)}")
             return False
 
+    @_timed_write
+    def add_files(self, files: List[Dict]) -> bool:
+        """
+        在同一个事务中批量添加文件记录
+        :param files: 与 add_file 参数相同的字典列表
+        """
+        if not files:
+            return True
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO files (
+                        file_id, task_id, file_type, original_filename,
+                        stored_filename, file_path, is_temporary, lang
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(f['file_id'], f['task_id'], f['file_type'], f['original_filename'],
+                       f['stored_filename'], f['file_path'], f.get('is_temporary', False), f.get('lang'))
+                      for f in files])
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"批量添加文件记录失败: {str(e)}")
+            return False
+
     def get_task_files(self, task_id: str) -> List[Dict]:
         """获取任务相关的所有文件"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM files WHERE task_id = ?', (task_id,))
                 return [dict(row) for row in cursor.fetchall()]
@@ -177,11 +631,113 @@ class Database:
             logging.error(f"获取任务文件失败: {str(e)}")
             return []
 
+    def get_files_with_task_state(self) -> List[Dict]:
+        """
+        获取所有文件记录（包括已归档任务的）及所属任务的状态，用于清理过期文件
+        :return: 文件记录，附带 task_status、finished_at（任务完成时间，未完成时为最后更新时间）和 archived
+        """
+        select = '''
+            SELECT f.file_id, f.task_id, f.file_type, f.file_path, f.is_temporary, f.created_at,
+                   t.status AS task_status, COALESCE(t.completed_at, t.updated_at) AS finished_at,
+                   {archived} AS archived
+            FROM {files} f LEFT JOIN {tasks} t ON t.task_id = f.task_id
+        '''
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(select.format(archived=0, files='files', tasks='tasks') + ' UNION ALL ' +
+                               select.format(archived=1, files='files_archive', tasks='tasks_archive'))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"获取文件记录失败: {str(e)}")
+            return []
+
+    def get_referenced_file_paths(self) -> List[str]:
+        """获取数据库中引用的所有文件路径（文件记录、归档文件记录、检查点产物及未结束任务的中间文件）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT file_path FROM files
+                    UNION SELECT file_path FROM files_archive
+                    UNION SELECT artifact_path FROM checkpoints
+                    UNION SELECT json_extract(task_data, '$.' || key.value)
+                    FROM tasks, json_each('["file_path", "audio_file", "srt_file"]') AS key
+                    WHERE status NOT IN {TERMINAL_SQL} AND json_valid(task_data)
+                ''')
+                return [row[0] for row in cursor.fetchall() if row[0]]
+        except Exception as e:
+            logging.error(f"获取文件引用失败: {str(e)}")
+            return []
+
+    @_timed_write
+    def delete_file_records(self, file_ids: List[str]) -> bool:
+        """删除文件记录（文件本身由调用方删除）"""
+        if not file_ids:
+            return True
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('DELETE FROM files WHERE file_id = ?', [(file_id,) for file_id in file_ids])
+                cursor.executemany('DELETE FROM files_archive WHERE file_id = ?',
+                                   [(file_id,) for file_id in file_ids])
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"删除文件记录失败: {str(e)}")
+            return False
+
+    @_timed_write
+    def archive_tasks(self, finished_before: str, batch_size: int = 1000) -> int:
+        """
+        将早于指定时间结束的任务及其文件记录移入归档表，并删除其检查点和追踪记录
+        :param finished_before: 任务完成时间（未完成时为最后更新时间）早于该时间才归档，格式 YYYY-MM-DD HH:MM:SS
+        :param batch_size: 本次最多归档的任务数
+        :return: 归档的任务数
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT task_id FROM tasks
+                    WHERE status IN {TERMINAL_SQL} AND COALESCE(completed_at, updated_at) < ?
+                    LIMIT ?
+                ''', (finished_before, batch_size))
+                task_ids = [(row[0],) for row in cursor.fetchall()]
+                if not task_ids:
+                    return 0
+                for table in ('tasks', 'files'):
+                    columns = ', '.join(self._column_types(cursor, f'{table}_archive'))
+                    cursor.executemany(f'''
+                        INSERT INTO {table}_archive ({columns})
+                        SELECT {columns} FROM {table} WHERE task_id = ?
+                    ''', task_ids)
+                for table in ('checkpoints', 'task_traces', 'files', 'tasks'):
+                    cursor.executemany(f'DELETE FROM {table} WHERE task_id = ?', task_ids)
+                conn.commit()
+                return len(task_ids)
+        except Exception as e:
+            logging.error(f"归档任务失败: {str(e)}")
+            return 0
+
+    def vacuum(self) -> bool:
+        """整理数据库文件，回收已删除记录占用的空间，并截断 WAL 文件"""
+        self.flush()
+        try:
+            conn = self._connect()
+            conn.execute('PRAGMA optimize')
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            return True
+        except Exception as e:
+            logging.error(f"整理数据库失败: {str(e)}")
+            return False
+
+    @_timed_write
     def cleanup_temporary_files(self, task_id: str) -> List[str]:
         """获取并删除任务的临时文件"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT file_path FROM files 
@@ -201,18 +757,475 @@ class Database:
             logging.error(f"清理临时文件失败: {str(e)}")
             return []
 
+    @_timed_write
+    def save_checkpoint(self, task_id: str, name: str, artifact_path: str, sha256: str) -> bool:
+        """
+        记录阶段检查点，同名检查点会被覆盖
+        :param name: 检查点名称，如 extract、asr、correct、translate:<语言>
+        :param artifact_path: 阶段产物路径
+        :param sha256: 产物的 SHA-256 校验值
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO checkpoints (task_id, name, artifact_path, sha256)
+                    VALUES (?, ?, ?, ?)
+                ''', (task_id, name, artifact_path, sha256))
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"记录检查点失败: {str(e)}")
+            return False
+
+    def get_checkpoints(self, task_id: str) -> Dict[str, Dict]:
+        """
+        获取任务的所有检查点
+        :return: {检查点名称: {'artifact_path': 路径, 'sha256': 校验值}}
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT name, artifact_path, sha256 FROM checkpoints WHERE task_id = ?
+                ''', (task_id,))
+                return {
+                    row['name']: {'artifact_path': row['artifact_path'], 'sha256': row['sha256']}
+                    for row in cursor.fetchall()
+                }
+        except Exception as e:
+            logging.error(f"获取检查点失败: {str(e)}")
+            return {}
+
+    @_timed_write
+    def update_stage_progress(self, task_id: str, stage_progress: float) -> bool:
+        """更新任务在当前阶段内的完成比例（0-1），启用缓冲写入时与进度更新合并"""
+        if self.flush_interval:
+            self._buffer(task_id, {'stage_progress': stage_progress})
+            return True
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('UPDATE tasks SET stage_progress = ? WHERE task_id = ?',
+                               (stage_progress, task_id))
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"更新阶段进度失败: {str(e)}")
+            return False
+
+    @_timed_write
+    def update_task_model(self, task_id: str, model_name: str) -> bool:
+        """更新任务使用的模型（内存不足时改用已加载的替代模型）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('UPDATE tasks SET model_name = ? WHERE task_id = ?',
+                               (model_name, task_id))
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"更新任务模型失败: {str(e)}")
+            return False
+
+    def set_task_profile(self, task_id: str, enabled: bool) -> bool:
+        """
+        设置未结束任务的性能分析标记，从下一个开始的阶段起生效
+        :return: 任务存在且未结束时返回True
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'UPDATE tasks SET profile = ? WHERE task_id = ? AND status NOT IN {TERMINAL_SQL}',
+                               (1 if enabled else 0, task_id))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logging.error(f"设置任务性能分析标记失败: {str(e)}")
+            return False
+
+    @_timed_write
+    def add_stage_timing(self, task_id: str, stage: str, seconds: float, model_name: Optional[str] = None,
+                         media_duration: Optional[float] = None, line_count: Optional[int] = None,
+                         token_count: Optional[int] = None, lang_count: Optional[int] = None) -> bool:
+        """记录任务某个阶段的实际耗时及相关特征"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO stage_timings (
+                        task_id, stage, model_name, media_duration,
+                        line_count, token_count, lang_count, seconds
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (task_id, stage, model_name, media_duration,
+                      line_count, token_count, lang_count, seconds))
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"记录阶段耗时失败: {str(e)}")
+            return False
+
+    def get_stage_timings(self, stage: str, limit: int = 200) -> List[Dict]:
+        """获取某个阶段最近的耗时记录"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM stage_timings WHERE stage = ?
+                    ORDER BY id DESC LIMIT ?
+                ''', (stage, limit))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"获取阶段耗时失败: {str(e)}")
+            return []
+
+    def get_task_stage_timings(self, task_id: str) -> List[Dict]:
+        """获取任务各阶段的耗时记录"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM stage_timings WHERE task_id = ? ORDER BY id', (task_id,))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"获取任务阶段耗时失败: {str(e)}")
+            return []
+
+    @_timed_write
+    def add_task_trace(self, task_id: str, spans: List[List]) -> bool:
+        """
+        保存任务一次阶段执行的追踪记录
+        :param spans: [[id, 父id, 名称, 开始, 结束, 属性]]
+        """
+        try:
+            data = zlib.compress(json.dumps(spans, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('INSERT INTO task_traces (task_id, spans) VALUES (?, ?)', (task_id, data))
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"保存任务追踪记录失败: {str(e)}")
+            return False
+
+    def get_task_trace(self, task_id: str) -> List[Dict]:
+        """
+        获取任务的所有 span，按开始时间排序
+        :return: [{'id', 'parent_id', 'name', 'start', 'end', 'attrs'}]
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT spans FROM task_traces WHERE task_id = ? ORDER BY id', (task_id,))
+                spans = []
+                for row in cursor.fetchall():
+                    for span_id, parent_id, name, start, end, attrs in json.loads(zlib.decompress(row['spans'])):
+                        spans.append({'id': span_id, 'parent_id': parent_id, 'name': name,
+                                      'start': start, 'end': end, 'attrs': attrs})
+                spans.sort(key=lambda span: span['start'])
+                return spans
+        except Exception as e:
+            logging.error(f"获取任务追踪记录失败: {str(e)}")
+            return []
+
+    def add_llm_usage(self, task_id: str, usage: List[Dict]) -> bool:
+        """
+        保存任务一次阶段执行的大模型用量
+        :param usage: [{'stage', 'model', 'requests', 'errors', 'prompt_tokens', 'completion_tokens', 'seconds', 'cost'}]
+        """
+        if not usage:
+            return True
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO llm_usage (
+                        task_id, stage, model, requests, errors,
+                        prompt_tokens, completion_tokens, seconds, cost
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(task_id, item['stage'], item['model'], item['requests'], item['errors'],
+                       item['prompt_tokens'], item['completion_tokens'], item['seconds'], item['cost'])
+                      for item in usage])
+                conn.commit()
+                return True
+        except Exception as e:
+            logging.error(f"保存大模型用量失败: {str(e)}")
+            return False
+
+    def get_task_llm_usage(self, task_id: str) -> List[Dict]:
+        """获取任务按 (步骤, 模型) 汇总的大模型用量，包含重试的阶段执行"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT stage, model, SUM(requests) AS requests, SUM(errors) AS errors,
+                           SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens,
+                           SUM(seconds) AS seconds, SUM(cost) AS cost
+                    FROM llm_usage WHERE task_id = ?
+                    GROUP BY stage, model ORDER BY MIN(id)
+                ''', (task_id,))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"获取大模型用量失败: {str(e)}")
+            return []
+
     def get_incomplete_tasks(self) -> List[Dict]:
         """获取所有未完成的任务"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
+                cursor.execute(f'''
                     SELECT * FROM tasks 
-                    WHERE status NOT IN ('completed', 'error')
+                    WHERE status NOT IN {TERMINAL_SQL}
                     ORDER BY created_at ASC 
                 ''')
                 return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
             logging.error(f"获取未完成任务失败: {str(e)}")
-            return [] 
\ No newline at end of file
+            return []
+
+    @_timed_write
+    def enqueue_stage(self, task_id: str, stage: str, task_data: Dict, stage_cost: float,
+                      progress: int, message: str, lease_owner: Optional[str] = None,
+                      status: str = 'queued') -> bool:
+        """
+        将任务放入指定阶段的队列（tasks 表即为持久化队列）
+        :param task_data: 任务在阶段间传递的数据，以JSON保存
+        :param stage_cost: 该阶段的预计耗时，用于调度
+        :param lease_owner: 若指定，仅当任务仍由该持有者租用时才更新，防止租约被回收后重复推进
+        :param status: 入队后的状态，'paused' 表示被高优先级任务抢占，恢复前不会被领取
+        :return: 是否更新成功
+        """
+        self._discard_pending(task_id)
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                sql = '''
+                    UPDATE tasks
+                    SET stage = ?, task_data = ?, stage_cost = ?, enqueued_at = ?,
+                        status = ?, progress = ?, message = ?,
+                        lease_owner = NULL, lease_expires_at = NULL, stage_started_at = NULL,
+                        stage_progress = NULL, attempts = 0, updated_at = ?
+                    WHERE task_id = ?
+                '''
+                values = [stage, json.dumps(task_data, ensure_ascii=False), stage_cost, time.time(),
+                          status, progress, message, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                          task_id]
+                if lease_owner:
+                    sql += ' AND lease_owner = ?'
+                    values.append(lease_owner)
+                cursor.execute(sql, values)
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logging.error(f"任务入队失败: {str(e)}")
+            return False
+
+    @_timed_write
+    def claim_task(self, stage: str, lease_owner: str, lease_seconds: float,
+                   choose, max_attempts: int = 3, order_by: str = 'enqueued_at ASC',
+                   order_params: Tuple = (), window: int = 1000) -> Optional[Dict]:
+        """
+        原子地领取指定阶段的一个任务
+        可领取的任务包括排队中的任务，以及租约已过期（持有者进程已退出）的任务
+        :param choose: 从候选任务列表中选出要执行的任务的函数，返回None表示没有可执行的任务
+        :param max_attempts: 同一阶段的最大尝试次数，超过后任务标记为错误
+        :param order_by: 候选任务的排序表达式（与调度策略一致，由调度器生成），只有排在前 window 个的任务交给 choose
+        :param order_params: order_by 中的参数
+        :param window: 交给 choose 的候选任务数
+        :return: 领取到的任务（包含 task_data 解析后的字段），没有可领取的任务时返回None
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            # 立即获取写锁，保证多个进程之间领取操作互斥
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(f'''
+                SELECT * FROM tasks
+                WHERE stage = ? AND status NOT IN {TERMINAL_SQL} AND status != 'paused'
+                  AND (lease_owner IS NULL OR lease_expires_at < ?)
+                ORDER BY {order_by}
+                LIMIT ?
+            ''', (stage, now, *order_params, window))
+            candidates = [dict(row) for row in cursor.fetchall()]
+
+            task = None
+            while candidates and task is None:
+                candidate = choose(candidates, now)
+                if candidate is None:
+                    break
+                candidates.remove(candidate)
+                if candidate['lease_owner'] and candidate['attempts'] >= max_attempts:
+                    # 多次在处理中途丢失租约（如进程崩溃），不再重试
+                    cursor.execute('''
+                        UPDATE tasks
+                        SET status = 'error', message = ?, error_message = ?,
+                            lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                        WHERE task_id = ?
+                    ''', ('处理失败: 多次中断后放弃', '超过最大尝试次数',
+                          datetime.now().strftime('%Y-%m-%d %H:%M:%S'), candidate['task_id']))
+                    continue
+                task = candidate
+
+            if task:
+                cursor.execute('''
+                    UPDATE tasks
+                    SET lease_owner = ?, lease_expires_at = ?, stage_started_at = ?,
+                        stage_progress = NULL, attempts = attempts + 1
+                    WHERE task_id = ?
+                ''', (lease_owner, now + lease_seconds, now, task['task_id']))
+                if task['lease_owner']:
+                    logging.warning(f"任务 {task['task_id']} 的租约已过期（原持有者 {task['lease_owner']}），重新领取")
+            cursor.execute('COMMIT')
+
+            if task:
+                task.update(json.loads(task['task_data'] or '{}'))
+            return task
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"领取任务失败: {str(e)}")
+            return None
+
+    @_timed_write
+    def renew_leases(self, lease_owner: str, lease_seconds: float) -> int:
+        """
+        续期持有者的所有租约（心跳）
+        :return: 续期的任务数
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    UPDATE tasks SET lease_expires_at = ?
+                    WHERE lease_owner = ? AND status NOT IN {TERMINAL_SQL}
+                ''', (time.time() + lease_seconds, lease_owner))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logging.error(f"续期租约失败: {str(e)}")
+            return 0
+
+    @_timed_write
+    def release_lease(self, task_id: str, lease_owner: str) -> bool:
+        """释放任务的租约"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE tasks SET lease_owner = NULL, lease_expires_at = NULL
+                    WHERE task_id = ? AND lease_owner = ?
+                ''', (task_id, lease_owner))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logging.error(f"释放租约失败: {str(e)}")
+            return False
+
+    def get_stage_tasks(self, stage: str) -> Tuple[List[Dict], List[Dict]]:
+        """
+        获取指定阶段的任务
+        :return: (等待中的任务列表, 处理中的任务列表)
+        """
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT task_id, priority, stage_cost, enqueued_at, lease_owner,
+                           lease_expires_at, stage_started_at
+                    FROM tasks
+                    WHERE stage = ? AND status NOT IN {TERMINAL_SQL} AND status != 'paused'
+                ''', (stage,))
+                rows = [dict(row) for row in cursor.fetchall()]
+            waiting = [row for row in rows
+                       if row['lease_owner'] is None or row['lease_expires_at'] < now]
+            running = [row for row in rows
+                       if row['lease_owner'] is not None and row['lease_expires_at'] >= now]
+            return waiting, running
+        except Exception as e:
+            logging.error(f"获取阶段任务失败: {str(e)}")
+            return [], []
+
+    @_timed_write
+    def request_cancel(self, task_id: str) -> Optional[str]:
+        """
+        请求取消任务
+        未被领取的任务直接标记为已取消；处理中的任务设置取消标记，由持有租约的工作进程中止
+        :return: 'cancelled'（已取消）、'cancelling'（等待工作进程中止），任务不存在或已结束时返回None
+        """
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    UPDATE tasks SET cancel_requested = 1
+                    WHERE task_id = ? AND status NOT IN {TERMINAL_SQL}
+                ''', (task_id,))
+                if cursor.rowcount == 0:
+                    return None
+                cursor.execute('''
+                    UPDATE tasks
+                    SET status = 'cancelled', message = '任务已取消', updated_at = ?
+                    WHERE task_id = ? AND (lease_owner IS NULL OR lease_expires_at < ?)
+                ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), task_id, now))
+                cancelled = cursor.rowcount > 0
+                conn.commit()
+                return 'cancelled' if cancelled else 'cancelling'
+        except Exception as e:
+            logging.error(f"取消任务失败: {str(e)}")
+            return None
+
+    def get_cancel_requests(self, lease_owner: str) -> List[str]:
+        """获取持有者正在处理、且已被请求取消的任务"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT task_id FROM tasks
+                    WHERE lease_owner = ? AND cancel_requested = 1 AND status NOT IN {TERMINAL_SQL}
+                ''', (lease_owner,))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"获取取消请求失败: {str(e)}")
+            return []
+
+    def has_urgent_tasks(self, min_priority: int, exclude_task_id: Optional[str] = None) -> bool:
+        """是否存在未结束且未暂停的高优先级任务"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT 1 FROM tasks
+                    WHERE priority >= ? AND status NOT IN {TERMINAL_SQL} AND status != 'paused'
+                      AND task_id != ?
+                    LIMIT 1
+                ''', (min_priority, exclude_task_id or ''))
+                return cursor.fetchone() is not None
+        except Exception as e:
+            logging.error(f"查询高优先级任务失败: {str(e)}")
+            return False
+
+    @_timed_write
+    def resume_paused_tasks(self, min_priority: int) -> int:
+        """
+        没有高优先级任务时恢复被抢占暂停的任务
+        :return: 恢复的任务数
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    UPDATE tasks
+                    SET status = 'queued', message = '已恢复，等待处理...', updated_at = ?
+                    WHERE status = 'paused' AND NOT EXISTS (
+                        SELECT 1 FROM tasks AS urgent
+                        WHERE urgent.priority >= ? AND urgent.status NOT IN {TERMINAL_SQL}
+                          AND urgent.status != 'paused'
+                    )
+                ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), min_priority))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logging.error(f"恢复暂停任务失败: {str(e)}")
+            return 0
+
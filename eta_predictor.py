@@ -0,0 +1,169 @@
+import re
+import time
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+from token_budget import estimate_tokens
+
+# 语音识别的耗时与模型强相关，按模型分别拟合；其他阶段不区分模型
+PER_MODEL_STAGES = ('asr',)
+
+# 以token数为特征的阶段（字幕纠正与翻译），其余阶段以媒体时长为特征
+TOKEN_STAGES = ('llm',)
+
+_TIMESTAMP_LINE = re.compile(r'^\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}')
+
+def srt_statistics(srt_file: str) -> Tuple[int, int]:
+    """
+    统计字幕文件的字幕条数和文本token数
+    :return: (字幕条数, token数)
+    """
+    line_count = 0
+    token_count = 0
+    with open(srt_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.isdigit():
+                continue
+            if _TIMESTAMP_LINE.match(line):
+                line_count += 1
+            else:
+                token_count += estimate_tokens(line)
+    return line_count, token_count
+
+class LinearModel:
+    """单特征线性回归 seconds = intercept + slope * x，斜率不小于0"""
+
+    def __init__(self, intercept: float, slope: float, samples: int):
+        self.intercept = intercept
+        self.slope = slope
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, points: List[Tuple[float, float]]) -> 'LinearModel':
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        cov_xy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+        if var_x > 0 and cov_xy > 0:
+            slope = cov_xy / var_x
+            return cls(mean_y - slope * mean_x, slope, n)
+        if mean_x > 0:
+            # 特征没有变化或样本噪声导致负相关时，按比例估算（过原点）
+            return cls(0.0, mean_y / mean_x, n)
+        return cls(mean_y, 0.0, n)
+
+    def predict(self, x: float) -> float:
+        return max(0.0, self.intercept + self.slope * x)
+
+class EtaPredictor:
+    """
+    根据历史阶段耗时预测各阶段的处理时间
+    - 音频提取：与媒体时长线性相关
+    - 语音识别：与媒体时长线性相关，按模型分别拟合
+    - 字幕纠正与翻译：与字幕token数 ×（1 + 目标语言数）线性相关，
+      尚未生成字幕时按历史的每秒媒体token数估算
+    模型定期从数据库重新拟合，样本不足时返回None，由调用方使用配置的估算值
+    """
+
+    def __init__(self, db, stages: List[str], refit_interval: float = 300, min_samples: int = 5,
+                 history_limit: int = 200):
+        """
+        :param db: Database 实例
+        :param stages: 需要预测的处理阶段
+        :param refit_interval: 重新拟合的间隔（秒）
+        :param min_samples: 拟合所需的最少样本数
+        :param history_limit: 每个阶段参与拟合的最近样本数
+        """
+        self.db = db
+        self.stages = list(stages)
+        self.refit_interval = refit_interval
+        self.min_samples = min_samples
+        self.history_limit = history_limit
+        self._models: Dict[Tuple[str, Optional[str]], LinearModel] = {}
+        self._tokens_per_second: Optional[float] = None
+        self._fitted_at = 0.0
+        self._lock = threading.Lock()
+
+    def _feature(self, stage: str, sample: Dict) -> Optional[float]:
+        if stage in TOKEN_STAGES:
+            if sample.get('token_count') is None:
+                return None
+            return sample['token_count'] * (1 + (sample.get('lang_count') or 0))
+        return sample.get('media_duration')
+
+    def refit(self) -> None:
+        """从数据库读取最近的耗时记录并重新拟合"""
+        models = {}
+        token_ratios = []
+        for stage in self.stages:
+            groups: Dict[Optional[str], List[Tuple[float, float]]] = {}
+            for sample in self.db.get_stage_timings(stage, self.history_limit):
+                feature = self._feature(stage, sample)
+                if feature is None:
+                    continue
+                model_name = sample['model_name'] if stage in PER_MODEL_STAGES else None
+                groups.setdefault(model_name, []).append((feature, sample['seconds']))
+                if stage in TOKEN_STAGES and sample.get('media_duration'):
+                    token_ratios.append((sample['token_count'], sample['media_duration']))
+            for model_name, points in groups.items():
+                if len(points) >= self.min_samples:
+                    models[(stage, model_name)] = LinearModel.fit(points)
+
+        with self._lock:
+            self._models = models
+            if len(token_ratios) >= self.min_samples:
+                self._tokens_per_second = (sum(tokens for tokens, _ in token_ratios) /
+                                           sum(duration for _, duration in token_ratios))
+            self._fitted_at = time.time()
+        logging.info(f"耗时预测模型已更新: {len(models)} 个模型")
+
+    def _maybe_refit(self) -> None:
+        if time.time() - self._fitted_at >= self.refit_interval:
+            self.refit()
+
+    def record(self, task_id: str, stage: str, seconds: float, **features) -> None:
+        """
+        记录阶段的实际耗时
+        :param features: model_name、media_duration、line_count、token_count、lang_count
+        """
+        self.db.add_stage_timing(task_id, stage, seconds, **features)
+
+    def predict(self, stage: str, model_name: Optional[str] = None, media_duration: Optional[float] = None,
+                token_count: Optional[int] = None, lang_count: int = 0) -> Optional[float]:
+        """
+        预测阶段耗时（秒）
+        :return: 预测值，没有足够的历史数据时返回None
+        """
+        self._maybe_refit()
+        with self._lock:
+            model = self._models.get((stage, model_name if stage in PER_MODEL_STAGES else None))
+            tokens_per_second = self._tokens_per_second
+        if model is None:
+            return None
+
+        if stage in TOKEN_STAGES and token_count is None:
+            if not tokens_per_second or media_duration is None:
+                return None
+            token_count = media_duration * tokens_per_second
+        feature = self._feature(stage, {
+            'media_duration': media_duration,
+            'token_count': token_count,
+            'lang_count': lang_count
+        })
+        if feature is None:
+            return None
+        return round(model.predict(feature), 1)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取已拟合模型的参数"""
+        with self._lock:
+            return {
+                f'{stage}:{model_name}' if model_name else stage: {
+                    'intercept': round(model.intercept, 3),
+                    'slope': round(model.slope, 6),
+                    'samples': model.samples
+                }
+                for (stage, model_name), model in self._models.items()
+            }
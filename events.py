@@ -0,0 +1,260 @@
+import json
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlsplit, parse_qs
+from task_processor import public_task_view
+
+# 推送给订阅者的队列摘要字段
+QUEUE_SUMMARY_KEYS = ('active_tasks', 'queued_tasks', 'max_tasks', 'backlog_exceeded')
+
+# 判断任务视图是否变化的字段（预计剩余时间随时间变化，不参与比较）
+TASK_SIGNATURE_KEYS = ('status', 'progress', 'message', 'stage', 'stage_progress',
+                       'queue_position', 'estimated_start_time', 'model_name')
+
+def format_event(event: str, data: Dict) -> bytes:
+    """生成一条 Server-Sent Events 消息"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f'event: {event}\ndata: {payload}\n\n'.encode('utf-8')
+
+class _Subscriber:
+    def __init__(self, task_ids: Optional[Set[str]], max_pending: int):
+        # 为None时接收所有任务的变化
+        self.task_ids = task_ids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.closed = False
+
+    def wants(self, task_id: str) -> bool:
+        return self.task_ids is None or task_id in self.task_ids
+
+class EventStream:
+    """
+    以 Server-Sent Events 推送任务状态、阶段进度和排队位置的变化
+    所有订阅连接由一个 asyncio 事件循环处理，空闲连接只占用一个套接字，不占用线程；
+    另有一个线程按状态版本号（见 StatusCache）检测变化并生成事件。
+    在独立端口上提供 GET /events?tasks=<任务ID,...>，不指定 tasks 参数时推送所有任务的变化
+    """
+
+    def __init__(self, processor, host: str = '0.0.0.0', port: int = 5001, poll_interval: float = 0.5,
+                 heartbeat_interval: float = 15, max_subscribers: int = 1000, max_pending: int = 1000):
+        """
+        :param processor: TaskProcessor 实例
+        :param host: 监听地址
+        :param port: 监听端口
+        :param poll_interval: 检测状态变化的间隔（秒）
+        :param heartbeat_interval: 没有事件时发送心跳注释的间隔（秒），用于穿过代理的空闲超时并发现断开的连接
+        :param max_subscribers: 最大订阅连接数
+        :param max_pending: 单个订阅者积压的最大事件数，超过后断开该连接（客户端会自动重连）
+        """
+        self.processor = processor
+        self.host = host
+        self.port = port
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_subscribers = max_subscribers
+        self.max_pending = max_pending
+        self._subscribers: Set[_Subscriber] = set()
+        self._version = processor.status_cache.version
+        self._signatures: Dict[str, tuple] = {}
+        self._queue_summary: Optional[Dict] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._start_error: Optional[Exception] = None
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _task_view(self, task_id: str) -> Optional[Dict]:
+        task = self.processor.get_status(task_id)
+        if task is None:
+            return None
+        return public_task_view(task)
+
+    def _queue_view(self) -> Dict:
+        info = self.processor.get_queue_info()
+        return {key: info[key] for key in QUEUE_SUMMARY_KEYS}
+
+    def _collect_events(self) -> List[tuple]:
+        """
+        检测状态变化并生成事件
+        :return: [(任务ID或None, 消息)]，任务ID为None的是队列摘要
+        """
+        version, changed = self.processor.status_cache.changes_since(self._version)
+        if version == self._version:
+            return []
+        self._version = version
+
+        # 变化的任务，加上订阅者关注的未结束任务（其他任务的变化可能改变其排队位置）
+        task_ids = {task['task_id'] for task in changed}
+        for subscriber in list(self._subscribers):
+            if subscriber.task_ids:
+                task_ids |= subscriber.task_ids
+
+        if len(self._signatures) > 10000:
+            self._signatures.clear()
+        events = []
+        for task_id in task_ids:
+            view = self._task_view(task_id)
+            if view is None:
+                continue
+            signature = tuple(view.get(key) for key in TASK_SIGNATURE_KEYS)
+            if self._signatures.get(task_id) == signature:
+                continue
+            self._signatures[task_id] = signature
+            events.append((task_id, format_event('task', view)))
+
+        queue_summary = self._queue_view()
+        if queue_summary != self._queue_summary:
+            self._queue_summary = queue_summary
+            events.append((None, format_event('queue', queue_summary)))
+        return events
+
+    def _dispatch(self, events: List[tuple]) -> None:
+        """在事件循环中将事件放入各订阅者的队列"""
+        for subscriber in list(self._subscribers):
+            for task_id, message in events:
+                if task_id is not None and not subscriber.wants(task_id):
+                    continue
+                try:
+                    subscriber.queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    logging.warning("事件订阅者积压过多，断开连接")
+                    subscriber.closed = True
+                    self._subscribers.discard(subscriber)
+                    break
+
+    def _poll(self):
+        while not self._stop_event.wait(self.poll_interval):
+            if not self._subscribers:
+                # 没有订阅者时只跟进版本号
+                self._version = self.processor.status_cache.version
+                continue
+            try:
+                events = self._collect_events()
+                if events:
+                    self._loop.call_soon_threadsafe(self._dispatch, events)
+            except Exception as e:
+                logging.error(f"生成状态事件失败: {str(e)}")
+
+    def _initial_events(self, task_ids: Optional[Set[str]]) -> List[bytes]:
+        """新订阅者的初始状态"""
+        messages = [format_event('queue', self._queue_view())]
+        for task_id in sorted(task_ids or []):
+            view = self._task_view(task_id)
+            if view is not None:
+                messages.append(format_event('task', view))
+        return messages
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriber = None
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            # 忽略请求头
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if len(request_line) < 2 or request_line[0] != 'GET' or urlsplit(request_line[1]).path != '/events':
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            if len(self._subscribers) >= self.max_subscribers:
+                writer.write(b'HTTP/1.1 503 Service Unavailable\r\nRetry-After: 10\r\n'
+                             b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+
+            # 指定 tasks 时只推送这些任务（为空时只推送队列摘要），未指定时推送所有任务
+            query = parse_qs(urlsplit(request_line[1]).query, keep_blank_values=True)
+            task_ids = None
+            if 'tasks' in query:
+                task_ids = {task_id.strip() for value in query['tasks'] for task_id in value.split(',')
+                            if task_id.strip()}
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/event-stream; charset=utf-8\r\n'
+                         b'Cache-Control: no-cache\r\n'
+                         b'Access-Control-Allow-Origin: *\r\n'
+                         b'Connection: keep-alive\r\n\r\n'
+                         b'retry: 3000\n\n')
+            subscriber = _Subscriber(task_ids, self.max_pending)
+            self._subscribers.add(subscriber)
+            for message in await asyncio.get_running_loop().run_in_executor(
+                    None, self._initial_events, task_ids):
+                writer.write(message)
+            await writer.drain()
+
+            while not subscriber.closed:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    message = b': ping\n\n'
+                writer.write(message)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logging.error(f"事件连接出错: {str(e)}")
+        finally:
+            if subscriber is not None:
+                self._subscribers.discard(subscriber)
+            writer.close()
+
+    def _run_loop(self, started: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+        except Exception as e:
+            # 如端口已被其他 Web 进程占用
+            self._start_error = e
+            self._loop.close()
+            return
+        finally:
+            started.set()
+        self._loop.run_forever()
+
+    def start(self, timeout: float = 10) -> bool:
+        """
+        在后台线程中启动事件服务
+        :param timeout: 等待监听端口的最长时间（秒）
+        :return: 是否启动成功；失败时页面退回轮询
+        """
+        started = threading.Event()
+        loop_thread = threading.Thread(target=self._run_loop, args=(started,), daemon=True)
+        loop_thread.start()
+        if not started.wait(timeout):
+            logging.error(f"状态事件服务启动超时（{timeout}秒），改用轮询")
+            return False
+        if self._start_error:
+            logging.error(f"状态事件服务启动失败: {str(self._start_error)}，改用轮询")
+            return False
+        poll_thread = threading.Thread(target=self._poll, daemon=True)
+        poll_thread.start()
+        self._threads = [loop_thread, poll_thread]
+        logging.info(f"状态事件服务已启动: http://{self.host}:{self.port}/events")
+        return True
+
+    def stop(self):
+        """停止事件服务"""
+        self._stop_event.set()
+        if self._server:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+def create_event_stream(processor, config: Dict) -> Optional[EventStream]:
+    """
+    根据 events 配置创建事件服务
+    :return: 未启用时返回None
+    """
+    if not config.get('enabled', True):
+        return None
+    return EventStream(
+        processor,
+        host=config.get('host', '0.0.0.0'),
+        port=config.get('port', 5001),
+        poll_interval=config.get('poll_interval', 0.5),
+        heartbeat_interval=config.get('heartbeat_interval', 15),
+        max_subscribers=config.get('max_subscribers', 1000),
+        max_pending=config.get('max_pending', 1000)
+    )
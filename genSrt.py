@@ -1,30 +1,147 @@
 import ffmpeg
-import whisper
 import logging
-import whisper.utils
 import os
+import sys
+import types
+import threading
+import time
+import tracing
+from metrics import WHISPER_MODEL_LOAD, WHISPER_REALTIME_FACTOR
+# 模型元数据在 whisper_models 中定义，这里保留原有的导入路径
+from whisper_models import AVAILABLE_MODELS, get_available_models, estimate_transcribe_seconds
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-# 支持的模型列表
-AVAILABLE_MODELS = {
-    'tiny': {'name': 'tiny', 'description': '最小模型，速度最快，准确度较低'},
-    'base': {'name': 'base', 'description': '基础模型，速度较快，准确度一般'},
-    'small': {'name': 'small', 'description': '小型模型，速度和准确度均衡'},
-    'medium': {'name': 'medium', 'description': '中型模型，准确度较高，速度较慢'},
-    'large-v3': {'name': 'large-v3', 'description': '大型模型，最高准确度，速度最慢'},
-    'large-v3-turbo': {'name': 'large-v3-turbo', 'description': '大型模型，在保留准确度的同时，速度更快'},
-}
-
-def get_available_models():
-    """获取可用的模型列表"""
-    return AVAILABLE_MODELS
-
-def extract_audio(video_file, output_audio_file):
-    # 使用 ffmpeg 提取音频
-    ffmpeg.input(video_file).output(output_audio_file, q=0, map='a').run()
-
-def extract_subtitles(audio_file, output_dir, language='Chinese', output_format="srt", device=None, model_name='large-v3-turbo', output_filename=None):
+def probe_duration(media_file) -> float:
+    """
+    使用 ffprobe 获取媒体文件时长
+    :return: 时长（秒），无法获取时返回None
+    """
+    try:
+        info = ffmpeg.probe(media_file)
+        return float(info['format']['duration'])
+    except Exception as e:
+        logging.warning(f"获取媒体时长失败 {media_file}: {e}")
+        return None
+
+def load_model(model_name, device=None):
+    """
+    加载 whisper 模型
+    :param model_name: 模型名称
+    :param device: 设备（cuda/cpu）
+    :return: 模型实例
+    """
+    if model_name not in AVAILABLE_MODELS:
+        raise ValueError(f"不支持的模型: {model_name}")
+
+    # whisper 依赖 torch，只在实际加载模型的进程中导入
+    import whisper
+
+    logging.info(f"正在加载模型 {model_name}...")
+    load_start = time.time()
+    with tracing.span('model_load', model=model_name):
+        model = whisper.load_model(model_name, download_root='./models', device=device)
+    WHISPER_MODEL_LOAD.labels(model=model_name).observe(time.time() - load_start)
+    logging.info("模型加载成功。")
+    return model
+
+def device_memory(device=None):
+    """
+    获取加载模型的设备当前的可用内存和总内存，反映同一台机器上所有进程的占用
+    GPU 使用 torch.cuda.mem_get_info，CPU 读取 /proc/meminfo 中的 MemAvailable
+    :param device: 设备（cuda/cpu），未指定时有 GPU 则使用 GPU
+    :return: (可用内存MB, 总内存MB)，无法获取时返回None
+    """
+    try:
+        if device != 'cpu':
+            import torch
+            if torch.cuda.is_available():
+                free, total = torch.cuda.mem_get_info(torch.device(device or 'cuda'))
+                return free / 1024 / 1024, total / 1024 / 1024
+            if device:
+                return None
+        meminfo = {}
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                meminfo[key] = int(value.split()[0])
+        return meminfo['MemAvailable'] / 1024, meminfo['MemTotal'] / 1024
+    except Exception as e:
+        logging.debug(f"获取设备可用内存失败: {e}")
+        return None
+
+def extract_audio(video_file, output_audio_file, cancel_token=None):
+    """
+    使用 ffmpeg 提取音频
+    :param cancel_token: 取消令牌，取消时结束 ffmpeg 进程
+    """
+    started_at = time.time()
+    process = (
+        ffmpeg.input(video_file)
+        .output(output_audio_file, q=0, map='a')
+        .overwrite_output()
+        .run_async()
+    )
+
+    def kill_process():
+        if process.poll() is None:
+            process.kill()
+            logging.info(f"已结束 ffmpeg 进程 {process.pid}")
+
+    if cancel_token:
+        cancel_token.add_callback(kill_process)
+    try:
+        process.wait()
+    finally:
+        if cancel_token:
+            cancel_token.remove_callback(kill_process)
+        tracing.record('ffmpeg', started_at, time.time(), input=os.path.basename(video_file),
+                       returncode=process.returncode)
+    if cancel_token:
+        cancel_token.check()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg 提取音频失败，返回码: {process.returncode}")
+
+# 当前线程的转录钩子（取消令牌、进度回调）
+_transcribe_hooks = threading.local()
+
+class _TranscribeProgress:
+    """
+    替换 whisper 转录循环中的 tqdm 进度条
+    whisper 每处理完一个30秒窗口调用一次 update()，借此在窗口边界检查取消请求并报告进度
+    """
+
+    def __init__(self, total=None, **kwargs):
+        self.total = total
+        self.n = 0
+        self.window_started_at = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def update(self, n=1):
+        self.n += n
+        # 每个转录窗口记录为一个 span
+        now = time.time()
+        tracing.record('asr_window', self.window_started_at, now, frames=n)
+        self.window_started_at = now
+        cancel_token = getattr(_transcribe_hooks, 'cancel_token', None)
+        if cancel_token:
+            cancel_token.check()
+        progress_callback = getattr(_transcribe_hooks, 'progress_callback', None)
+        if progress_callback and self.total:
+            progress_callback(min(1.0, self.n / self.total))
+
+def _install_transcribe_hooks():
+    """将 whisper.transcribe 模块中的 tqdm 替换为 _TranscribeProgress"""
+    transcribe_module = sys.modules.get('whisper.transcribe')
+    if transcribe_module is not None and getattr(transcribe_module.tqdm, 'tqdm', None) is not _TranscribeProgress:
+        transcribe_module.tqdm = types.SimpleNamespace(tqdm=_TranscribeProgress)
+
+def extract_subtitles(audio_file, output_dir, language='Chinese', output_format="srt", device=None, model_name='large-v3-turbo', output_filename=None, cancel_token=None, progress_callback=None, model=None):
     """
     提取字幕
     :param audio_file: 音频文件路径
@@ -34,17 +151,13 @@ def extract_subtitles(audio_file, output_dir, language='Chinese', output_format=
     :param device: 设备（cuda/cpu）
     :param model_name: 模型名称
     :param output_filename: 指定的输出文件名（不包含路径）
+    :param cancel_token: 取消令牌，在每个转录窗口结束时检查
+    :param progress_callback: 转录进度回调，参数为已完成的比例（0-1）
+    :param model: 已加载的 model_name 模型实例，为None时重新加载
     :return: 生成的字幕文件完整路径
     """
-    # 检查模型是否支持
-    if model_name not in AVAILABLE_MODELS:
-        raise ValueError(f"不支持的模型: {model_name}")
-
-    # 加载 whisper 模型
-    logging.info(f"正在加载模型 {model_name}...")
-
-    model = whisper.load_model(model_name, download_root='./models', device=device)
-    logging.info("模型加载成功。")
+    if model is None:
+        model = load_model(model_name, device=device)
     
     # 提取字幕
     logging.info("开始转录...")
@@ -55,9 +168,26 @@ def extract_subtitles(audio_file, output_dir, language='Chinese', output_format=
         "verbose": True,
         "word_timestamps": True,  # 启用词级时间戳
     }
-    result = model.transcribe(audio_file, **transcribe_options)
+    _install_transcribe_hooks()
+    _transcribe_hooks.cancel_token = cancel_token
+    _transcribe_hooks.progress_callback = progress_callback
+    transcribe_start = time.time()
+    try:
+        with tracing.span('transcribe', model=model_name) as transcribe_span:
+            result = model.transcribe(audio_file, **transcribe_options)
+            transcribe_span.set(segments=len(result.get('segments') or []))
+    finally:
+        _transcribe_hooks.cancel_token = None
+        _transcribe_hooks.progress_callback = None
+    transcribe_seconds = time.time() - transcribe_start
     logging.info("转录完成。")
 
+    # 实时率：转录耗时 / 音频时长（以最后一条字幕的结束时间近似音频时长）
+    segments = result.get('segments') or []
+    audio_duration = segments[-1]['end'] if segments else 0
+    if audio_duration > 0:
+        WHISPER_REALTIME_FACTOR.labels(model=model_name).observe(transcribe_seconds / audio_duration)
+
     # 使用指定的文件名或生成默认文件名
     if output_filename:
         base_name = os.path.splitext(output_filename)[0]
@@ -68,6 +198,7 @@ def extract_subtitles(audio_file, output_dir, language='Chinese', output_format=
     output_path = os.path.join(output_dir, f"{base_name}.{output_format}")
     
     # 使用whisper的writer保存文件
+    import whisper.utils
     writer = whisper.utils.get_writer(output_format, output_dir)
     writer(result, base_name)
 
@@ -0,0 +1,155 @@
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 支持的文件类型
+ALLOWED_VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mkv', '.mov'}
+ALLOWED_AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.aac', '.flac'}
+
+def get_file_type(filename):
+    """判断文件类型"""
+    ext = os.path.splitext(filename.lower())[1]
+    if ext in ALLOWED_VIDEO_EXTENSIONS:
+        return 'video'
+    elif ext in ALLOWED_AUDIO_EXTENSIONS:
+        return 'audio'
+    return None
+
+def is_within(path: str, roots: List[str]) -> bool:
+    """判断路径是否位于允许的目录之内（解析符号链接后比较）"""
+    real_path = os.path.realpath(path)
+    for root in roots:
+        real_root = os.path.realpath(root)
+        if os.path.commonpath([real_path, real_root]) == real_root:
+            return True
+    return False
+
+def collect_media_files(paths: List[str]) -> Tuple[List[str], List[Dict]]:
+    """
+    展开文件和目录，收集支持的媒体文件
+    :param paths: 文件或目录路径，目录会递归扫描
+    :return: (媒体文件列表, 错误列表)
+    """
+    media_files = []
+    errors = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                for name in sorted(files):
+                    if not name.startswith('.') and get_file_type(name):
+                        media_files.append(os.path.join(root, name))
+        elif not os.path.isfile(path):
+            errors.append({'file': path, 'error': '文件不存在'})
+        elif not get_file_type(path):
+            errors.append({'file': path, 'error': '不支持的文件格式'})
+        else:
+            media_files.append(path)
+    return media_files, errors
+
+class FolderWatcher:
+    """
+    监视目录，将新放入的媒体文件批量登记为任务
+    文件在连续两次扫描中大小和修改时间都未变化才会被登记，避免处理仍在复制中的文件；
+    登记时文件被移入上传目录，因此不会重复登记。多个进程监视同一目录时，移动失败的一方会跳过该文件
+    """
+
+    def __init__(self, processor, watch_dir: str, output_dir: str, options: Dict,
+                 poll_interval: float = 10, max_batch: int = 500):
+        """
+        :param processor: TaskProcessor 实例
+        :param watch_dir: 监视的目录
+        :param output_dir: 登记后文件移入的目录
+        :param options: 任务选项（target_langs、keep_original、model_name、priority）
+        :param poll_interval: 扫描间隔（秒）
+        :param max_batch: 单次登记的最大文件数
+        """
+        self.processor = processor
+        self.watch_dir = watch_dir
+        self.output_dir = output_dir
+        self.options = options
+        self.poll_interval = poll_interval
+        self.max_batch = max_batch
+        self._seen: Dict[str, Tuple[int, float]] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _stable_files(self) -> List[str]:
+        """本次扫描中大小和修改时间与上次相同的文件"""
+        current = {}
+        media_files, _ = collect_media_files([self.watch_dir])
+        for path in media_files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime)
+        stable = [path for path, signature in current.items()
+                  if self._seen.get(path) == signature and signature[0] > 0]
+        self._seen = current
+        return stable
+
+    def scan_once(self) -> int:
+        """
+        扫描一次目录并登记稳定的文件
+        :return: 登记的任务数
+        """
+        stable = self._stable_files()[:self.max_batch]
+        if not stable:
+            return 0
+        success, message, tasks, errors = self.processor.add_tasks_bulk(
+            stable, self.output_dir, move=True, **self.options
+        )
+        for error in errors:
+            logging.warning(f"登记文件 {error['file']} 失败: {error['error']}")
+        for task in tasks:
+            self._seen.pop(task['file'], None)
+        logging.info(f"监视目录 {self.watch_dir}: {message}")
+        return len(tasks)
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.scan_once()
+            except Exception as e:
+                logging.error(f"扫描监视目录失败: {str(e)}")
+
+    def start(self):
+        """在后台线程中开始监视"""
+        os.makedirs(self.watch_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logging.info(f"开始监视目录 {self.watch_dir}，每 {self.poll_interval} 秒扫描一次")
+
+    def stop(self):
+        """停止监视"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+def create_folder_watcher(processor, config: Dict, output_dir: str,
+                          watch_dir: Optional[str] = None) -> Optional[FolderWatcher]:
+    """
+    根据 ingest 配置创建目录监视器
+    :param config: ingest 配置节
+    :param watch_dir: 覆盖配置中的监视目录
+    :return: 未配置监视目录时返回None
+    """
+    watch_dir = watch_dir or config.get('watch_dir')
+    if not watch_dir:
+        return None
+    options = {
+        'target_langs': config.get('target_langs') or [],
+        'keep_original': config.get('keep_original', False),
+        'model_name': config.get('model_name', 'large-v3-turbo'),
+        'priority': config.get('priority', 0)
+    }
+    return FolderWatcher(
+        processor,
+        watch_dir,
+        output_dir,
+        options,
+        poll_interval=config.get('poll_interval', 10),
+        max_batch=config.get('max_batch', 500)
+    )
@@ -0,0 +1,308 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+import tracing
+from metrics import LLM_ENDPOINT_LATENCY, LLM_ENDPOINT_REQUESTS, LLM_HEDGED_REQUESTS
+
+# 请求本身无效（如超出上下文长度、参数错误），换一个接口也不会成功，不切换接口也不计入接口的错误率
+_REQUEST_ERROR_STATUS = (400, 422)
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩法计算分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def is_request_error(error: Exception) -> bool:
+    return getattr(error, 'status_code', None) in _REQUEST_ERROR_STATUS
+
+class Endpoint:
+    """一个 OpenAI 兼容接口，记录请求耗时和错误率的指数移动平均"""
+
+    def __init__(self, name: str, client, weight: float = 1.0):
+        """
+        :param name: 接口名称（用于日志、指标和追踪）
+        :param client: 与 openai.OpenAI 接口相同的客户端
+        :param weight: 权重，延迟和错误率相同时按权重比例分配请求；为0时只在其他接口都失败时使用
+        """
+        self.name = name
+        self.client = client
+        self.weight = max(0.0, float(weight))
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+class _HedgedRequest:
+    """一次对话请求的各次尝试共享的状态，用于区分落败的尝试"""
+
+    def __init__(self):
+        self.finished = False
+
+class LLMRouter:
+    """
+    在多个 OpenAI 兼容接口之间分配大模型请求
+    - 按权重、延迟的指数移动平均、错误率和进行中的请求数随机选择接口，慢的或出错的接口分到的请求随之减少
+    - 请求超过该步骤近期延迟的分位数（默认 p95）仍未返回时，向另一个接口发送对冲请求，先返回的结果生效
+    - 请求失败时切换到尚未尝试的接口，都尝试过后退避重试；连续失败的接口暂停使用一段时间
+    只配置一个接口时直接在调用线程中发送请求，与不使用路由时相同
+    """
+
+    def __init__(self, endpoints: List[Endpoint], config: Optional[Dict] = None):
+        """
+        :param endpoints: 接口列表，至少一个
+        :param config: llm_routing 配置
+        """
+        if not endpoints:
+            raise ValueError("至少需要配置一个大模型接口")
+        config = config or {}
+        self.endpoints = endpoints
+        self.alpha = config.get('ewma_alpha', 0.2)
+        self.hedge_enabled = config.get('hedge', True)
+        self.hedge_percentile = config.get('hedge_percentile', 95)
+        self.hedge_min_samples = config.get('hedge_min_samples', 20)
+        self.hedge_min_delay = config.get('hedge_min_delay', 1.0)
+        self.hedge_max_delay = config.get('hedge_max_delay', 60.0)
+        self.max_hedge_ratio = config.get('max_hedge_ratio', 0.1)
+        # 默认在尝试过所有接口后再重试两次，与单个接口时 openai 客户端的默认重试次数相当
+        self.max_attempts = config.get('max_attempts', len(endpoints) + 2)
+        self.retry_backoff = config.get('retry_backoff', 0.5)
+        self.failure_threshold = config.get('failure_threshold', 3)
+        self.failure_cooldown = config.get('failure_cooldown', 30)
+        self._lock = threading.Lock()
+        # 各步骤近期成功请求的耗时，纠正和翻译的请求大小不同，分别计算对冲延迟
+        self._latencies: Dict[str, deque] = {}
+        self._window = config.get('latency_window', 200)
+        self._requests = 0
+        self._hedges = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if len(endpoints) > 1:
+            # 落败的请求无法中途终止，会继续占用线程直到返回，线程数需大于纠正和翻译的总并发数
+            self._executor = ThreadPoolExecutor(
+                max_workers=config.get('max_concurrent_requests', 64), thread_name_prefix='llm-request')
+
+    def complete(self, stage: str, model: str, messages: List[dict], **params):
+        """
+        发送对话请求
+        :param stage: 请求所属的处理步骤（correct / translate）
+        :param model: 模型名称
+        :param messages: 对话消息
+        :param params: 生成参数（如 max_tokens、temperature）
+        :return: 响应对象；所有尝试都失败时抛出最后一次的异常
+        """
+        if self._executor is None:
+            return self._send(self.endpoints[0], stage, model, messages, params, _HedgedRequest())
+
+        with self._lock:
+            self._requests += 1
+        request = _HedgedRequest()
+        pending: Dict[Future, tuple] = {}
+        tried: List[Endpoint] = []
+        last_error: Optional[Exception] = None
+        hedged = False
+
+        def submit(endpoint: Endpoint, role: str):
+            tried.append(endpoint)
+            future = self._executor.submit(
+                tracing.bind(self._attempt), endpoint, role, stage, model, messages, params, request)
+            pending[future] = (endpoint, role)
+
+        submit(self._pick(tried), 'primary')
+        hedge_delay = self._hedge_delay(stage)
+        hedge_at = time.time() + hedge_delay if hedge_delay is not None else None
+
+        try:
+            while pending:
+                timeout = max(0.0, hedge_at - time.time()) if hedge_at is not None else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # 超过对冲延迟仍未返回，每个请求最多对冲一次
+                    hedge_at = None
+                    endpoint = self._pick(tried)
+                    if endpoint is not None and self._take_hedge_budget():
+                        logging.info(f"{stage} 请求超过 {hedge_delay:.1f} 秒未返回，向 {endpoint.name} 发送对冲请求")
+                        submit(endpoint, 'hedge')
+                        hedged = True
+                    continue
+
+                for future in done:
+                    endpoint, role = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        last_error = e
+                        if is_request_error(e):
+                            raise
+                        logging.warning(f"大模型接口 {endpoint.name} 请求失败: {str(e)}")
+                        continue
+                    if hedged:
+                        LLM_HEDGED_REQUESTS.labels(stage=stage, winner=role).inc()
+                    return response
+
+                if not pending and len(tried) < self.max_attempts:
+                    endpoint = self._pick(tried)
+                    if endpoint is None:
+                        # 所有接口都已尝试过，退避后重新选择
+                        time.sleep(min(self.retry_backoff * 2 ** (len(tried) - len(self.endpoints)), 8))
+                        endpoint = self._pick([])
+                    submit(endpoint, 'failover')
+                    if hedge_at is not None:
+                        hedge_at = time.time() + hedge_delay
+            if hedged:
+                LLM_HEDGED_REQUESTS.labels(stage=stage, winner='none').inc()
+            raise last_error
+        finally:
+            # 丢弃其余尝试的结果：尚未开始的直接取消，已经发出的请求无法中途终止，返回后不再使用
+            request.finished = True
+            for future in pending:
+                future.cancel()
+
+    def _attempt(self, endpoint: Endpoint, role: str, stage: str, model: str, messages: List[dict],
+                 params: Dict, request: _HedgedRequest):
+        with tracing.span('llm_attempt', endpoint=endpoint.name, role=role) as attempt_span:
+            response = self._send(endpoint, stage, model, messages, params, request)
+            if request.finished:
+                attempt_span.set(abandoned=True)
+            return response
+
+    def _send(self, endpoint: Endpoint, stage: str, model: str, messages: List[dict], params: Dict,
+              request: _HedgedRequest):
+        """向接口发送请求并更新其延迟和错误率"""
+        with self._lock:
+            endpoint.in_flight += 1
+        start_time = time.time()
+        try:
+            response = endpoint.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=False,
+                **params
+            )
+        except Exception as e:
+            self._record(endpoint, stage, None if is_request_error(e) else False, 0, request)
+            raise
+        self._record(endpoint, stage, True, time.time() - start_time, request)
+        return response
+
+    def _record(self, endpoint: Endpoint, stage: str, success: Optional[bool], seconds: float,
+                request: _HedgedRequest):
+        """
+        :param success: True 成功，False 失败，None 为请求本身无效（不影响接口的统计）
+        """
+        abandoned = request.finished
+        with self._lock:
+            endpoint.in_flight -= 1
+            if success:
+                endpoint.latency = seconds if endpoint.latency is None else \
+                    self.alpha * seconds + (1 - self.alpha) * endpoint.latency
+                endpoint.error_rate *= 1 - self.alpha
+                endpoint.consecutive_failures = 0
+                endpoint.cooldown_until = 0.0
+                # 落败请求的耗时同样是真实的延迟，计入分位数，避免低估长尾而过多对冲
+                self._latencies.setdefault(stage, deque(maxlen=self._window)).append(seconds)
+            elif success is False:
+                endpoint.error_rate = self.alpha + (1 - self.alpha) * endpoint.error_rate
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.failure_threshold and len(self.endpoints) > 1:
+                    endpoint.cooldown_until = time.time() + self.failure_cooldown
+                    logging.warning(f"大模型接口 {endpoint.name} 连续失败 {endpoint.consecutive_failures} 次，"
+                                    f"暂停使用 {self.failure_cooldown} 秒")
+            latency = endpoint.latency
+        if latency is not None:
+            LLM_ENDPOINT_LATENCY.labels(endpoint=endpoint.name).set(latency)
+        if abandoned:
+            result = 'abandoned'
+        else:
+            result = 'success' if success else 'error'
+        LLM_ENDPOINT_REQUESTS.labels(endpoint=endpoint.name, result=result).inc()
+
+    def _pick(self, exclude: List[Endpoint]) -> Optional[Endpoint]:
+        """
+        按 权重 × (1 - 错误率) / (延迟 × (1 + 进行中的请求数)) 的比例随机选择接口
+        随机选择避免所有线程同时涌向当前最快的接口；暂停中的接口只在没有其他可选接口时使用
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+            if not candidates:
+                return None
+            available = [endpoint for endpoint in candidates if endpoint.cooldown_until <= now] or candidates
+            # 还没有延迟数据的接口按已知接口的平均延迟估计，使其能分到请求
+            known = [endpoint.latency for endpoint in available if endpoint.latency is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            scores = [
+                endpoint.weight * max(0.05, 1 - endpoint.error_rate) /
+                (max(endpoint.latency or default_latency, 0.001) * (1 + endpoint.in_flight))
+                for endpoint in available
+            ]
+        if not any(scores):
+            return available[0]
+        return random.choices(available, weights=scores)[0]
+
+    def _hedge_delay(self, stage: str) -> Optional[float]:
+        """该步骤近期请求耗时的分位数，样本不足或不对冲时返回None"""
+        if not self.hedge_enabled:
+            return None
+        with self._lock:
+            samples = list(self._latencies.get(stage, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return min(max(percentile(samples, self.hedge_percentile), self.hedge_min_delay), self.hedge_max_delay)
+
+    def _take_hedge_budget(self) -> bool:
+        """对冲请求不超过总请求数的 max_hedge_ratio，避免接口整体变慢时请求量翻倍"""
+        with self._lock:
+            if self._hedges + 1 > self.max_hedge_ratio * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+    def stats(self) -> List[Dict]:
+        """各接口的当前统计"""
+        now = time.time()
+        with self._lock:
+            return [{
+                'name': endpoint.name,
+                'weight': endpoint.weight,
+                'latency': round(endpoint.latency, 3) if endpoint.latency is not None else None,
+                'error_rate': round(endpoint.error_rate, 3),
+                'in_flight': endpoint.in_flight,
+                'cooling_down': endpoint.cooldown_until > now
+            } for endpoint in self.endpoints]
+
+def create_router(config_manager, names: Optional[List[str]] = None) -> LLMRouter:
+    """
+    根据 api.endpoints 和 llm_routing 配置创建路由
+    :param names: 只使用这些名称的接口（处理步骤配置的 endpoints），为空时使用所有接口
+    """
+    # openai 客户端库较重，只在实际调用大模型的进程中导入
+    from openai import OpenAI
+
+    endpoint_configs = config_manager.get_api_endpoints()
+    if names:
+        selected = [item for item in endpoint_configs if item.get('name') in names]
+        unknown = set(names) - {item.get('name') for item in selected}
+        if unknown:
+            logging.warning(f"未找到大模型接口: {', '.join(sorted(unknown))}")
+        endpoint_configs = selected or endpoint_configs
+    routing_config = config_manager.get_config('llm_routing')
+    # 多个接口时由路由切换接口，客户端不再对同一个接口重试
+    max_retries = routing_config.get('client_max_retries', 2 if len(endpoint_configs) == 1 else 0)
+    endpoints = [
+        Endpoint(
+            item.get('name') or item.get('base_url') or f'endpoint-{i}',
+            OpenAI(api_key=item.get('api_key'), base_url=item.get('base_url'), max_retries=max_retries),
+            item.get('weight', 1.0)
+        )
+        for i, item in enumerate(endpoint_configs)
+    ]
+    logging.info(f"大模型接口: {', '.join(endpoint.name for endpoint in endpoints)}")
+    return LLMRouter(endpoints, routing_config)
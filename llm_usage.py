@@ -0,0 +1,76 @@
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# 当前线程（或复制了上下文的线程池任务）正在累计用量的记录器，线程池任务需经由 tracing.bind 提交
+_current = contextvars.ContextVar('llm_usage', default=None)
+
+class UsageRecorder:
+    """按 (步骤, 模型) 累计大模型请求数、token 数、耗时和费用"""
+
+    def __init__(self):
+        self._usage: Dict[Tuple[str, str], Dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, model: str, prompt_tokens: int, completion_tokens: int,
+            seconds: float, cost: float, error: bool = False):
+        with self._lock:
+            item = self._usage.setdefault((stage, model), {
+                'stage': stage, 'model': model, 'requests': 0, 'errors': 0,
+                'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0, 'cost': 0.0
+            })
+            item['requests'] += 1
+            item['errors'] += int(error)
+            item['prompt_tokens'] += prompt_tokens
+            item['completion_tokens'] += completion_tokens
+            item['seconds'] += seconds
+            item['cost'] += cost
+
+    def rows(self) -> List[Dict]:
+        with self._lock:
+            return [{**item, 'seconds': round(item['seconds'], 3), 'cost': round(item['cost'], 6)}
+                    for item in self._usage.values()]
+
+@contextmanager
+def recording():
+    """在当前上下文中累计大模型用量，退出后可从返回的记录器中读取"""
+    recorder = UsageRecorder()
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+def add(stage: str, model: str, prompt_tokens: int, completion_tokens: int,
+        seconds: float, cost: float, error: bool = False):
+    """记录一个请求的用量；不在 recording() 中时不做任何事"""
+    recorder: Optional[UsageRecorder] = _current.get()
+    if recorder is not None:
+        recorder.add(stage, model, prompt_tokens, completion_tokens, seconds, cost, error)
+
+def summarize(usage: List[Dict]) -> Dict:
+    """
+    汇总用量（如数据库中按模型分行的记录），供状态接口和报告使用
+    :return: {'stages': {步骤: {...含 avg_seconds}}, 'cost', 'prompt_tokens', 'completion_tokens'}
+    """
+    stages = {}
+    for item in usage:
+        stage = stages.setdefault(item['stage'], {
+            'models': [], 'requests': 0, 'errors': 0, 'prompt_tokens': 0,
+            'completion_tokens': 0, 'seconds': 0.0, 'cost': 0.0
+        })
+        if item['model'] not in stage['models']:
+            stage['models'].append(item['model'])
+        for key in ('requests', 'errors', 'prompt_tokens', 'completion_tokens', 'seconds', 'cost'):
+            stage[key] += item[key] or 0
+    for stage in stages.values():
+        stage['avg_seconds'] = round(stage['seconds'] / stage['requests'], 3) if stage['requests'] else None
+        stage['seconds'] = round(stage['seconds'], 3)
+        stage['cost'] = round(stage['cost'], 6)
+    return {
+        'stages': stages,
+        'prompt_tokens': sum(stage['prompt_tokens'] for stage in stages.values()),
+        'completion_tokens': sum(stage['completion_tokens'] for stage in stages.values()),
+        'cost': round(sum(stage['cost'] for stage in stages.values()), 6)
+    }
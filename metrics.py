@@ -0,0 +1,273 @@
+import math
+import time
+import threading
+import functools
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 默认的直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    """指标基类，按标签值保存子指标"""
+    metric_type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """获取指定标签值的子指标"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"指标 {self.name} 需要指定标签: {', '.join(self.labelnames)}")
+        return self.labels()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            children = list(self._children.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}'
+                for key, child in children]
+
+class Gauge(Counter):
+    """可增可减的数值"""
+    metric_type = 'gauge'
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default().dec(amount)
+
+    def clear(self) -> None:
+        """清空所有子指标（用于每次采集时重新计算的指标）"""
+        with self._lock:
+            self._children.clear()
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+
+class Histogram(_Metric):
+    """直方图，分桶计数为累计值"""
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            children = list(self._children.items())
+        lines = []
+        for key, child in children:
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表，以 Prometheus 文本格式输出
+    各工作进程分别持有自己的指标，独立部署的工作进程可通过 worker.py --metrics-port 暴露
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(MetricsRegistry, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._registry_lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._registry_lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """以 Prometheus 文本格式输出所有指标"""
+        with self._registry_lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+def timed(histogram: Histogram, **labels):
+    """装饰器：记录函数的执行耗时"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child = histogram.labels(**labels) if labels else histogram
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# 各模块使用的指标
+REGISTRY = MetricsRegistry()
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    'videowhisper_queue_depth', '各阶段队列中等待的任务数（所有工作进程）', ['stage'])
+STAGE_ACTIVE = REGISTRY.gauge(
+    'videowhisper_stage_active_tasks', '各阶段正在处理的任务数（所有工作进程）', ['stage'])
+STAGE_DURATION = REGISTRY.histogram(
+    'videowhisper_stage_duration_seconds', '各阶段的处理耗时', ['stage'],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+TASKS_FINISHED = REGISTRY.counter(
+    'videowhisper_tasks_finished_total', '结束的任务数', ['status'])
+CHECKPOINT_LOOKUPS = REGISTRY.counter(
+    'videowhisper_checkpoint_lookups_total', '检查点查询次数（hit 表示复用了已完成阶段的产物）',
+    ['checkpoint', 'result'])
+
+WHISPER_REALTIME_FACTOR = REGISTRY.histogram(
+    'videowhisper_whisper_realtime_factor', 'Whisper 转录耗时与音频时长之比', ['model'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8))
+WHISPER_MODEL_LOAD = REGISTRY.histogram(
+    'videowhisper_whisper_model_load_seconds', 'Whisper 模型加载耗时', ['model'],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+
+LLM_REQUEST_DURATION = REGISTRY.histogram(
+    'videowhisper_llm_request_seconds', '大模型请求耗时', ['stage', 'model'],
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+LLM_REQUEST_ERRORS = REGISTRY.counter(
+    'videowhisper_llm_request_errors_total', '大模型请求失败次数', ['stage', 'model'])
+LLM_IN_FLIGHT = REGISTRY.gauge(
+    'videowhisper_llm_requests_in_flight', '正在进行的大模型请求数', ['stage'])
+LLM_TOKENS = REGISTRY.counter(
+    'videowhisper_llm_tokens_total', '大模型请求的 token 数（接口未返回用量时为估算值）', ['stage', 'model', 'kind'])
+LLM_COST = REGISTRY.counter(
+    'videowhisper_llm_cost_total', '大模型请求的费用（按 api.pricing 计算）', ['stage', 'model'])
+LLM_ENDPOINT_REQUESTS = REGISTRY.counter(
+    'videowhisper_llm_endpoint_requests_total',
+    '发往各接口的请求数（success 成功，error 失败，abandoned 对冲中落败、结果被丢弃）', ['endpoint', 'result'])
+LLM_ENDPOINT_LATENCY = REGISTRY.gauge(
+    'videowhisper_llm_endpoint_latency_seconds', '各接口请求耗时的指数移动平均（用于选择接口）', ['endpoint'])
+LLM_HEDGED_REQUESTS = REGISTRY.counter(
+    'videowhisper_llm_hedged_requests_total', '发出对冲请求的次数（按先成功返回的一方统计，none 表示全部失败）', ['stage', 'winner'])
+
+SQLITE_WRITE_DURATION = REGISTRY.histogram(
+    'videowhisper_sqlite_write_seconds', 'SQLite 写操作耗时', ['operation'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+MODEL_CACHE_LOOKUPS = REGISTRY.counter(
+    'videowhisper_model_cache_lookups_total',
+    '模型预留次数（hit 复用已加载模型，load 需要加载，fallback 改用已加载的替代模型）', ['model', 'result'])
+MODEL_MEMORY_COMMITTED = REGISTRY.gauge(
+    'videowhisper_model_memory_committed_mb', '本进程已加载和已预留的模型内存估算（MB）')
+
+RETENTION_FILES_DELETED = REGISTRY.counter(
+    'videowhisper_retention_files_deleted_total', '清理删除的文件数（expired 过期，quota 超出容量，orphan 孤立文件，render_cache 未使用的渲染缓存）',
+    ['reason'])
+RETENTION_BYTES_FREED = REGISTRY.counter(
+    'videowhisper_retention_bytes_freed_total', '清理释放的字节数', ['reason'])
+UPLOAD_DIR_BYTES = REGISTRY.gauge(
+    'videowhisper_upload_dir_bytes', '上传目录占用的字节数（最近一次清理后）')
+TASKS_ARCHIVED = REGISTRY.counter(
+    'videowhisper_tasks_archived_total', '移入归档表的任务数')
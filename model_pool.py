@@ -0,0 +1,237 @@
+import gc
+import sys
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from metrics import MODEL_CACHE_LOOKUPS, MODEL_MEMORY_COMMITTED
+
+class _ModelInstance:
+    """一个已加载的模型实例，同一时间只能被一个任务使用（whisper 解码时会在模型上挂载缓存钩子）"""
+
+    def __init__(self, model_name: str, model, memory_mb: int):
+        self.model_name = model_name
+        self.model = model
+        self.memory_mb = memory_mb
+        self.holder: Optional[str] = None
+        self.last_used = time.time()
+
+class ModelPool:
+    """
+    按内存预算管理本进程加载的 Whisper 模型
+    - 已加载的模型在任务结束后保留，后续使用同一模型的任务直接复用
+    - 领取语音识别任务前先为其预留内存（admit），放不下的任务留在队列中，不会被领取
+    - 内存不足时先释放空闲的模型；仍然不足且配置了替代模型时，任务改用已加载且空闲的替代模型
+    已提交的内存 = 已加载的模型 + 已预留但尚未加载的模型，预算为0表示不限制
+    预算只约束本进程；提供 device_memory 时同时按设备的实际可用内存准入，
+    从而计入同一台机器上其他进程已加载的模型
+    """
+
+    def __init__(self, budget_mb: float = 0, model_memory: Optional[Dict[str, int]] = None,
+                 fallback_models: Optional[Dict[str, List[str]]] = None, idle_seconds: float = 600,
+                 loader: Optional[Callable] = None, default_memory_mb: int = 4000,
+                 device_memory: Optional[Callable[[], Optional[Tuple[float, float]]]] = None,
+                 device_reserve_mb: float = 0):
+        """
+        :param budget_mb: 本进程模型可使用的内存预算（MB），0表示不限制
+        :param model_memory: 各模型的常驻内存估算 {模型名称: MB}
+        :param fallback_models: 内存不足时可改用的已加载模型 {模型名称: [替代模型, ...]}
+        :param idle_seconds: 空闲模型保留的时长（秒），超过后由 evict_idle 释放（不限制预算时也会释放）
+        :param loader: 加载模型的函数 loader(model_name)
+        :param default_memory_mb: 未知模型的内存估算
+        :param device_memory: 返回设备 (可用内存MB, 总内存MB) 的函数，无法获取时返回None
+        :param device_reserve_mb: 按设备可用内存准入时保留的余量（MB）
+        """
+        self.budget_mb = budget_mb or 0
+        self.model_memory = dict(model_memory or {})
+        self.fallback_models = dict(fallback_models or {})
+        self.idle_seconds = idle_seconds
+        self.loader = loader
+        self.default_memory_mb = default_memory_mb
+        self.device_memory = device_memory
+        self.device_reserve_mb = device_reserve_mb
+        self._instances: List[_ModelInstance] = []
+        # 任务ID -> (模型名称, 预留的实例；为None时表示需要加载新实例)
+        self._reservations: Dict[str, Tuple[str, Optional[_ModelInstance]]] = {}
+        self._lock = threading.Lock()
+
+    def memory_of(self, model_name: str) -> int:
+        """模型的常驻内存估算（MB）"""
+        return self.model_memory.get(model_name, self.default_memory_mb)
+
+    def fits_budget(self, model_name: str) -> bool:
+        """模型是否可能在预算内加载（预算不足以容纳该模型时，使用它的任务永远无法执行）"""
+        return not self.budget_mb or self.memory_of(model_name) <= self.budget_mb
+
+    def _pending_mb(self) -> int:
+        """已预留但尚未加载的模型内存"""
+        return sum(self.memory_of(model_name) for model_name, instance in self._reservations.values()
+                   if instance is None)
+
+    def _committed_mb(self) -> int:
+        return sum(instance.memory_mb for instance in self._instances) + self._pending_mb()
+
+    def _available_mb(self, needed: int) -> Optional[float]:
+        """
+        还可以加载的模型内存（MB）：本进程预算的剩余量与设备实际可用内存中较小的一个，都不限制时返回None
+        设备内存小于模型所需时不按设备内存限制（等待也无法满足），与之前一样尝试加载
+        """
+        limits = []
+        if self.budget_mb:
+            limits.append(self.budget_mb - self._committed_mb())
+        memory = self.device_memory() if self.device_memory else None
+        if memory is not None:
+            free_mb, total_mb = memory
+            if needed <= total_mb - self.device_reserve_mb:
+                # 已预留但尚未加载的模型还没有占用设备内存
+                limits.append(free_mb - self.device_reserve_mb - self._pending_mb())
+        return min(limits) if limits else None
+
+    def _idle_instances(self) -> List[_ModelInstance]:
+        reserved = {id(instance) for _, instance in self._reservations.values() if instance is not None}
+        return [instance for instance in self._instances
+                if instance.holder is None and id(instance) not in reserved]
+
+    def _evict(self, instances: List[_ModelInstance]) -> None:
+        for instance in instances:
+            self._instances.remove(instance)
+            instance.model = None
+            logging.info(f"释放空闲模型 {instance.model_name}（{instance.memory_mb} MB）")
+        if instances:
+            gc.collect()
+            torch = sys.modules.get('torch')
+            if torch is not None and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def _update_metrics(self) -> None:
+        MODEL_MEMORY_COMMITTED.set(self._committed_mb())
+
+    def reserve(self, task_id: str, model_name: str) -> Optional[str]:
+        """
+        为任务预留模型
+        :return: 预留的模型名称（可能是替代模型），放不下时返回None
+        """
+        with self._lock:
+            if task_id in self._reservations:
+                return self._reservations[task_id][0]
+
+            now = time.time()
+            idle = self._idle_instances()
+            self._evict([instance for instance in idle
+                         if instance.model_name != model_name and now - instance.last_used > self.idle_seconds])
+            idle = self._idle_instances()
+
+            # 优先复用已加载的同一模型
+            for instance in idle:
+                if instance.model_name == model_name:
+                    self._reservations[task_id] = (model_name, instance)
+                    MODEL_CACHE_LOOKUPS.labels(model=model_name, result='hit').inc()
+                    return model_name
+
+            # 加载新实例，必要时按最久未使用的顺序释放空闲模型
+            needed = self.memory_of(model_name)
+            available = self._available_mb(needed)
+            if available is not None:
+                victims = []
+                for instance in sorted(idle, key=lambda item: item.last_used):
+                    if available >= needed:
+                        break
+                    victims.append(instance)
+                    available += instance.memory_mb
+                if available >= needed:
+                    self._evict(victims)
+                else:
+                    # 放不下时改用已加载且空闲的替代模型
+                    for fallback in self.fallback_models.get(model_name, []):
+                        for instance in idle:
+                            if instance.model_name == fallback:
+                                self._reservations[task_id] = (fallback, instance)
+                                MODEL_CACHE_LOOKUPS.labels(model=model_name, result='fallback').inc()
+                                return fallback
+                    return None
+
+            self._reservations[task_id] = (model_name, None)
+            MODEL_CACHE_LOOKUPS.labels(model=model_name, result='load').inc()
+            self._update_metrics()
+            return model_name
+
+    def admit(self, entry: Dict) -> bool:
+        """调度器的准入检查：能为候选任务预留模型时返回True"""
+        return self.reserve(entry['task_id'], entry['model_name']) is not None
+
+    def acquire(self, task_id: str, model_name: str):
+        """
+        获取任务使用的模型实例，需要时加载
+        没有预留时（如未经准入检查领取的任务）先尝试预留，放不下时仍然加载
+        :return: (模型名称, 模型实例)
+        """
+        with self._lock:
+            reservation = self._reservations.get(task_id)
+        if reservation is None:
+            if self.reserve(task_id, model_name) is None:
+                logging.warning(f"任务 {task_id} 的模型 {model_name} 超出内存预算")
+                with self._lock:
+                    self._reservations[task_id] = (model_name, None)
+            with self._lock:
+                reservation = self._reservations[task_id]
+
+        reserved_name, instance = reservation
+        if instance is None:
+            try:
+                model = self.loader(reserved_name)
+            except Exception:
+                self.release(task_id)
+                raise
+            instance = _ModelInstance(reserved_name, model, self.memory_of(reserved_name))
+            with self._lock:
+                self._instances.append(instance)
+        with self._lock:
+            instance.holder = task_id
+            self._reservations[task_id] = (reserved_name, instance)
+            self._update_metrics()
+        return reserved_name, instance.model
+
+    def release(self, task_id: str) -> bool:
+        """
+        释放任务的预留或正在使用的模型，模型本身保留以便复用
+        :return: 是否释放了内容
+        """
+        with self._lock:
+            reservation = self._reservations.pop(task_id, None)
+            if reservation is None:
+                return False
+            _, instance = reservation
+            if instance is not None and instance.holder == task_id:
+                instance.holder = None
+                instance.last_used = time.time()
+            self._update_metrics()
+            return True
+
+    def evict_idle(self) -> int:
+        """
+        释放空闲超过 idle_seconds 的模型（不区分模型名称），由工作进程定期调用
+        不限制预算时只有这里会释放模型，避免处理过的模型一直占用内存
+        :return: 释放的模型数
+        """
+        with self._lock:
+            now = time.time()
+            victims = [instance for instance in self._idle_instances()
+                       if now - instance.last_used > self.idle_seconds]
+            if victims:
+                self._evict(victims)
+                self._update_metrics()
+            return len(victims)
+
+    def get_stats(self) -> Dict:
+        """获取内存预算和已加载模型的情况"""
+        with self._lock:
+            return {
+                'budget_mb': self.budget_mb,
+                'committed_mb': self._committed_mb(),
+                'loaded_models': [
+                    {'model_name': instance.model_name, 'memory_mb': instance.memory_mb,
+                     'in_use': instance.holder is not None}
+                    for instance in self._instances
+                ],
+                'reserved_tasks': len(self._reservations)
+            }
@@ -0,0 +1,194 @@
+import os
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import contextvars
+from collections import Counter
+from typing import Callable, Optional
+
+# 分析方式：sampling 为定时采样调用栈（与 py-spy 相同的折叠栈格式），cprofile 为确定性分析
+MODE_SAMPLING = 'sampling'
+MODE_CPROFILE = 'cprofile'
+
+# 各分析方式的产物扩展名
+PROFILE_EXTENSIONS = {
+    MODE_SAMPLING: '.folded',
+    MODE_CPROFILE: '.pstats'
+}
+
+# cProfile 在 Python 3.12 起通过 sys.monitoring 实现，同一时间只能有一个分析器处于启用状态
+_cprofile_lock = threading.Lock()
+
+# 当前任务的采样器，经由 tracing.bind 提交到线程池的工作在执行期间同样被采样
+_current_sampler = contextvars.ContextVar('profile_sampler', default=None)
+
+def frame_label(frame) -> str:
+    """栈帧的显示名称，格式与 py-spy 相同：函数名 (文件名:行号)"""
+    code = frame.f_code
+    # 分号是折叠栈格式的分隔符
+    name = getattr(code, 'co_qualname', code.co_name).replace(';', ':')
+    return f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+class StackSampler:
+    """
+    定期采样指定线程（及执行期间加入的线程池线程）的调用栈，按折叠栈累计采样次数
+    采样的是墙钟时间：等待子进程、网络请求和锁的时间同样计入，适合定位任务的耗时去向
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.01, root: Optional[str] = None):
+        """
+        :param thread_id: 被采样线程的 threading.get_ident()
+        :param interval: 采样间隔（秒）
+        :param root: 加在每个调用栈最外层的名称（如处理阶段）
+        """
+        self.interval = interval
+        self.root = root
+        self.samples: Counter = Counter()
+        # 被采样的线程及其进入次数（同一线程可能嵌套进入）
+        self._threads: Counter = Counter({thread_id: 1})
+        self._threads_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, thread_id: int):
+        """开始采样线程池中为该任务工作的线程"""
+        with self._threads_lock:
+            self._threads[thread_id] += 1
+
+    def remove_thread(self, thread_id: int):
+        with self._threads_lock:
+            self._threads[thread_id] -= 1
+            if self._threads[thread_id] <= 0:
+                del self._threads[thread_id]
+
+    def _sample_once(self):
+        with self._threads_lock:
+            thread_ids = list(self._threads)
+        frames = sys._current_frames()
+        for thread_id in thread_ids:
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if self.root:
+                stack.append(self.root)
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample_once()
+
+    def start(self) -> 'StackSampler':
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        """停止采样，返回 {折叠栈: 采样次数}"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        return self.samples
+
+def run_sampled(func: Callable, *args, **kwargs):
+    """
+    执行 func，当前上下文属于正在采样的任务时，执行期间同时采样当前线程
+    由 tracing.bind 在线程池线程中调用，使纠正、翻译和大模型请求的工作出现在任务的分析结果中
+    """
+    sampler: Optional[StackSampler] = _current_sampler.get()
+    if sampler is None:
+        return func(*args, **kwargs)
+    thread_id = threading.get_ident()
+    sampler.add_thread(thread_id)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sampler.remove_thread(thread_id)
+
+def read_folded(path: str) -> Counter:
+    """读取折叠栈文件"""
+    samples = Counter()
+    if not os.path.exists(path):
+        return samples
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                samples[stack] += int(count)
+    return samples
+
+def write_folded(path: str, samples: Counter):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(samples.items()):
+            f.write(f"{stack} {count}\n")
+    os.replace(temp_path, path)
+
+def resolve_mode(mode: str) -> str:
+    """不支持采样的解释器（没有 sys._current_frames）改用 cProfile"""
+    if mode == MODE_SAMPLING and not hasattr(sys, '_current_frames'):
+        return MODE_CPROFILE
+    return mode if mode in PROFILE_EXTENSIONS else MODE_SAMPLING
+
+def profile_call(func: Callable, path: str, root: str, mode: str = MODE_SAMPLING,
+                 interval: float = 0.01) -> bool:
+    """
+    在分析器下执行 func()，结果合并到已有的分析文件中（同一任务的多个阶段写入同一个文件）
+    func 抛出的异常照常抛出，分析结果仍会保存
+    :param path: 分析文件路径，扩展名应与 mode 对应（见 PROFILE_EXTENSIONS）
+    :param root: 调用栈最外层的名称，用于区分处理阶段
+    :param mode: sampling 或 cprofile，需先经过 resolve_mode
+    :param interval: 采样间隔（秒）
+    :return: 是否保存了分析结果
+    """
+    started_at = time.time()
+    saved = False
+
+    if mode == MODE_SAMPLING:
+        sampler = StackSampler(threading.get_ident(), interval=interval, root=root).start()
+        token = _current_sampler.set(sampler)
+        try:
+            func()
+        finally:
+            _current_sampler.reset(token)
+            samples = sampler.stop()
+            try:
+                merged = read_folded(path)
+                merged.update(samples)
+                write_folded(path, merged)
+                saved = True
+                logging.info(f"{root} 阶段采样 {sum(samples.values())} 次（{time.time() - started_at:.1f}秒），"
+                             f"保存到 {path}")
+            except OSError as e:
+                logging.error(f"保存分析结果失败: {str(e)}")
+        return saved
+
+    if not _cprofile_lock.acquire(blocking=False):
+        logging.warning(f"已有任务在使用 cProfile 分析，{root} 阶段不进行分析")
+        func()
+        return saved
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            func()
+        finally:
+            profiler.disable()
+            try:
+                stats = pstats.Stats(profiler)
+                if os.path.exists(path):
+                    stats.add(path)
+                stats.dump_stats(path)
+                saved = True
+                logging.info(f"{root} 阶段的 cProfile 分析结果保存到 {path}")
+            except Exception as e:
+                logging.error(f"保存分析结果失败: {str(e)}")
+        return saved
+    finally:
+        _cprofile_lock.release()
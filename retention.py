@@ -0,0 +1,277 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from database import TERMINAL_STATUSES
+from ingest import is_within
+from metrics import RETENTION_FILES_DELETED, RETENTION_BYTES_FREED, UPLOAD_DIR_BYTES, TASKS_ARCHIVED
+
+# 文件保留类别
+CATEGORY_ORIGINAL = 'original'        # 上传或登记的源视频/音频
+CATEGORY_TEMPORARY = 'temporary'      # 提取的临时音频
+FILE_CATEGORIES = [CATEGORY_ORIGINAL, CATEGORY_TEMPORARY, 'subtitle', 'subtitle_corrected', 'subtitle_translated',
+                   'profile']
+
+# 上传目录中由 Web 进程自行管理的文件，不按孤立文件清理：
+# 导出格式的渲染缓存目录（按最近使用时间单独清理），以及正在接收的上传临时文件
+RENDER_CACHE_DIR = '.render_cache'
+UPLOAD_TEMP_PREFIX = '.upload_'
+
+def file_category(record: Dict) -> str:
+    """文件记录的保留类别"""
+    if record.get('is_temporary'):
+        return CATEGORY_TEMPORARY
+    if record['file_type'] in ('video', 'audio'):
+        return CATEGORY_ORIGINAL
+    return record['file_type']
+
+class RetentionSweeper:
+    """
+    后台清理上传目录和数据库
+    - 已结束任务的文件按类别在保留天数后删除，文件记录随之删除
+    - 上传目录超过容量上限时，按最近访问时间从旧到新删除已结束任务的源文件
+    - 删除上传目录中没有任何记录引用、且超过宽限期的孤立文件（渲染缓存和上传临时文件除外）；删除文件已不存在的记录
+    - 删除超过 render_cache_days 天未使用的渲染缓存
+    - 结束超过指定天数的任务移入归档表，并定期整理数据库文件
+    只删除上传目录内的文件，通过 /tasks/register 原地登记的服务器文件不会被删除；未结束任务的文件不会被删除
+    """
+
+    def __init__(self, processor, upload_dir: str, keep_days: Optional[Dict[str, float]] = None,
+                 max_upload_gb: float = 0, orphan_grace_hours: float = 24, archive_after_days: float = 30,
+                 vacuum_interval_hours: float = 168, render_cache_days: float = 7, interval: float = 3600):
+        """
+        :param processor: TaskProcessor 实例
+        :param upload_dir: 上传目录
+        :param keep_days: 各类别文件的保留天数 {类别: 天数}，0或未配置表示不按时间删除
+        :param max_upload_gb: 上传目录的容量上限（GB），0表示不限制
+        :param orphan_grace_hours: 孤立文件的宽限期（小时），避免删除正在写入、尚未登记的文件
+        :param archive_after_days: 任务结束多少天后移入归档表，0表示不归档
+        :param vacuum_interval_hours: 整理数据库的间隔（小时），0表示不整理
+        :param render_cache_days: 渲染缓存多少天未使用后删除，0表示不删除
+        :param interval: 两次清理之间的间隔（秒）
+        """
+        self.processor = processor
+        self.db = processor.db
+        self.upload_dir = upload_dir
+        self.keep_days = dict(keep_days or {})
+        self.max_upload_bytes = int((max_upload_gb or 0) * 1024 ** 3)
+        self.orphan_grace_seconds = orphan_grace_hours * 3600
+        self.archive_after_days = archive_after_days
+        self.vacuum_interval_seconds = vacuum_interval_hours * 3600
+        self.render_cache_dir = os.path.realpath(os.path.join(upload_dir, RENDER_CACHE_DIR))
+        self.render_cache_seconds = render_cache_days * 86400
+        self.interval = interval
+        self._vacuumed_at = time.time()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _remove(self, path: str, reason: str) -> int:
+        """
+        删除上传目录内的文件
+        :return: 释放的字节数，文件不在上传目录内或删除失败时返回-1
+        """
+        if not is_within(path, [self.upload_dir]):
+            return -1
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            logging.warning(f"删除文件 {path} 失败: {str(e)}")
+            return -1
+        RETENTION_FILES_DELETED.labels(reason=reason).inc()
+        RETENTION_BYTES_FREED.labels(reason=reason).inc(size)
+        logging.info(f"清理文件 {path}（{reason}，{size} 字节）")
+        return size
+
+    def _expire_files(self, records: List[Dict], now: datetime) -> List[Dict]:
+        """
+        删除已过保留期的文件及文件已不存在的记录
+        :return: 保留下来的文件记录
+        """
+        expired_ids = []
+        kept = []
+        for record in records:
+            if record['task_status'] is not None and record['task_status'] not in TERMINAL_STATUSES:
+                kept.append(record)
+                continue
+            if not os.path.exists(record['file_path']):
+                expired_ids.append(record['file_id'])
+                continue
+            keep_days = self.keep_days.get(file_category(record)) or 0
+            finished_at = record['finished_at'] or record['created_at']
+            if keep_days and finished_at and finished_at < (now - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S'):
+                if self._remove(record['file_path'], 'expired') >= 0:
+                    expired_ids.append(record['file_id'])
+                    continue
+            kept.append(record)
+        self.db.delete_file_records(expired_ids)
+        return kept
+
+    def _upload_dir_files(self) -> Dict[str, os.stat_result]:
+        """上传目录中的所有文件 {真实路径: stat}"""
+        files = {}
+        for root, _, names in os.walk(self.upload_dir):
+            for name in names:
+                path = os.path.realpath(os.path.join(root, name))
+                try:
+                    files[path] = os.stat(path)
+                except OSError:
+                    continue
+        return files
+
+    def _enforce_quota(self, records: List[Dict], disk_files: Dict[str, os.stat_result]) -> int:
+        """
+        上传目录超过容量上限时按最近访问时间删除已结束任务的源文件
+        :return: 删除后上传目录的大小（字节）
+        """
+        used = sum(stat.st_size for stat in disk_files.values())
+        if not self.max_upload_bytes or used <= self.max_upload_bytes:
+            return used
+
+        candidates = []
+        for record in records:
+            if record['task_status'] not in TERMINAL_STATUSES or file_category(record) != CATEGORY_ORIGINAL:
+                continue
+            stat = disk_files.get(os.path.realpath(record['file_path']))
+            if stat is not None:
+                candidates.append((max(stat.st_atime, stat.st_mtime), record))
+
+        evicted_ids = []
+        for _, record in sorted(candidates, key=lambda item: item[0]):
+            if used <= self.max_upload_bytes:
+                break
+            freed = self._remove(record['file_path'], 'quota')
+            if freed >= 0:
+                used -= freed
+                evicted_ids.append(record['file_id'])
+        self.db.delete_file_records(evicted_ids)
+        if used > self.max_upload_bytes:
+            logging.warning(f"上传目录仍超出容量上限: {used} / {self.max_upload_bytes} 字节，"
+                            f"剩余文件属于未结束的任务或非源文件")
+        return used
+
+    def _is_render_cache(self, path: str) -> bool:
+        return path.startswith(self.render_cache_dir + os.sep)
+
+    def _remove_orphans(self, disk_files: Dict[str, os.stat_result]) -> int:
+        """
+        删除上传目录中没有被任何记录引用、且超过宽限期的文件，渲染缓存和上传临时文件不在此清理
+        :return: 删除的文件数
+        """
+        referenced = {os.path.realpath(path) for path in self.db.get_referenced_file_paths()}
+        cutoff = time.time() - self.orphan_grace_seconds
+        removed = 0
+        for path, stat in disk_files.items():
+            if path in referenced or stat.st_mtime > cutoff:
+                continue
+            if self._is_render_cache(path) or os.path.basename(path).startswith(UPLOAD_TEMP_PREFIX):
+                continue
+            if self._remove(path, 'orphan') > 0:
+                removed += 1
+        return removed
+
+    def _prune_render_cache(self, disk_files: Dict[str, os.stat_result]) -> int:
+        """
+        删除超过 render_cache_days 天未使用的渲染缓存（命中缓存时会更新文件的修改时间）
+        正在写入的临时文件同样至少保留孤立文件的宽限期
+        :return: 删除的文件数
+        """
+        if not self.render_cache_seconds:
+            return 0
+        cutoff = time.time() - max(self.render_cache_seconds, self.orphan_grace_seconds)
+        removed = 0
+        for path, stat in disk_files.items():
+            if self._is_render_cache(path) and stat.st_mtime <= cutoff:
+                if self._remove(path, 'render_cache') > 0:
+                    removed += 1
+        return removed
+
+    def _archive_tasks(self, now: datetime) -> int:
+        """将结束超过 archive_after_days 天的任务移入归档表"""
+        if not self.archive_after_days:
+            return 0
+        finished_before = (now - timedelta(days=self.archive_after_days)).strftime('%Y-%m-%d %H:%M:%S')
+        archived = 0
+        while True:
+            count = self.db.archive_tasks(finished_before)
+            archived += count
+            if count == 0:
+                break
+        if archived:
+            TASKS_ARCHIVED.inc(archived)
+            logging.info(f"已归档 {archived} 个任务")
+        return archived
+
+    def sweep_once(self) -> Dict:
+        """
+        执行一次清理
+        :return: 清理结果统计
+        """
+        now = datetime.now()
+        records = self._expire_files(self.db.get_files_with_task_state(), now)
+        upload_bytes = self._enforce_quota(records, self._upload_dir_files())
+        disk_files = self._upload_dir_files()
+        orphans = self._remove_orphans(disk_files)
+        cache_removed = self._prune_render_cache(disk_files)
+        archived = self._archive_tasks(now)
+
+        vacuumed = False
+        if self.vacuum_interval_seconds and time.time() - self._vacuumed_at >= self.vacuum_interval_seconds:
+            self._vacuumed_at = time.time()
+            vacuumed = self.db.vacuum()
+            if vacuumed:
+                logging.info("数据库整理完成")
+
+        upload_bytes = sum(stat.st_size for stat in self._upload_dir_files().values())
+        UPLOAD_DIR_BYTES.set(upload_bytes)
+        return {
+            'upload_bytes': upload_bytes,
+            'orphans_removed': orphans,
+            'render_cache_removed': cache_removed,
+            'tasks_archived': archived,
+            'vacuumed': vacuumed
+        }
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sweep_once()
+            except Exception as e:
+                logging.error(f"清理上传目录失败: {str(e)}")
+
+    def start(self):
+        """在后台线程中开始定期清理"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logging.info(f"开始定期清理 {self.upload_dir}，每 {self.interval} 秒一次")
+
+    def stop(self):
+        """停止清理"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+def create_retention_sweeper(processor, config: Dict, upload_dir: str) -> Optional[RetentionSweeper]:
+    """
+    根据 retention 配置创建清理器
+    :param config: retention 配置节
+    :param upload_dir: 上传目录
+    :return: 未启用时返回None
+    """
+    if not config.get('enabled', False):
+        return None
+    return RetentionSweeper(
+        processor,
+        upload_dir,
+        keep_days=config.get('keep_days') or {},
+        max_upload_gb=config.get('max_upload_gb', 0),
+        orphan_grace_hours=config.get('orphan_grace_hours', 24),
+        archive_after_days=config.get('archive_after_days', 30),
+        vacuum_interval_hours=config.get('vacuum_interval_hours', 168),
+        render_cache_days=config.get('render_cache_days', 7),
+        interval=config.get('interval_minutes', 60) * 60
+    )
@@ -0,0 +1,194 @@
+import threading
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+# 支持的调度策略
+SCHEDULING_POLICIES = ('fifo', 'sjf', 'priority')
+
+class TaskScheduler:
+    """
+    单个处理阶段的任务队列，以 tasks 表作为持久化队列
+    多个工作进程（或共享数据库的多台机器）通过租约领取任务，租约过期的任务会被重新领取
+
+    调度策略：
+    - fifo: 先进先出
+    - sjf: 预计耗时最短的任务优先（shortest-expected-job-first）
+    - priority: 显式优先级高的任务优先
+    两种非FIFO策略都支持老化（aging），等待越久的任务得分越高，避免长任务饿死
+    """
+
+    def __init__(self, db, stage: str, num_workers: int = 1, policy: str = 'sjf',
+                 sjf_aging_factor: float = 0.5, priority_aging_per_minute: float = 1.0,
+                 lease_seconds: float = 60, poll_interval: float = 1.0, max_attempts: int = 3,
+                 urgent_priority: Optional[int] = None, admission=None, claim_window: int = 1000):
+        """
+        :param db: Database 实例
+        :param stage: 队列对应的处理阶段
+        :param num_workers: 处理该阶段的工作线程数，用于估算开始时间
+        :param policy: 调度策略
+        :param sjf_aging_factor: sjf策略下每等待1秒抵扣的预计耗时（秒）
+        :param priority_aging_per_minute: priority策略下每等待1分钟增加的优先级
+        :param lease_seconds: 领取任务的租约时长，持有者需在过期前续期
+        :param poll_interval: 队列为空时轮询数据库的间隔（秒）
+        :param max_attempts: 任务在同一阶段因租约过期被重新领取的最大次数
+        :param urgent_priority: 启用抢占时，优先级不低于该值的任务无论调度策略如何都最先执行
+        :param admission: 准入检查，提供 admit(entry) 和 release(task_id)；
+                          admit 返回False的任务本次不领取，继续留在队列中（如模型内存不足）
+        :param claim_window: 每次领取时按调度得分取出的候选任务数（排序在数据库中完成）
+        """
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f"不支持的调度策略: {policy}")
+        self.db = db
+        self.stage = stage
+        self.num_workers = max(1, num_workers)
+        self.policy = policy
+        self.sjf_aging_factor = sjf_aging_factor
+        self.priority_aging_per_minute = priority_aging_per_minute
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.urgent_priority = urgent_priority
+        self.admission = admission
+        self.claim_window = claim_window
+        self._condition = threading.Condition()
+
+    def _score(self, entry: Dict, now: float) -> tuple:
+        """计算调度得分，得分越小越先执行"""
+        enqueued_at = entry['enqueued_at'] or now
+        wait = now - enqueued_at
+        if self.policy == 'sjf':
+            score = (entry['stage_cost'] or 0) - self.sjf_aging_factor * wait
+        elif self.policy == 'priority':
+            score = -((entry['priority'] or 0) + self.priority_aging_per_minute * wait / 60)
+        else:
+            score = 0
+        urgent = self.urgent_priority is not None and (entry['priority'] or 0) >= self.urgent_priority
+        return (0 if urgent else 1, score, enqueued_at, entry['task_id'])
+
+    def _order_sql(self, now: float) -> Tuple[str, tuple]:
+        """
+        与 _score 顺序一致的 SQL 排序表达式，使数据库只返回得分最小的候选任务
+        老化项与等待时间成线性关系，按入队时间展开后排序与当前时间无关
+        :return: (ORDER BY 表达式, 参数)
+        """
+        enqueued_at = 'COALESCE(enqueued_at, ?)'
+        if self.policy == 'sjf':
+            score, params = f'COALESCE(stage_cost, 0) + ? * {enqueued_at}', (self.sjf_aging_factor, now)
+        elif self.policy == 'priority':
+            score, params = (f'-COALESCE(priority, 0) + ? * {enqueued_at}',
+                             (self.priority_aging_per_minute / 60, now))
+        else:
+            score, params = '0', ()
+        if self.urgent_priority is not None:
+            score = f'CASE WHEN COALESCE(priority, 0) >= ? THEN 0 ELSE 1 END, {score}'
+            params = (self.urgent_priority, *params)
+        return f'{score}, {enqueued_at}, task_id', (*params, now)
+
+    def _choose(self, candidates: List[Dict], now: float) -> Dict:
+        return min(candidates, key=lambda entry: self._score(entry, now))
+
+    def _admitted_chooser(self, admitted: List[str]):
+        """按调度顺序选出第一个通过准入检查的任务，通过检查的任务ID记录在 admitted 中"""
+        def choose(candidates: List[Dict], now: float) -> Optional[Dict]:
+            for entry in sorted(candidates, key=lambda item: self._score(item, now)):
+                if self.admission.admit(entry):
+                    admitted.append(entry['task_id'])
+                    return entry
+            return None
+        return choose
+
+    def put(self, task_id: str, task_data: Dict, stage_cost: float, progress: int, message: str,
+            lease_owner: Optional[str] = None, status: str = 'queued') -> bool:
+        """
+        将任务放入本阶段队列
+        :param task_data: 阶段间传递的任务数据
+        :param stage_cost: 本阶段的预计耗时（秒），参与排序
+        :param lease_owner: 由上一阶段转入时传入当前租约持有者，租约已丢失则不会入队
+        :param status: 入队后的状态，被抢占的任务为 paused，恢复前不会被领取
+        :return: 是否入队成功
+        """
+        success = self.db.enqueue_stage(task_id, self.stage, task_data, stage_cost,
+                                        progress, message, lease_owner=lease_owner, status=status)
+        if success:
+            with self._condition:
+                self._condition.notify()
+        return success
+
+    def get(self, lease_owner: str, stop_event: Optional[threading.Event] = None) -> Optional[Dict]:
+        """
+        按调度策略领取下一个任务，队列为空时阻塞
+        :param lease_owner: 租约持有者标识
+        :param stop_event: 设置后停止等待并返回None
+        """
+        while not (stop_event and stop_event.is_set()):
+            admitted: List[str] = []
+            choose = self._admitted_chooser(admitted) if self.admission else self._choose
+            order_by, order_params = self._order_sql(time.time())
+            task = self.db.claim_task(self.stage, lease_owner, self.lease_seconds,
+                                      choose, max_attempts=self.max_attempts, order_by=order_by,
+                                      order_params=order_params, window=self.claim_window)
+            # 通过准入检查但最终未被领取的任务（超过最大尝试次数或领取失败）释放预留
+            for task_id in admitted:
+                if not task or task_id != task['task_id']:
+                    self.admission.release(task_id)
+            if task:
+                logging.info(f"调度任务 {task['task_id']} 到阶段 {self.stage}（策略: {self.policy}）")
+                return task
+            # 本进程入队时会立即唤醒，其他进程入队的任务通过轮询发现
+            with self._condition:
+                self._condition.wait(self.poll_interval)
+        return None
+
+    def wake_all(self) -> None:
+        """唤醒所有等待中的工作线程"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def qsize(self) -> int:
+        """队列中等待的任务数"""
+        waiting, _ = self.db.get_stage_tasks(self.stage)
+        return len(waiting)
+
+    def active_count(self) -> int:
+        """正在处理（持有有效租约）的任务数"""
+        _, running = self.db.get_stage_tasks(self.stage)
+        return len(running)
+
+    def get_queue_snapshot(self) -> List[Dict]:
+        """
+        获取当前排队情况
+        :return: 按执行顺序排列的任务列表，包含队列位置、预计耗时和预计开始时间
+        """
+        waiting, running = self.db.get_stage_tasks(self.stage)
+        now = time.time()
+        # 每个工作线程预计空闲的时间点
+        worker_free_at = sorted(
+            now + max(0, (row['stage_cost'] or 0) - (now - (row['stage_started_at'] or now)))
+            for row in running
+        )[:self.num_workers]
+        worker_free_at += [now] * (self.num_workers - len(worker_free_at))
+
+        snapshot = []
+        ordered = sorted(waiting, key=lambda entry: self._score(entry, now))
+        for position, entry in enumerate(ordered, 1):
+            # 任务分配给最早空闲的工作线程
+            worker_free_at.sort()
+            start_at = worker_free_at[0]
+            worker_free_at[0] = start_at + (entry['stage_cost'] or 0)
+            snapshot.append({
+                'task_id': entry['task_id'],
+                'queue_position': position,
+                'expected_cost': round(entry['stage_cost'] or 0, 1),
+                'priority': entry['priority'] or 0,
+                'estimated_start_time': start_at,
+                'estimated_wait_seconds': round(start_at - now, 1)
+            })
+        return snapshot
+
+    def get_position(self, task_id: str) -> Optional[Dict]:
+        """获取单个任务的排队信息，不在队列中时返回None"""
+        for item in self.get_queue_snapshot():
+            if item['task_id'] == task_id:
+                return item
+        return None
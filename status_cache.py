@@ -0,0 +1,110 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+class StatusCache:
+    """
+    进程内的任务状态视图，按状态版本号增量同步
+    数据库在任务的可见状态变化时递增 status_version（见 Database.init_db 中的触发器），
+    缓存按间隔只读取版本号更大的任务，轮询状态的请求直接从内存返回，不再逐个查询数据库。
+    其他工作进程的状态变化同样通过版本号同步
+    """
+
+    def __init__(self, db, refresh_interval: float = 0.5, max_tasks: int = 10000):
+        """
+        :param db: Database 实例
+        :param refresh_interval: 两次同步之间的最短间隔（秒）
+        :param max_tasks: 缓存的最大任务数，超过后淘汰最久未变化的任务
+        """
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.max_tasks = max_tasks
+        # 按最近一次变化的顺序排列，最新变化的在末尾
+        self._tasks: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._version = db.get_status_version()
+        # 版本号不大于该值的变化可能不在缓存中（启动前的变化及被淘汰的任务）
+        self._floor = self._version
+        self._refreshed_at = time.time()
+        # 依赖于当前版本的派生数据（如队列快照），版本变化时清空
+        self._memo: Dict = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def _store(self, task: Dict, changed: bool) -> None:
+        task_id = task['task_id']
+        self._tasks[task_id] = task
+        # 按需加载的旧任务放在最前面，保持版本号从前到后递增
+        self._tasks.move_to_end(task_id, last=changed)
+        while len(self._tasks) > self.max_tasks:
+            _, evicted = self._tasks.popitem(last=False)
+            self._floor = max(self._floor, evicted.get('status_version') or 0)
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        从数据库同步变化的任务，距上次同步不足 refresh_interval 时跳过
+        :return: 当前版本号
+        """
+        with self._lock:
+            if not force and time.time() - self._refreshed_at < self.refresh_interval:
+                return self._version
+            self._refreshed_at = time.time()
+            changed = self.db.get_tasks_since(self._version)
+            for task in changed:
+                self._store(task, changed=True)
+            if changed:
+                self._version = max(self._version, changed[-1]['status_version'] or 0)
+                self._memo.clear()
+            return self._version
+
+    def get_task(self, task_id: str) -> Optional[Dict]:
+        """获取任务状态（副本），不在缓存中时从数据库加载"""
+        self.refresh()
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                return dict(task)
+        task = self.db.get_task(task_id)
+        if task is None:
+            return None
+        with self._lock:
+            if task_id not in self._tasks:
+                self._store(task, changed=False)
+        return dict(task)
+
+    def changes_since(self, since: int) -> Tuple[int, List[Dict]]:
+        """
+        获取版本号大于 since 的任务
+        :return: (当前版本号, 变化的任务列表，按版本号升序)
+        """
+        version = self.refresh()
+        with self._lock:
+            if since >= self._floor:
+                changed = []
+                for task in reversed(self._tasks.values()):
+                    if (task.get('status_version') or 0) <= since:
+                        break
+                    changed.append(dict(task))
+                changed.reverse()
+                return version, changed
+        # 请求的版本早于缓存覆盖的范围，直接查询数据库
+        logging.debug(f"状态版本 {since} 早于缓存范围，从数据库读取")
+        return version, [task for task in self.db.get_tasks_since(since)
+                         if (task['status_version'] or 0) <= version]
+
+    def memoize(self, key, compute: Callable):
+        """按当前版本缓存派生数据，版本变化后重新计算"""
+        version = self.refresh()
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+        value = compute()
+        with self._lock:
+            # 计算期间版本已变化时不缓存，避免旧数据被当作新版本的结果
+            if self._version == version:
+                self._memo[key] = value
+        return value
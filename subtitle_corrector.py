@@ -1,10 +1,14 @@
 import os
+import math
 import logging
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from concurrent.futures import ThreadPoolExecutor
 import concurrent.futures
 from config_manager import ConfigManager
 from ai_service import AIService
+from token_budget import LatencyTracker, estimate_tokens
+from cancellation import cancel_futures
+import tracing
 import re
 
 class SubtitleCorrector:
@@ -14,7 +18,9 @@ class SubtitleCorrector:
         self.batch_size = config.get('batch_size', 10)
         self.max_workers = config.get('max_workers', 3)
         self.scene_gap = config.get('scene_gap', 2.0)  # 场景切换的时间间隔（秒）
+        self.config = config
         self.ai_service = AIService()
+        self.latency_tracker = LatencyTracker()
         print("初始化SubtitleCorrector")
 
     def _parse_timestamp(self, timestamp: str) -> Tuple[float, float]:
@@ -27,36 +33,24 @@ class SubtitleCorrector:
         
         return time_to_seconds(start), time_to_seconds(end)
 
-    def _detect_scenes(self, blocks: List[str]) -> List[List[Dict]]:
+    def _get_token_budget(self) -> int:
+        """根据模型观测到的每token延迟计算单个场景的token预算"""
+        return self.latency_tracker.token_budget(self.ai_service.stage_model('correct'), self.config, default_budget=600)
+
+    def _detect_scenes(self, blocks: List[str], token_budget: Optional[int] = None) -> List[List[Dict]]:
         """
         检测场景，将字幕分组
         返回场景列表，每个场景包含多个字幕块
         
         场景切分规则：
         1. 时间间隔超过阈值
-        2. 当前场景字幕数量达到最大限制
+        2. 当前场景的token数达到预算（按总量均分，使各场景开销接近）
         3. 检测到明显的语义分隔符
         """
-        scenes = []
-        current_scene = []
-        last_end_time = 0
-        max_scene_size = 15  # 每个场景最大字幕数量
-        min_scene_size = 3   # 每个场景最小字幕数量
-
-        def should_start_new_scene(block_data, current_scene_size):
-            # 时间间隔条件
-            time_gap = block_data['start_time'] - last_end_time > self.scene_gap
-            # 场景大小条件
-            size_limit = current_scene_size >= max_scene_size
-            # 语义分隔条件（检查是否包含明显的语义分隔符）
-            semantic_break = any(marker in block_data['text'] for marker in ['。。。', '...', '？', '！'])
-            
-            # 如果当前场景太小，即使满足其他条件也不切分
-            if current_scene_size < min_scene_size:
-                return False
-                
-            return (time_gap and semantic_break) or size_limit
+        if token_budget is None:
+            token_budget = self._get_token_budget()
 
+        block_datas = []
         for block in blocks:
             lines = block.split('\n')
             if len(lines) < 3:
@@ -68,51 +62,109 @@ class SubtitleCorrector:
             
             start_time, end_time = self._parse_timestamp(timestamp)
             
-            block_data = {
+            block_datas.append({
                 'index': index,
                 'timestamp': timestamp,
                 'text': text,
                 'start_time': start_time,
-                'end_time': end_time
-            }
+                'end_time': end_time,
+                'tokens': estimate_tokens(text) + 1  # 换行符
+            })
+
+        # 按总token数计算均衡后的场景目标大小
+        total_tokens = sum(block_data['tokens'] for block_data in block_datas)
+        scene_count = max(1, math.ceil(total_tokens / token_budget))
+        target_tokens = total_tokens / scene_count
+
+        scenes = []
+        current_scene = []
+        current_tokens = 0
+        last_end_time = 0
+        min_scene_size = 3   # 每个场景最小字幕数量
 
+        def should_start_new_scene(block_data, current_scene_size):
+            # 超过预算必须切分，避免超出模型上下文限制
+            if current_tokens + block_data['tokens'] > token_budget:
+                return True
+            # 场景大小条件
+            size_limit = current_tokens >= target_tokens
+            # 时间间隔条件
+            time_gap = block_data['start_time'] - last_end_time > self.scene_gap
+            # 语义分隔条件（检查是否包含明显的语义分隔符）
+            semantic_break = any(marker in block_data['text'] for marker in ['。。。', '...', '？', '！'])
+            
+            # 如果当前场景太小，即使满足其他条件也不切分
+            if current_scene_size < min_scene_size:
+                return False
+                
+            return (time_gap and semantic_break) or size_limit
+
+        for block_data in block_datas:
             # 判断是否应该开始新场景
             if current_scene and should_start_new_scene(block_data, len(current_scene)):
                 scenes.append(current_scene)
-                logging.info(f"场景切换，当前场景大小: {len(current_scene)}")
+                logging.info(f"场景切换，当前场景大小: {len(current_scene)}, token数: {current_tokens}")
                 current_scene = []
+                current_tokens = 0
             
             current_scene.append(block_data)
-            last_end_time = end_time
+            current_tokens += block_data['tokens']
+            last_end_time = block_data['end_time']
 
         # 添加最后一个场景
         if current_scene:
             scenes.append(current_scene)
 
         # 输出场景统计信息
-        scene_sizes = [len(scene) for scene in scenes]
-        logging.info(f"场景数量: {len(scenes)}, 场景大小分布: 最小{min(scene_sizes)}, 最大{max(scene_sizes)}, 平均{sum(scene_sizes)/len(scenes):.1f}")
+        if scenes:
+            scene_tokens = [self._scene_tokens(scene) for scene in scenes]
+            logging.info(f"场景数量: {len(scenes)}, token预算: {token_budget}, 场景token分布: 最小{min(scene_tokens)}, 最大{max(scene_tokens)}, 平均{sum(scene_tokens)/len(scenes):.1f}")
 
         return scenes
 
-    def _merge_small_scenes(self, scenes: List[List[Dict]], min_subtitles: int = 5) -> List[List[Dict]]:
-        """合并过小的场景"""
+    def _scene_tokens(self, scene: List[Dict]) -> int:
+        """计算场景的token数"""
+        return sum(block['tokens'] for block in scene)
+
+    def _merge_small_scenes(self, scenes: List[List[Dict]], min_tokens: Optional[int] = None,
+                            token_budget: Optional[int] = None) -> List[List[Dict]]:
+        """
+        合并过小的场景
+        :param min_tokens: 场景的最小token数，默认为预算的三分之一
+        :param token_budget: 合并后场景的token上限
+        """
+        if token_budget is None:
+            token_budget = self._get_token_budget()
+        if min_tokens is None:
+            min_tokens = token_budget // 3
+
         merged_scenes = []
         current_scene = []
+        current_tokens = 0
         
         for scene in scenes:
+            scene_tokens = self._scene_tokens(scene)
+            # 合并后会超出预算时，先保存当前场景
+            if current_scene and current_tokens + scene_tokens > token_budget:
+                merged_scenes.append(current_scene)
+                current_scene = []
+                current_tokens = 0
+
             current_scene.extend(scene)
+            current_tokens += scene_tokens
             
-            # 如果当前合并场景的字幕数量达到阈值，保存并开始新的场景
-            if len(current_scene) >= min_subtitles:
+            # 如果当前合并场景的token数达到阈值，保存并开始新的场景
+            if current_tokens >= min_tokens:
                 merged_scenes.append(current_scene)
                 current_scene = []
+                current_tokens = 0
         
         # 添加最后一个场景
         if current_scene:
             if merged_scenes:
-                # 如果最后的场景太小，合并到前一个场景
-                if len(current_scene) < min_subtitles:
+                # 如果最后的场景太小且合并后不超预算，合并到前一个场景
+                if (current_tokens < min_tokens and
+                        self._scene_tokens(merged_scenes[-1]) + current_tokens <= token_budget):
                     merged_scenes[-1].extend(current_scene)
                 else:
                     merged_scenes.append(current_scene)
@@ -121,6 +173,11 @@ class SubtitleCorrector:
         
         return merged_scenes
 
+    def _process_scene_traced(self, scene: List[Dict]) -> List[str]:
+        """处理单个场景，并在任务追踪中记录为一个 span"""
+        with tracing.span('scene', lines=len(scene), tokens=self._scene_tokens(scene)):
+            return self._process_scene(scene)
+
     def _process_scene(self, scene: List[Dict]) -> List[str]:
         """处理单个场景"""
         try:
@@ -197,10 +254,11 @@ class SubtitleCorrector:
         
         return result_blocks
 
-    def correct_srt(self, srt_file: str) -> str:
+    def correct_srt(self, srt_file: str, cancel_token=None) -> str:
         """
         纠正SRT文件中的识别错误（基于场景的批处理版本）
         :param srt_file: SRT文件路径
+        :param cancel_token: 取消令牌，取消时丢弃尚未开始的场景请求
         :return: 纠正后的SRT文件路径
         """
         print("开始纠正字幕文件: ",srt_file)
@@ -213,34 +271,49 @@ class SubtitleCorrector:
             # 将SRT内容分成块
             blocks = content.strip().split('\n\n')
             
+            # 按模型的观测延迟计算每个请求的token预算
+            token_budget = self._get_token_budget()
+
             # 检测场景
-            scenes = self._detect_scenes(blocks)
+            scenes = self._detect_scenes(blocks, token_budget)
             
             # 合并小场景
-            merged_scenes = self._merge_small_scenes(scenes)
+            merged_scenes = self._merge_small_scenes(scenes, token_budget=token_budget)
             
             logging.info(f"检测到 {len(merged_scenes)} 个场景")
 
             # 使用线程池并行处理场景
             corrected_blocks = []
             with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                # 提交所有场景的处理任务
+                # 提交所有场景的处理任务，开销大的场景先提交以缩短尾部等待
+                submit_order = sorted(range(len(merged_scenes)),
+                                      key=lambda i: self._scene_tokens(merged_scenes[i]),
+                                      reverse=True)
                 future_to_scene = {
-                    executor.submit(self._process_scene, scene): i 
-                    for i, scene in enumerate(merged_scenes)
+                    executor.submit(tracing.bind(self._process_scene_traced), merged_scenes[i]): i
+                    for i in submit_order
                 }
+                cancel_pending = cancel_futures(future_to_scene)
+                if cancel_token:
+                    cancel_token.add_callback(cancel_pending)
 
                 # 收集结果
                 all_results = []
-                for future in concurrent.futures.as_completed(future_to_scene):
-                    scene_index = future_to_scene[future] 
-                    try:
-                        result = future.result()
-                        all_results.append((scene_index, result))
-                        logging.info(f"场景 {scene_index + 1}/{len(merged_scenes)} 处理完成")
-                    except Exception as e:
-                        logging.error(f"处理场景 {scene_index} 时出错: {str(e)}")
-                        raise
+                try:
+                    for future in concurrent.futures.as_completed(future_to_scene):
+                        if cancel_token:
+                            cancel_token.check()
+                        scene_index = future_to_scene[future] 
+                        try:
+                            result = future.result()
+                            all_results.append((scene_index, result))
+                            logging.info(f"场景 {scene_index + 1}/{len(merged_scenes)} 处理完成")
+                        except Exception as e:
+                            logging.error(f"处理场景 {scene_index} 时出错: {str(e)}")
+                            raise
+                finally:
+                    if cancel_token:
+                        cancel_token.remove_callback(cancel_pending)
                 # 按原始顺序排序结果
                 logging.info("按原始顺序排序结果")
                 all_results.sort(key=lambda x: x[0])
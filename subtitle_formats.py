@@ -0,0 +1,218 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import zipfile
+import threading
+from typing import Dict, List, Tuple
+
+def _srt_time_to_seconds(value: str) -> float:
+    h, m, s = value.strip().replace(',', '.').split(':')
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+def _split_time(seconds: float) -> Tuple[int, int, int, int]:
+    """拆分为 (时, 分, 秒, 毫秒)"""
+    total_ms = max(0, int(round(seconds * 1000)))
+    return total_ms // 3600000, total_ms // 60000 % 60, total_ms // 1000 % 60, total_ms % 1000
+
+def parse_srt(content: str) -> List[Dict]:
+    """
+    解析SRT内容
+    :return: 字幕段列表 [{index, start, end, text}]，时间单位为秒
+    """
+    segments = []
+    for block in content.replace('\r\n', '\n').strip().split('\n\n'):
+        lines = block.strip().split('\n')
+        # 序号行可能缺失，以时间轴行定位
+        for i, line in enumerate(lines[:2]):
+            if ' --> ' in line:
+                break
+        else:
+            continue
+        try:
+            start, end = lines[i].split(' --> ')
+            segments.append({
+                'index': len(segments) + 1,
+                'start': _srt_time_to_seconds(start),
+                'end': _srt_time_to_seconds(end.split()[0]),
+                'text': '\n'.join(lines[i + 1:]).strip()
+            })
+        except ValueError:
+            logging.warning(f"跳过无法解析的字幕块: {block[:50]}")
+    return segments
+
+def render_srt(segments: List[Dict]) -> str:
+    def timestamp(seconds):
+        return '%02d:%02d:%02d,%03d' % _split_time(seconds)
+    return '\n\n'.join(
+        f"{i}\n{timestamp(seg['start'])} --> {timestamp(seg['end'])}\n{seg['text']}"
+        for i, seg in enumerate(segments, 1)
+    ) + '\n'
+
+def render_vtt(segments: List[Dict]) -> str:
+    def timestamp(seconds):
+        return '%02d:%02d:%02d.%03d' % _split_time(seconds)
+    cues = [
+        # 空行会提前结束 WebVTT 的字幕块
+        f"{timestamp(seg['start'])} --> {timestamp(seg['end'])}\n"
+        + '\n'.join(line for line in seg['text'].split('\n') if line.strip()).replace('-->', '->')
+        for seg in segments
+    ]
+    return 'WEBVTT\n\n' + '\n\n'.join(cues) + '\n'
+
+_ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+WrapStyle: 0
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,60,&H00FFFFFF,&H000000FF,&H00000000,&H64000000,0,0,0,0,100,100,0,0,1,2,1,2,30,30,40,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+def render_ass(segments: List[Dict]) -> str:
+    def timestamp(seconds):
+        h, m, s, ms = _split_time(seconds)
+        return '%d:%02d:%02d.%02d' % (h, m, s, ms // 10)
+    events = []
+    for seg in segments:
+        # 花括号在 ASS 中表示样式覆盖标签，替换为全角避免被解析
+        text = seg['text'].replace('{', '｛').replace('}', '｝').replace('\n', '\\N')
+        events.append(f"Dialogue: 0,{timestamp(seg['start'])},{timestamp(seg['end'])},Default,,0,0,0,,{text}")
+    return _ASS_HEADER + '\n'.join(events) + '\n'
+
+def render_json(segments: List[Dict]) -> str:
+    return json.dumps({'segments': [
+        {'index': i, 'start': round(seg['start'], 3), 'end': round(seg['end'], 3), 'text': seg['text']}
+        for i, seg in enumerate(segments, 1)
+    ]}, ensure_ascii=False, indent=2)
+
+# 支持导出的格式
+EXPORT_FORMATS = {
+    'srt': {'render': render_srt, 'mimetype': 'application/x-subrip'},
+    'vtt': {'render': render_vtt, 'mimetype': 'text/vtt'},
+    'ass': {'render': render_ass, 'mimetype': 'text/x-ssa'},
+    'json': {'render': render_json, 'mimetype': 'application/json'},
+}
+
+def render_subtitle(content: str, output_format: str) -> str:
+    """将SRT内容转换为指定格式"""
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的字幕格式: {output_format}")
+    return EXPORT_FORMATS[output_format]['render'](parse_srt(content))
+
+def export_filename(filename: str, output_format: str) -> str:
+    """将文件名的扩展名替换为导出格式"""
+    return f"{os.path.splitext(filename)[0]}.{output_format}"
+
+class RenderCache:
+    """
+    按源文件的 SHA-256 缓存转换后的字幕和打包文件
+    源文件内容不变时重复下载直接返回磁盘上的结果，缓存键同时用作 ETag。
+    缓存文件在命中时更新修改时间，超过 retention.render_cache_days 天未使用的缓存由清理器
+    （RetentionSweeper._prune_render_cache）删除，不参与孤立文件清理
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        :param cache_dir: 缓存目录
+        """
+        self.cache_dir = cache_dir
+        # 文件路径 -> ((大小, 修改时间), SHA-256)，避免每次请求都重新计算校验值
+        self._hashes: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._lock = threading.Lock()
+
+    def file_hash(self, path: str) -> str:
+        """源文件的 SHA-256，文件未变化时使用上次的结果"""
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        with self._lock:
+            if len(self._hashes) > 10000:
+                self._hashes.clear()
+            self._hashes[path] = (signature, digest)
+        return digest
+
+    def _lookup(self, key: str, build) -> str:
+        """返回缓存文件路径，不存在时调用 build(临时路径) 生成"""
+        path = os.path.join(self.cache_dir, key)
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 先写入临时文件再重命名，并发请求不会读到不完整的文件
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            build(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path
+
+    def render(self, source_path: str, output_format: str) -> Tuple[str, str]:
+        """
+        获取转换为指定格式的字幕文件
+        :return: (缓存文件路径, 缓存键)
+        """
+        if output_format not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的字幕格式: {output_format}")
+        key = f"{self.file_hash(source_path)}.{output_format}"
+
+        def build(temp_path):
+            with open(source_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(render_subtitle(content, output_format))
+
+        return self._lookup(key, build), key
+
+    def bundle(self, entries: List[Tuple[str, str]], formats: List[str]) -> Tuple[str, str]:
+        """
+        将多个字幕文件按指定格式打包为 zip
+        :param entries: [(源文件路径, 包内文件名)]
+        :param formats: 导出格式列表
+        :return: (缓存文件路径, 缓存键)
+        """
+        for output_format in formats:
+            if output_format not in EXPORT_FORMATS:
+                raise ValueError(f"不支持的字幕格式: {output_format}")
+        members = []
+        used_names = set()
+        for source_path, filename in entries:
+            for output_format in formats:
+                name = export_filename(filename, output_format)
+                base, extension = os.path.splitext(name)
+                suffix = 2
+                while name in used_names:
+                    name = f"{base}_{suffix}{extension}"
+                    suffix += 1
+                used_names.add(name)
+                members.append((source_path, name, output_format))
+        key = hashlib.sha256(json.dumps(
+            [[self.file_hash(source_path), name, output_format] for source_path, name, output_format in members]
+        ).encode('utf-8')).hexdigest() + '.zip'
+
+        def build(temp_path):
+            with zipfile.ZipFile(temp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for source_path, name, output_format in members:
+                    archive.write(self.render(source_path, output_format)[0], arcname=name)
+
+        return self._lookup(key, build), key
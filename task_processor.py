@@ -1,48 +1,283 @@
 import threading
-import queue
 import logging
 import os
+import json
+import hashlib
+import base64
 import genSrt
+import whisper_models
 from translator import Translator
 from subtitle_corrector import SubtitleCorrector
 from config_manager import ConfigManager
 import concurrent.futures
 import time
 import uuid
+import socket
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Dict, Tuple, Optional, List
 from datetime import datetime
-from database import Database
+from database import Database, TERMINAL_STATUSES
+from scheduler import TaskScheduler
+from eta_predictor import EtaPredictor, srt_statistics
+from model_pool import ModelPool
+from status_cache import StatusCache
+from metrics import CHECKPOINT_LOOKUPS, QUEUE_DEPTH, STAGE_ACTIVE, STAGE_DURATION, TASKS_FINISHED
+from cancellation import CancelToken, TaskCancelled, cancel_futures
+from ingest import get_file_type
+import tracing
+import llm_usage
+from profiler import MODE_SAMPLING, PROFILE_EXTENSIONS, profile_call, resolve_mode
+
+def parse_target_langs(value) -> List[str]:
+    """
+    解析目标语言，支持列表或以逗号分隔的字符串，去重并保持顺序
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    langs = []
+    for item in value:
+        for lang in item.split(','):
+            lang = lang.strip()
+            if lang and lang not in langs:
+                langs.append(lang)
+    return langs
+
+# 处理阶段，每个阶段由独立的工作线程池处理
+STAGE_EXTRACT = 'extract'   # ffmpeg 提取音频
+STAGE_ASR = 'asr'           # Whisper 语音识别
+STAGE_LLM = 'llm'           # 字幕纠正、翻译及收尾
+STAGES = [STAGE_EXTRACT, STAGE_ASR, STAGE_LLM]
+
+# 进入各阶段队列时显示的等待信息
+STAGE_WAITING_MESSAGES = {
+    STAGE_EXTRACT: '等待提取音频...',
+    STAGE_ASR: '等待语音识别...',
+    STAGE_LLM: '等待字幕纠正和翻译...'
+}
+
+# 进入各阶段时的进度
+STAGE_START_PROGRESS = {
+    STAGE_EXTRACT: 0,
+    STAGE_ASR: 20,
+    STAGE_LLM: 40
+}
+
+# 检查点名称，翻译结果的检查点为 translate:<语言>
+CHECKPOINT_EXTRACT = 'extract'      # 提取的音频
+CHECKPOINT_ASR = 'asr'              # 语音识别生成的字幕
+CHECKPOINT_CORRECT = 'correct'      # 纠正后的字幕
+
+# 旧任务在 files 表中的文件类型对应的检查点，用于为没有检查点的任务补建
+LEGACY_CHECKPOINT_FILE_TYPES = {
+    'audio': CHECKPOINT_EXTRACT,
+    'subtitle': CHECKPOINT_ASR,
+    'subtitle_corrected': CHECKPOINT_CORRECT
+}
+
+def generate_task_id() -> str:
+    """生成任务ID（UUID），并发提交时也不会重复"""
+    return uuid.uuid4().hex
+
+def translate_checkpoint(lang: str) -> str:
+    """翻译结果的检查点名称"""
+    return f'translate:{lang}'
+
+def file_sha256(file_path: str) -> str:
+    """计算文件的 SHA-256 校验值"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def encode_cursor(cursor: Tuple[str, str]) -> str:
+    """将分页游标 (created_at, task_id) 编码为URL安全的字符串"""
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode('utf-8')).decode('ascii')
+
+def decode_cursor(value: str) -> Tuple[str, str]:
+    """
+    解析分页游标
+    :raises ValueError: 游标格式无效
+    """
+    try:
+        created_at, task_id = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+        return str(created_at), str(task_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+# 阶段之间通过 tasks.task_data 传递的任务数据字段
+TASK_DATA_KEYS = [
+    'file_path', 'output_dir', 'target_langs', 'audio_file', 'srt_file', 'srt_filename',
+    'start_time', f'{STAGE_EXTRACT}_cost', f'{STAGE_ASR}_cost', f'{STAGE_LLM}_cost'
+]
+
+# 返回给客户端的任务字段，不包含服务器路径（task_data 中的 file_path、output_dir、srt_file 等）和租约等内部状态
+PUBLIC_TASK_FIELDS = (
+    'task_id', 'original_filename', 'file_type', 'status', 'progress', 'message', 'error_message',
+    'target_lang', 'keep_original', 'model_name', 'priority', 'profile', 'media_duration', 'expected_cost',
+    'created_at', 'updated_at', 'completed_at', 'process_time', 'stage', 'stage_progress', 'attempts',
+    'status_version', 'queue_position', 'estimated_wait_seconds', 'estimated_start_time',
+    'eta_seconds', 'estimated_completion_time', 'stage_estimates'
+)
+
+def public_task_view(task: Dict) -> Dict:
+    """只保留任务中可返回给客户端的字段"""
+    return {key: task[key] for key in PUBLIC_TASK_FIELDS if key in task}
 
 class TaskProcessor:
-    def __init__(self, num_workers=2):
+    def __init__(self, num_workers=2, run_workers=True, pool_sizes: Optional[Dict[str, int]] = None,
+                 db_file: str = 'tasks.db'):
+        """
+        :param num_workers: 语音识别线程数，其他阶段的默认线程数据此推算
+        :param run_workers: 是否在本进程内启动工作线程，为False时只负责提交任务和查询状态
+        :param pool_sizes: 覆盖配置中各阶段的线程数，如 {'asr': 4}
+        :param db_file: 任务数据库文件
+        """
         self.num_workers = num_workers
-        self.max_active_tasks = num_workers * 3  # 最大任务数为工作线程数的3倍
-        self.task_queue = queue.Queue()
+
+        # 各阶段工作线程数，语音识别默认使用 num_workers 个线程
+        pool_config = ConfigManager().get_config('task_processor')
+        self.pool_sizes = {
+            STAGE_EXTRACT: pool_config.get('extract_workers', max(1, num_workers // 2)),
+            STAGE_ASR: pool_config.get('asr_workers', num_workers),
+            STAGE_LLM: pool_config.get('llm_workers', num_workers * 2)
+        }
+        self.pool_sizes.update(pool_sizes or {})
+
+        # 积压任务数的软限制，超过后仍接受任务但会提示等待时间较长
+        self.max_backlog = pool_config.get('max_backlog', num_workers * 3)
+        # 租约时长和心跳间隔
+        self.lease_seconds = pool_config.get('lease_seconds', 60)
+        self.heartbeat_interval = pool_config.get('heartbeat_interval', self.lease_seconds / 3)
+        # 本进程的租约持有者标识
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stop_event = threading.Event()
+
+        # 初始化数据库
+        database_config = ConfigManager().get_config('database')
+        self.db = Database(
+            db_file,
+            journal_mode=database_config.get('journal_mode', 'WAL'),
+            synchronous=database_config.get('synchronous', 'NORMAL'),
+            flush_interval=database_config.get('progress_flush_interval', 0.5)
+        )
+
+        # 轮询状态的请求从按版本号增量同步的内存视图返回
+        self.status_cache = StatusCache(
+            self.db,
+            refresh_interval=database_config.get('status_refresh_interval', 0.5),
+            max_tasks=database_config.get('status_cache_size', 10000)
+        )
+        # 状态版本不变时，未结束任务的预计进度和剩余时间的更新间隔（秒），期间状态查询可返回 304
+        self.estimate_refresh_interval = database_config.get('estimate_refresh_interval', 5)
+
+        # 根据历史阶段耗时预测处理时间
+        eta_config = ConfigManager().get_config('eta')
+        self.eta_predictor = EtaPredictor(
+            self.db,
+            STAGES,
+            refit_interval=eta_config.get('refit_interval', 300),
+            min_samples=eta_config.get('min_samples', 5),
+            history_limit=eta_config.get('history_limit', 200)
+        )
+
+        # 按内存预算管理已加载的 Whisper 模型，语音识别任务领取前先预留模型内存
+        models_config = ConfigManager().get_config('models')
+        model_memory = {name: info['memory_mb'] for name, info in whisper_models.AVAILABLE_MODELS.items()}
+        model_memory.update(models_config.get('memory_mb') or {})
+        self.model_pool = ModelPool(
+            budget_mb=models_config.get('memory_budget_mb', 0),
+            model_memory=model_memory,
+            fallback_models=models_config.get('fallbacks'),
+            idle_seconds=models_config.get('idle_seconds', 600),
+            loader=lambda model_name: genSrt.load_model(model_name, device=models_config.get('device')),
+            # 按设备实际可用内存准入，计入同一台机器上其他工作进程加载的模型
+            device_memory=(lambda: genSrt.device_memory(models_config.get('device')))
+            if models_config.get('device_memory_check', True) else None,
+            device_reserve_mb=models_config.get('device_reserve_mb', 1024)
+        )
+
+        # 每个阶段一个按调度策略排序的持久化任务队列
+        self.scheduler_config = ConfigManager().get_config('scheduler')
+        # 抢占：存在高优先级任务时，低优先级任务在阶段边界处暂停
+        preemption_config = self.scheduler_config.get('preemption', {})
+        self.preemption_priority = (preemption_config.get('min_priority', 10)
+                                    if preemption_config.get('enabled', False) else None)
+        self.stage_queues = {
+            stage: TaskScheduler(
+                self.db,
+                stage,
+                num_workers=self.pool_sizes[stage],
+                policy=self.scheduler_config.get('policy', 'sjf'),
+                sjf_aging_factor=self.scheduler_config.get('sjf_aging_factor', 0.5),
+                priority_aging_per_minute=self.scheduler_config.get('priority_aging_per_minute', 1.0),
+                lease_seconds=self.lease_seconds,
+                poll_interval=pool_config.get('poll_interval', 1.0),
+                max_attempts=pool_config.get('max_attempts', 3),
+                urgent_priority=self.preemption_priority,
+                admission=self.model_pool if stage == STAGE_ASR else None,
+                claim_window=self.scheduler_config.get('claim_window', 1000)
+            )
+            for stage in STAGES
+        }
         self.active_tasks = 0
+        self.stage_active = {stage: 0 for stage in STAGES}
         self.task_lock = threading.Lock()
+        # 本进程正在处理的任务的取消令牌
+        self.cancel_tokens: Dict[str, CancelToken] = {}
+        # 标记了性能分析的任务在分析器下执行各阶段，其他任务不受影响
+        self.profiling_config = ConfigManager().get_config('profiling')
+        # 按任务记录各阶段及其中每个操作的起止时间
+        self.tracing_enabled = ConfigManager().get_config('tracing').get('enabled', True)
         
-        # 初始化数据库
-        self.db = Database()
-        
-        # 初始化其他组件
-        self.corrector = SubtitleCorrector()
-        self.translator = Translator()
+        # 字幕纠正和翻译只在处理任务的进程中使用，只负责提交和查询的 Web 进程不创建大模型客户端
+        self.corrector = None
+        self.translator = None
+        if run_workers:
+            self.corrector = SubtitleCorrector()
+            self.translator = Translator()
+            self._load_word_dict()
         
-        # 启动工作线程
-        self.workers = []
-        for _ in range(num_workers):
-            worker = threading.Thread(target=self._worker, daemon=True)
-            worker.start()
-            self.workers.append(worker)
-            
         # 恢复未完成的任务
         self._recover_incomplete_tasks()
 
+        # 按阶段启动工作线程
+        self.workers = []
+        if run_workers:
+            for stage in STAGES:
+                for _ in range(self.pool_sizes[stage]):
+                    worker = threading.Thread(target=self._worker, args=(stage,), daemon=True)
+                    worker.start()
+                    self.workers.append(worker)
+            heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+            heartbeat.start()
+            logging.info(f"工作进程 {self.worker_id} 已启动，线程数: {self.pool_sizes}")
+
+    def _load_word_dict(self):
+        """如果启用了词典，加载词典"""
+        word_dict_config = ConfigManager().get_word_dict_config()
+        if word_dict_config.get('enabled', True):
+            dict_path = word_dict_config.get('path', 'word_dict.txt')
+            if os.path.exists(dict_path):
+                self.translator.set_word_dict(dict_path)
+            else:
+                logging.warning(f"词典文件 {dict_path} 不存在")
+
     def _recover_incomplete_tasks(self):
-        """恢复未完成的任务"""
+        """
+        恢复未完成的任务
+        已在持久化队列中的任务无需处理（处理中的任务在租约过期后会被重新领取，
+        领取时根据检查点跳过已完成的阶段），只将旧版本遗留的、尚未进入任何阶段队列的任务
+        按已有的阶段产物从第一个未完成的阶段重新入队
+        """
         incomplete_tasks = self.db.get_incomplete_tasks()
         for task in incomplete_tasks:
+            if task['stage']:
+                continue
+
             # 检查文件是否仍然存在
             files = self.db.get_task_files(task['task_id'])
             if not files or not os.path.exists(files[0]['file_path']):
@@ -57,272 +292,953 @@ class TaskProcessor:
                 continue
             
             # 将任务重新加入队列
-            self.task_queue.put({
-                'task_id': task['task_id'],
+            task_data = {
                 'file_path': files[0]['file_path'],
                 'output_dir': os.path.dirname(files[0]['file_path']),
-                'file_type': task['file_type'],
-                'target_lang': task['target_lang'],
-                'keep_original': task['keep_original'],
-                'model_name': task['model_name']
-            })
-            
-            # 更新任务状态
-            self.db.update_task_status(
-                task['task_id'],
-                'queued',
-                0,
+                'target_langs': parse_target_langs(task['target_lang']),
+                'start_time': time.time()
+            }
+            task_data.update(self._estimate_stage_costs(task['media_duration'], task['model_name'],
+                                                        len(task_data['target_langs'])))
+            self._import_legacy_checkpoints(task['task_id'], files)
+            resumed_task = dict(task, **task_data)
+            stage = self._resume_stage(resumed_task)
+            task_data.update({key: resumed_task[key] for key in TASK_DATA_KEYS if key in resumed_task})
+            self.stage_queues[stage].put(
+                task['task_id'], task_data, task_data[f'{stage}_cost'], STAGE_START_PROGRESS[stage],
                 '任务已重新加入队列'
             )
 
-    def _worker(self):
-        """工作线程函数"""
-        while True:
-            task = self.task_queue.get()
+    def _import_legacy_checkpoints(self, task_id: str, files: List[Dict]):
+        """
+        为旧版本的任务补建检查点
+        files 表中的记录都是在对应阶段完成之后写入的，可以作为阶段完成的依据
+        """
+        checkpoints = self.db.get_checkpoints(task_id)
+        for file in files:
+            if file['file_type'] == 'subtitle_translated':
+                name = translate_checkpoint(file['lang']) if file.get('lang') else None
+            else:
+                name = LEGACY_CHECKPOINT_FILE_TYPES.get(file['file_type'])
+            if not name or name in checkpoints:
+                continue
+            file_path = file['file_path']
+            if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+                self._save_checkpoint(task_id, name, file_path)
+                checkpoints[name] = file_path
+
+    def _save_checkpoint(self, task_id: str, name: str, artifact_path: str):
+        """记录阶段检查点及产物的校验值"""
+        self.db.save_checkpoint(task_id, name, artifact_path, file_sha256(artifact_path))
+
+    def _verify_checkpoint(self, task_id: str, checkpoints: Dict[str, Dict], name: str) -> Optional[str]:
+        """
+        校验检查点的产物是否完整
+        :param checkpoints: 任务的所有检查点
+        :param name: 检查点名称
+        :return: 产物路径，检查点不存在、产物丢失或已被修改时返回None
+        """
+        artifact_path = self._check_artifact(task_id, checkpoints.get(name))
+        CHECKPOINT_LOOKUPS.labels(checkpoint=name.split(':')[0],
+                                  result='hit' if artifact_path else 'miss').inc()
+        return artifact_path
+
+    def _check_artifact(self, task_id: str, checkpoint: Optional[Dict]) -> Optional[str]:
+        if not checkpoint:
+            return None
+        artifact_path = checkpoint['artifact_path']
+        if not os.path.exists(artifact_path):
+            logging.warning(f"任务 {task_id} 的检查点产物 {artifact_path} 已丢失")
+            return None
+        if file_sha256(artifact_path) != checkpoint['sha256']:
+            logging.warning(f"任务 {task_id} 的检查点产物 {artifact_path} 校验失败")
+            return None
+        return artifact_path
+
+    def _resume_stage(self, task: Dict) -> str:
+        """
+        根据检查点确定任务第一个未完成的阶段，并将已完成阶段的产物写入任务数据
+        """
+        task_id = task['task_id']
+        checkpoints = self.db.get_checkpoints(task_id)
+        srt_file = self._verify_checkpoint(task_id, checkpoints, CHECKPOINT_ASR)
+        if srt_file:
+            task['srt_file'] = srt_file
+            task['srt_filename'] = self._srt_filename(task['original_filename'])
+            return STAGE_LLM
+        audio_file = self._verify_checkpoint(task_id, checkpoints, CHECKPOINT_EXTRACT)
+        if audio_file:
+            task['audio_file'] = audio_file
+            return STAGE_ASR
+        return self._first_stage(task['file_type'])
+
+    def _srt_filename(self, original_filename: str) -> str:
+        """根据上传的文件名生成字幕文件名"""
+        return f"{os.path.splitext(original_filename)[0]}.srt"
+
+    def _heartbeat(self):
+        """定期续期本进程持有的租约，检查取消请求和被暂停的任务，并释放空闲超时的模型"""
+        last_renewal = time.time()
+        while not self.stop_event.wait(1):
+            if time.time() - last_renewal >= self.heartbeat_interval:
+                self.db.renew_leases(self.worker_id, self.lease_seconds)
+                last_renewal = time.time()
+
+            # 其他进程（如 Web 进程）发起的取消请求
+            for task_id in self.db.get_cancel_requests(self.worker_id):
+                cancel_token = self.cancel_tokens.get(task_id)
+                if cancel_token:
+                    cancel_token.cancel()
+
+            if self.preemption_priority is not None:
+                resumed = self.db.resume_paused_tasks(self.preemption_priority)
+                if resumed:
+                    logging.info(f"高优先级任务已完成，恢复 {resumed} 个暂停的任务")
+                    for stage_queue in self.stage_queues.values():
+                        stage_queue.wake_all()
+
+            self.model_pool.evict_idle()
+
+    def shutdown(self, timeout: float = 30):
+        """
+        停止工作线程
+        等待正在处理的阶段结束，超时仍未结束的任务释放租约，由其他工作进程重新领取
+        """
+        self.stop_event.set()
+        for stage_queue in self.stage_queues.values():
+            stage_queue.wake_all()
+        deadline = time.time() + timeout
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.time()))
+        self.db.flush()
+        for task in self.db.get_incomplete_tasks():
+            if task['lease_owner'] == self.worker_id:
+                self.db.release_lease(task['task_id'], self.worker_id)
+                logging.info(f"已释放任务 {task['task_id']} 的租约")
+
+    def _first_stage(self, file_type: str) -> str:
+        """任务的第一个处理阶段，音频文件无需提取音频"""
+        return STAGE_EXTRACT if file_type == 'video' else STAGE_ASR
+
+    def _dispatch(self, task: Dict, stage: str, progress: int, cancel_token: CancelToken) -> None:
+        """
+        将任务交给下一个阶段的队列
+        启用抢占时，若有高优先级任务未完成，低优先级任务在此处暂停
+        """
+        cancel_token.check()
+        task_data = {key: task[key] for key in TASK_DATA_KEYS if key in task}
+        status, message = 'queued', STAGE_WAITING_MESSAGES[stage]
+        if (self.preemption_priority is not None
+                and (task.get('priority') or 0) < self.preemption_priority
+                and self.db.has_urgent_tasks(self.preemption_priority, exclude_task_id=task['task_id'])):
+            status, message = 'paused', '已暂停，等待高优先级任务完成...'
+            logging.info(f"任务 {task['task_id']} 在进入阶段 {stage} 前被高优先级任务抢占")
+        if not self.stage_queues[stage].put(task['task_id'], task_data, task.get(f'{stage}_cost') or 0,
+                                            progress, message, lease_owner=self.worker_id,
+                                            status=status):
+            logging.warning(f"任务 {task['task_id']} 的租约已丢失，放弃推进到阶段 {stage}")
+
+    def _worker(self, stage: str):
+        """工作线程函数，只处理指定阶段的任务"""
+        stage_queue = self.stage_queues[stage]
+        handlers = {
+            STAGE_EXTRACT: self._run_extract,
+            STAGE_ASR: self._run_asr,
+            STAGE_LLM: self._run_llm
+        }
+        while not self.stop_event.is_set():
+            task = stage_queue.get(self.worker_id, self.stop_event)
             if task is None:
                 break
                 
+            cancel_token = CancelToken(task['task_id'])
             with self.task_lock:
                 self.active_tasks += 1
+                self.stage_active[stage] += 1
+                self.cancel_tokens[task['task_id']] = cancel_token
+            if task.get('cancel_requested'):
+                cancel_token.cancel()
                 
             try:
-                self._process_task(task)
+                with self._task_trace(task, stage), self._record_llm_usage(task):
+                    # 被重新领取的任务可能已完成本阶段，或者前一阶段的产物已丢失
+                    resume_stage = self._resume_stage(task)
+                    if resume_stage != stage:
+                        logging.info(f"任务 {task['task_id']} 根据检查点转到阶段 {resume_stage}")
+                        now = time.time()
+                        tracing.record('checkpoint_resume', now, now, resume_stage=resume_stage, cache_hit=True)
+                        self._dispatch(task, resume_stage, STAGE_START_PROGRESS[resume_stage], cancel_token)
+                    else:
+                        started_at = time.time()
+                        if task.get('profile'):
+                            self._run_profiled(task, stage, handlers[stage], cancel_token)
+                        else:
+                            handlers[stage](task, cancel_token)
+                        stage_seconds = time.time() - started_at
+                        STAGE_DURATION.labels(stage=stage).observe(stage_seconds)
+                        # 重新领取的任务可能跳过了部分工作，耗时不具代表性
+                        if not task.get('attempts'):
+                            self._record_stage_timing(task, stage, stage_seconds)
+            except TaskCancelled:
+                self._finish_cancelled(task['task_id'])
             except Exception as e:
                 logging.error(f"处理任务 {task['task_id']} 时出错: {str(e)}")
-                self.db.update_task_status(
+                # 即使出错也记录处理时间
+                process_time = round(time.time() - task['start_time'], 1)
+                # 租约已被回收时任务已由其他线程接手，不能覆盖其状态
+                if self.db.update_task_status(
                     task['task_id'],
                     'error',
                     0,
                     f'处理失败: {str(e)}',
-                    error_message=str(e)
-                )
+                    error_message=str(e),
+                    process_time=process_time,
+                    lease_owner=self.worker_id
+                ):
+                    TASKS_FINISHED.labels(status='error').inc()
+                else:
+                    logging.warning(f"任务 {task['task_id']} 的租约已失效，不记录失败状态")
             finally:
                 with self.task_lock:
                     self.active_tasks -= 1
-                self.task_queue.task_done()
+                    self.stage_active[stage] -= 1
+                    self.cancel_tokens.pop(task['task_id'], None)
+                # 归还模型后唤醒因内存不足而等待的语音识别线程
+                if self.model_pool.release(task['task_id']):
+                    self.stage_queues[STAGE_ASR].wake_all()
+
+    @contextmanager
+    def _task_trace(self, task: Dict, stage: str):
+        """
+        记录任务本次阶段执行的追踪：在队列中的等待和阶段本身，阶段内的操作作为阶段的子 span
+        阶段结束（包括出错和取消）时一次写入数据库
+        """
+        if not self.tracing_enabled:
+            yield
+            return
+        with tracing.start_trace(task['task_id'], self.db.add_task_trace):
+            if task.get('enqueued_at'):
+                tracing.record('queue', task['enqueued_at'], time.time(), stage=stage)
+            with tracing.span(stage, attempt=(task.get('attempts') or 0) + 1, worker=self.worker_id):
+                yield
+
+    @contextmanager
+    def _record_llm_usage(self, task: Dict):
+        """累计本次阶段执行中各步骤的大模型请求数、token 数、耗时和费用，结束时（包括出错和取消）写入数据库"""
+        with llm_usage.recording() as recorder:
+            try:
+                yield
+            finally:
+                self.db.add_llm_usage(task['task_id'], recorder.rows())
+
+    def _run_profiled(self, task: Dict, stage: str, handler, cancel_token: CancelToken):
+        """
+        在性能分析器下执行阶段处理函数
+        各阶段的结果合并到同一个分析文件中（调用栈最外层为阶段名称），作为任务文件保存
+        """
+        task_id = task['task_id']
+        mode = resolve_mode(self.profiling_config.get('mode', MODE_SAMPLING))
+        extension = PROFILE_EXTENSIONS[mode]
+        stored_filename = f"profile_{task_id}{extension}"
+        file_path = os.path.join(task['output_dir'], stored_filename)
+        if not any(file['file_type'] == 'profile' and file['file_path'] == file_path
+                   for file in self.db.get_task_files(task_id)):
+            self.db.add_file(
+                file_id=str(uuid.uuid4()),
+                task_id=task_id,
+                file_type='profile',
+                original_filename=f"{os.path.splitext(task['original_filename'])[0]}_profile{extension}",
+                stored_filename=stored_filename,
+                file_path=file_path,
+                is_temporary=False
+            )
+        logging.info(f"任务 {task_id} 的 {stage} 阶段在性能分析器下执行（{mode}）")
+        profile_call(
+            lambda: handler(task, cancel_token),
+            file_path,
+            stage,
+            mode=mode,
+            interval=self.profiling_config.get('interval_ms', 10) / 1000
+        )
+
+    def set_task_profile(self, task_id: str, enabled: bool) -> Tuple[bool, str]:
+        """
+        为未结束的任务开启或关闭性能分析，从下一个开始的阶段起生效
+        :return: (是否成功, 消息)
+        """
+        if not self.db.set_task_profile(task_id, enabled):
+            task = self.db.get_task(task_id)
+            return False, '任务不存在' if not task else '任务已结束'
+        return True, '已开启性能分析，从下一个处理阶段起生效' if enabled else '已关闭性能分析'
+
+    def _cleanup_temporary_files(self, task_id: str):
+        """获取并删除临时文件"""
+        temp_files = self.db.cleanup_temporary_files(task_id)
+        for temp_file in temp_files:
+            try:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+            except Exception as e:
+                logging.error(f"删除临时文件 {temp_file} 失败: {str(e)}")
 
-    def _process_task(self, task):
+    def _finish_cancelled(self, task_id: str):
+        """清理被取消任务的临时文件并标记为已取消"""
+        self._cleanup_temporary_files(task_id)
+        self.db.update_task_status(task_id, 'cancelled', 0, '任务已取消')
+        TASKS_FINISHED.labels(status='cancelled').inc()
+        logging.info(f"任务 {task_id} 已取消")
+
+    def cancel_task(self, task_id: str) -> Tuple[bool, str]:
+        """
+        取消任务
+        排队中的任务立即取消；处理中的任务会结束 ffmpeg 进程、在下一个转录窗口处中止、
+        并丢弃尚未开始的大模型请求
+        :return: (bool, str) - (是否成功, 消息)
+        """
+        result = self.db.request_cancel(task_id)
+        if result is None:
+            return False, "任务不存在或已结束"
+        if result == 'cancelled':
+            TASKS_FINISHED.labels(status='cancelled').inc()
+            self._cleanup_temporary_files(task_id)
+            return True, "任务已取消"
+        cancel_token = self.cancel_tokens.get(task_id)
+        if cancel_token:
+            cancel_token.cancel()
+        return True, "正在取消任务..."
+
+    def _run_extract(self, task: Dict, cancel_token: CancelToken):
+        """提取音频阶段（10-20%）"""
+        task_id = task['task_id']
+        self.db.update_task_progress(task_id, 'extracting_audio', 10, '正在提取音频...')
+
+        # 生成临时音频文件名
+        audio_filename = f"temp_audio_{task_id}.mp3"
+        audio_file = os.path.join(task['output_dir'], audio_filename)
+        genSrt.extract_audio(task['file_path'], audio_file, cancel_token=cancel_token)
+        
+        self._save_checkpoint(task_id, CHECKPOINT_EXTRACT, audio_file)
+        
+        # 记录临时音频文件
+        self.db.add_file(
+            file_id=str(uuid.uuid4()),
+            task_id=task_id,
+            file_type='audio',
+            original_filename=audio_filename,
+            stored_filename=audio_filename,
+            file_path=audio_file,
+            is_temporary=True
+        )
+        
+        task['audio_file'] = audio_file
+        self._dispatch(task, STAGE_ASR, STAGE_START_PROGRESS[STAGE_ASR], cancel_token)
+
+    def _run_asr(self, task: Dict, cancel_token: CancelToken):
+        """生成字幕阶段（20-40%）"""
         task_id = task['task_id']
-        file_path = task['file_path']
         output_dir = task['output_dir']
-        file_type = task['file_type']
-        target_lang = task.get('target_lang')
-        keep_original = task.get('keep_original', False)
         model_name = task.get('model_name')
-        start_time = time.time()
+        # 音频文件直接使用
+        audio_file = task.get('audio_file') or task['file_path']
 
-        try:
-            if file_type == 'video':
-                # 提取音频（10-20%）
-                self.db.update_task_status(task_id, 'extracting_audio', 10, '正在提取音频...')
+        # 领取时已为任务预留了模型内存，内存不足时可能改用已加载的替代模型
+        requested_model = model_name
+        with tracing.span('model_acquire', model=requested_model):
+            model_name, model = self.model_pool.acquire(task_id, requested_model)
+        if model_name != requested_model:
+            logging.info(f"任务 {task_id} 因内存不足改用已加载的模型 {model_name}（原模型 {requested_model}）")
+            self.db.update_task_model(task_id, model_name)
+            task['model_name'] = model_name
 
-                # 生成临时音频文件名
-                audio_filename = f"temp_audio_{task_id}.mp3"
-                audio_file = os.path.join(output_dir, audio_filename)
-                genSrt.extract_audio(file_path, audio_file)
-                
-                # 记录临时音频文件
+        self.db.update_task_progress(
+            task_id,
+            'generating_subtitles',
+            30,
+            f'正在使用 {model_name} 模型生成字幕...'
+        )
+
+        # 生成字幕文件名
+        srt_filename = self._srt_filename(task['original_filename'])
+        stored_srt_filename = self.db.generate_stored_filename(srt_filename)
+        srt_file = os.path.join(output_dir, stored_srt_filename)
+
+        # 使用统一的文件名生成字幕
+        genSrt.extract_subtitles(
+            audio_file, 
+            output_dir, 
+            model_name=model_name,
+            output_filename=stored_srt_filename,
+            cancel_token=cancel_token,
+            progress_callback=self._stage_progress_callback(task_id),
+            model=model
+        )
+        self._save_checkpoint(task_id, CHECKPOINT_ASR, srt_file)
+        
+        # 记录字幕文件
+        self.db.add_file(
+            file_id=str(uuid.uuid4()),
+            task_id=task_id,
+            file_type='subtitle',
+            original_filename=srt_filename,
+            stored_filename=stored_srt_filename,
+            file_path=srt_file,
+            is_temporary=False
+        )
+
+        task['srt_filename'] = srt_filename
+        task['srt_file'] = srt_file
+
+        # 字幕生成后按实际token数重新预测纠正和翻译的耗时
+        _, token_count = srt_statistics(srt_file)
+        llm_cost = self.eta_predictor.predict(STAGE_LLM, token_count=token_count,
+                                              lang_count=len(task.get('target_langs') or []))
+        if llm_cost is not None:
+            task[f'{STAGE_LLM}_cost'] = llm_cost
+        self._dispatch(task, STAGE_LLM, STAGE_START_PROGRESS[STAGE_LLM], cancel_token)
+
+    def _run_llm(self, task: Dict, cancel_token: CancelToken):
+        """字幕纠正（40-60%）、翻译（60-90%）和清理阶段"""
+        task_id = task['task_id']
+        target_langs = task.get('target_langs') or []
+        keep_original = task.get('keep_original', False)
+        srt_filename = task['srt_filename']
+        srt_file = task['srt_file']
+
+        # 中断前已完成的纠正和翻译结果
+        checkpoints = self.db.get_checkpoints(task_id)
+
+        # 纠正字幕（40-60%）
+        self.db.update_task_progress(task_id, 'correcting_subtitles', 40, '正在纠正字幕...')
+
+        config = ConfigManager().get_config('subtitle_correction')
+        corrected_checkpoint = self._verify_checkpoint(task_id, checkpoints, CHECKPOINT_CORRECT)
+        if corrected_checkpoint:
+            logging.info(f"任务 {task_id} 的字幕已纠正，跳过纠正步骤")
+            now = time.time()
+            tracing.record('correct', now, now, cache_hit=True)
+            srt_file = corrected_checkpoint
+        elif config.get('enabled', True):
+            with tracing.span('correct'):
+                corrected_srt = self.corrector.correct_srt(srt_file, cancel_token=cancel_token)
+            self._save_checkpoint(task_id, CHECKPOINT_CORRECT, corrected_srt)
+            if corrected_srt != srt_file:
+                # 如果生成了新的纠正文件，更新文件记录
                 self.db.add_file(
                     file_id=str(uuid.uuid4()),
                     task_id=task_id,
-                    file_type='audio',
-                    original_filename=audio_filename,
-                    stored_filename=audio_filename,
-                    file_path=audio_file,
-                    is_temporary=True
+                    file_type='subtitle_corrected',
+                    original_filename=srt_filename,
+                    stored_filename=os.path.basename(corrected_srt),
+                    file_path=corrected_srt,
+                    is_temporary=False
                 )
-                
-                self.db.update_task_status(task_id, 'extracting_audio', 20, '音频提取完成...')
-            else:
-                # 音频文件直接使用
-                audio_file = file_path
-                self.db.update_task_status(task_id, 'processing', 20, '开始处理音频...')
+                srt_file = corrected_srt
 
-            # 生成字幕（20-40%）
-            self.db.update_task_status(
-                task_id,
-                'generating_subtitles',
-                30,
-                f'正在使用 {model_name} 模型生成字幕...'
-            )
+            self.db.update_task_progress(task_id, 'correcting_subtitles', 60, '字幕纠正完成...')
 
-            # 生成字幕文件名
-            task_info = self.db.get_task(task_id)
-            srt_filename = f"{os.path.splitext(task_info['original_filename'])[0]}.srt"
-            stored_srt_filename = self.db.generate_stored_filename(srt_filename)
-            srt_file = os.path.join(output_dir, stored_srt_filename)
-
-            # 使用统一的文件名生成字幕
-            genSrt.extract_subtitles(
-                audio_file, 
-                output_dir, 
-                model_name=model_name,
-                output_filename=stored_srt_filename
+        # 如果需要翻译（60-90%），多个目标语言共享同一份转录和纠正结果
+        if target_langs:
+            self.db.update_task_progress(
+                task_id,
+                'translating',
+                70,
+                f'正在翻译为{"、".join(target_langs)}{"(双语)" if keep_original else ""}...'
             )
             
-            # 记录字幕文件
-            self.db.add_file(
-                file_id=str(uuid.uuid4()),
-                task_id=task_id,
-                file_type='subtitle',
-                original_filename=srt_filename,
-                stored_filename=stored_srt_filename,
-                file_path=srt_file,
-                is_temporary=False
-            )
-
-            # 纠正字幕（40-60%）
-            self.db.update_task_status(task_id, 'correcting_subtitles', 40, '正在纠正字幕...')
-
-            config = ConfigManager().get_config('subtitle_correction')
-            if config.get('enabled', True):
-                corrected_srt = self.corrector.correct_srt(srt_file)
-                if corrected_srt != srt_file:
-                    # 如果生成了新的纠正文件，更新文件记录
-                    self.db.add_file(
-                        file_id=str(uuid.uuid4()),
-                        task_id=task_id,
-                        file_type='subtitle_corrected',
-                        original_filename=srt_filename,
-                        stored_filename=os.path.basename(corrected_srt),
-                        file_path=corrected_srt,
-                        is_temporary=False
-                    )
-                    srt_file = corrected_srt
-
-                self.db.update_task_status(task_id, 'correcting_subtitles', 60, '字幕纠正完成...')
-
-            # 如果需要翻译（60-90%）
-            if target_lang:
-                self.db.update_task_status(
-                    task_id,
-                    'translating',
-                    70,
-                    f'正在翻译为{target_lang}{"(双语)" if keep_original else ""}...'
-                )
-                
-                translated_file = self.translator.translate_srt(srt_file, target_lang, keep_original)
+            translated_langs = [
+                lang for lang in target_langs
+                if self._verify_checkpoint(task_id, checkpoints, translate_checkpoint(lang))
+            ]
+            if translated_langs:
+                logging.info(f"任务 {task_id} 已完成 {'、'.join(translated_langs)} 的翻译，跳过这些语言")
+                now = time.time()
+                for lang in translated_langs:
+                    tracing.record('translate', now, now, lang=lang, cache_hit=True)
+            remaining_langs = [lang for lang in target_langs if lang not in translated_langs]
+            translated_files = self._translate_all(srt_file, remaining_langs, keep_original, cancel_token)
+            translated_records = []
+            for lang, translated_file in translated_files:
+                self._save_checkpoint(task_id, translate_checkpoint(lang), translated_file)
                 if translated_file != srt_file:
-                    # 记录翻译后的文件
-                    self.db.add_file(
-                        file_id=str(uuid.uuid4()),
-                        task_id=task_id,
-                        file_type='subtitle_translated',
-                        original_filename=srt_filename,
-                        stored_filename=os.path.basename(translated_file),
-                        file_path=translated_file,
-                        is_temporary=False
-                    )
-                    srt_file = translated_file
-
-            # 清理临时文件（90-95%）
-            self.db.update_task_status(task_id, 'cleaning', 90, '正在清理临时文件...')
-            
-            # 获取并删除临时文件
-            temp_files = self.db.cleanup_temporary_files(task_id)
-            for temp_file in temp_files:
-                try:
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-                except Exception as e:
-                    logging.error(f"删除临时文件 {temp_file} 失败: {str(e)}")
+                    # 每个语言的翻译结果单独记录
+                    translated_records.append({
+                        'file_id': str(uuid.uuid4()),
+                        'task_id': task_id,
+                        'file_type': 'subtitle_translated',
+                        'original_filename': f"{os.path.splitext(srt_filename)[0]}_{lang}.srt",
+                        'stored_filename': os.path.basename(translated_file),
+                        'file_path': translated_file,
+                        'is_temporary': False,
+                        'lang': lang
+                    })
+            self.db.add_files(translated_records)
 
-            # 计算处理时间
-            process_time = round(time.time() - start_time, 1)
+        # 清理临时文件（90-95%）
+        cancel_token.check()
+        self.db.update_task_progress(task_id, 'cleaning', 90, '正在清理临时文件...')
+        self._cleanup_temporary_files(task_id)
 
-            # 更新完成状态
-            self.db.update_task_status(
-                task_id,
-                'completed',
-                100,
-                f'处理完成！总耗时: {process_time}秒',
-                process_time=process_time
-            )
+        # 计算处理时间（包含在各阶段队列中等待的时间）
+        process_time = round(time.time() - task['start_time'], 1)
 
-        except Exception as e:
-            # 即使出错也记录处理时间
-            process_time = round(time.time() - start_time, 1)
-            self.db.update_task_status(
-                task_id,
-                'error',
-                0,
-                f'处理失败: {str(e)}',
-                error_message=str(e),
-                process_time=process_time
-            )
-            logging.error(f"处理任务 {task_id} 时出错: {str(e)}")
-            raise
+        # 更新完成状态（仅当仍持有租约时）
+        if self.db.update_task_status(
+            task_id,
+            'completed',
+            100,
+            f'处理完成！总耗时: {process_time}秒',
+            process_time=process_time,
+            lease_owner=self.worker_id
+        ):
+            TASKS_FINISHED.labels(status='completed').inc()
+        else:
+            logging.warning(f"任务 {task_id} 的租约已失效，不记录完成状态")
+
+    def _translate_all(self, srt_file: str, target_langs: List[str],
+                       keep_original: bool, cancel_token: CancelToken) -> List[Tuple[str, str]]:
+        """
+        并行翻译为多个目标语言
+        :return: [(语言, 翻译后的文件路径)]，顺序与 target_langs 一致
+        """
+        if not target_langs:
+            return []
+
+        def translate(lang):
+            with tracing.span('translate', lang=lang):
+                return self.translator.translate_srt(srt_file, lang, keep_original, cancel_token)
+
+        if len(target_langs) == 1:
+            lang = target_langs[0]
+            return [(lang, translate(lang))]
+
+        max_parallel = ConfigManager().get_translation_config().get('max_parallel_languages', 3)
+        with ThreadPoolExecutor(max_workers=min(max_parallel, len(target_langs))) as executor:
+            futures = [executor.submit(tracing.bind(translate), lang) for lang in target_langs]
+            cancel_pending = cancel_futures(futures)
+            cancel_token.add_callback(cancel_pending)
+            try:
+                return [(lang, future.result()) for lang, future in zip(target_langs, futures)]
+            finally:
+                cancel_token.remove_callback(cancel_pending)
 
     def add_task(self, task_id: str, file_path: str, output_dir: str,
-                file_type: str = 'video', target_lang: Optional[str] = None,
-                keep_original: bool = False, model_name: str = 'large-v3') -> Tuple[bool, str]:
+                file_type: str = 'video', target_langs: Optional[List[str]] = None,
+                keep_original: bool = False, model_name: str = 'large-v3',
+                priority: int = 0, original_filename: Optional[str] = None,
+                profile: bool = False) -> Tuple[bool, str]:
         """
         添加任务到队列
+        :param target_langs: 翻译目标语言列表，为空则不翻译
+        :param priority: 显式优先级，数值越大越优先（priority 调度策略下生效）
+        :param original_filename: 原始文件名，默认取 file_path 的文件名
+        :param profile: 是否在性能分析器下处理该任务
         :return: (bool, str) - (是否成功添加, 消息)
         """
-        with self.task_lock:
-            # 计算当前总任务数（活动 + 队列中）
-            total_tasks = self.active_tasks + self.task_queue.qsize()
-            
-            if total_tasks >= self.max_active_tasks:
-                return False, f"任务队列已满（最大{self.max_active_tasks}个任务），请等待其他任务完成后再试"
+        target_langs = parse_target_langs(target_langs)
+        memory_error = self._check_model_memory(model_name)
+        if memory_error:
+            return False, memory_error
 
-            # 生成存储文件名
-            original_filename = os.path.basename(file_path)
-            stored_filename = self.db.generate_stored_filename(original_filename)
-            new_file_path = os.path.join(output_dir, stored_filename)
-            
-            # 移动文件到新位置
-            os.rename(file_path, new_file_path)
-            
-            # 添加任务到数据库
-            self.db.add_task(
-                task_id=task_id,
-                original_filename=original_filename,
-                stored_filename=stored_filename,
-                file_type=file_type,
-                target_lang=target_lang,
-                keep_original=keep_original,
-                model_name=model_name
-            )
-            
-            # 记录原始文件
-            self.db.add_file(
-                file_id=str(uuid.uuid4()),
-                task_id=task_id,
-                file_type=file_type,
-                original_filename=original_filename,
-                stored_filename=stored_filename,
-                file_path=new_file_path,
-                is_temporary=False
+        # 积压超过软限制时仍接受任务，只提示等待时间
+        backlog = self._queued_count() + self._active_count()
+
+        # 生成存储文件名
+        original_filename = original_filename or os.path.basename(file_path)
+        stored_filename = self.db.generate_stored_filename(original_filename)
+        new_file_path = os.path.join(output_dir, stored_filename)
+        
+        # 移动文件到新位置
+        os.rename(file_path, new_file_path)
+
+        # 探测媒体时长，任务、文件记录和入队在同一个事务中完成
+        task_row, file_row = self._build_task_rows(
+            task_id, new_file_path, original_filename, stored_filename, file_type, output_dir,
+            target_langs, keep_original, model_name, priority, genSrt.probe_duration(new_file_path),
+            profile=profile
+        )
+        if not self.db.add_tasks_bulk([task_row], [file_row]):
+            os.rename(new_file_path, file_path)
+            return False, "任务创建失败"
+        self.stage_queues[task_row['stage']].wake_all()
+
+        # 立即同步状态缓存，使排队位置包含新任务
+        self.status_cache.refresh(force=True)
+        position = self._find_queue_position(task_id)
+        if position is None:
+            message = "任务已开始处理"
+        else:
+            message = (f"任务已添加到队列，位置：{position['queue_position']}，"
+                       f"预计等待 {int(position['estimated_wait_seconds'])} 秒")
+        if backlog >= self.max_backlog:
+            message += f"（当前积压 {backlog} 个任务，超过建议上限 {self.max_backlog}，等待时间可能较长）"
+        return True, message
+
+    def add_tasks_bulk(self, file_paths: List[str], output_dir: str,
+                       target_langs: Optional[List[str]] = None, keep_original: bool = False,
+                       model_name: str = 'large-v3', priority: int = 0, move: bool = True,
+                       original_filenames: Optional[List[str]] = None,
+                       profile: bool = False) -> Tuple[bool, str, List[Dict], List[Dict]]:
+        """
+        批量添加任务，所有任务及其文件记录在同一个事务中写入
+        :param file_paths: 媒体文件路径
+        :param output_dir: 字幕输出目录
+        :param move: 是否将文件移入 output_dir；为False时原地引用文件（用于登记共享存储上的文件）
+        :param original_filenames: 与 file_paths 对应的原始文件名，默认取文件名
+        :param profile: 是否在性能分析器下处理这些任务
+        :return: (是否成功, 消息, 已添加的任务 [{'task_id', 'file', 'original_filename', 'file_type'}],
+                  失败的文件 [{'file', 'original_filename', 'error'}])，file 为传入的路径
+        """
+        target_langs = parse_target_langs(target_langs)
+        original_filenames = original_filenames or [os.path.basename(path) for path in file_paths]
+        memory_error = self._check_model_memory(model_name)
+        if memory_error:
+            return False, memory_error, [], [
+                {'file': path, 'original_filename': original_filename, 'error': memory_error}
+                for path, original_filename in zip(file_paths, original_filenames)
+            ]
+        errors = []
+        entries = []
+        for file_path, original_filename in zip(file_paths, original_filenames):
+            file_type = get_file_type(original_filename)
+            if not file_type:
+                errors.append({'file': file_path, 'original_filename': original_filename, 'error': '不支持的文件格式'})
+                continue
+            entries.append({'file': file_path, 'original_filename': original_filename, 'file_type': file_type})
+
+        # 探测时长主要是等待 ffprobe 进程，并行执行
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            durations = list(executor.map(genSrt.probe_duration, [entry['file'] for entry in entries]))
+
+        task_rows, file_rows, moved, tasks = [], [], [], []
+        for entry, media_duration in zip(entries, durations):
+            task_id = generate_task_id()
+            original_filename = entry['original_filename']
+            if move:
+                stored_filename = self.db.generate_stored_filename(original_filename)
+                stored_path = os.path.join(output_dir, stored_filename)
+                try:
+                    os.rename(entry['file'], stored_path)
+                except OSError as e:
+                    # 可能已被其他进程登记
+                    errors.append({'file': entry['file'], 'original_filename': original_filename,
+                                   'error': f'移动文件失败: {str(e)}'})
+                    continue
+                moved.append((stored_path, entry['file']))
+            else:
+                stored_path = os.path.abspath(entry['file'])
+                stored_filename = os.path.basename(stored_path)
+            task_row, file_row = self._build_task_rows(
+                task_id, stored_path, original_filename, stored_filename, entry['file_type'], output_dir,
+                target_langs, keep_original, model_name, priority, media_duration, profile=profile
             )
+            task_rows.append(task_row)
+            file_rows.append(file_row)
+            tasks.append({'task_id': task_id, 'file': entry['file'], 'original_filename': original_filename,
+                          'file_type': entry['file_type']})
+
+        if not self.db.add_tasks_bulk(task_rows, file_rows):
+            for stored_path, file_path in moved:
+                os.rename(stored_path, file_path)
+            return False, "任务创建失败", [], errors + [
+                {'file': task['file'], 'original_filename': task['original_filename'], 'error': '任务创建失败'}
+                for task in tasks
+            ]
+
+        for stage in {row['stage'] for row in task_rows}:
+            self.stage_queues[stage].wake_all()
+        message = f"已添加 {len(tasks)} 个任务"
+        if errors:
+            message += f"，{len(errors)} 个文件失败"
+        return True, message, tasks, errors
+
+    def _check_model_memory(self, model_name: str) -> Optional[str]:
+        """
+        检查模型能否在内存预算内运行
+        :return: 无法运行时返回错误消息
+        """
+        if self.model_pool.fits_budget(model_name) or self.model_pool.fallback_models.get(model_name):
+            return None
+        return (f"模型 {model_name} 需要约 {self.model_pool.memory_of(model_name)} MB 内存，"
+                f"超过内存预算 {self.model_pool.budget_mb} MB")
+
+    def _build_task_rows(self, task_id: str, file_path: str, original_filename: str, stored_filename: str,
+                         file_type: str, output_dir: str, target_langs: List[str], keep_original: bool,
+                         model_name: str, priority: int, media_duration: Optional[float],
+                         profile: bool = False) -> Tuple[Dict, Dict]:
+        """
+        生成已进入第一个阶段队列的任务记录和原始文件记录
+        :return: (tasks 表的行, files 表的行)
+        """
+        stage_costs = self._estimate_stage_costs(media_duration, model_name, len(target_langs))
+        if file_type != 'video':
+            stage_costs[f'{STAGE_EXTRACT}_cost'] = 0
+        stage = self._first_stage(file_type)
+        task_data = {
+            'file_path': file_path,
+            'output_dir': output_dir,
+            'target_langs': target_langs,
+            'start_time': time.time()
+        }
+        task_data.update(stage_costs)
+        task_row = {
+            'task_id': task_id,
+            'original_filename': original_filename,
+            'stored_filename': stored_filename,
+            'file_type': file_type,
+            'status': 'queued',
+            'progress': 0,
+            'message': '任务已加入队列',
+            'target_lang': ','.join(target_langs) or None,
+            'keep_original': keep_original,
+            'model_name': model_name,
+            'priority': priority,
+            'profile': 1 if profile else 0,
+            'media_duration': media_duration,
+            'expected_cost': round(sum(stage_costs.values()), 1),
+            'stage': stage,
+            'task_data': task_data,
+            'stage_cost': stage_costs[f'{stage}_cost'],
+            'enqueued_at': time.time()
+        }
+        file_row = {
+            'file_id': str(uuid.uuid4()),
+            'task_id': task_id,
+            'file_type': file_type,
+            'original_filename': original_filename,
+            'stored_filename': stored_filename,
+            'file_path': file_path,
+            'is_temporary': False
+        }
+        return task_row, file_row
+
+    def _estimate_stage_costs(self, media_duration: Optional[float], model_name: str,
+                              lang_count: int = 0) -> Dict[str, float]:
+        """
+        估算任务在各阶段的处理耗时（秒）
+        优先使用根据历史耗时拟合的预测值，历史数据不足时使用配置的估算系数
+        :param media_duration: 媒体时长，无法探测时使用配置的默认时长
+        :param lang_count: 翻译目标语言数
+        :return: {'extract_cost': ..., 'asr_cost': ..., 'llm_cost': ...}
+        """
+        if media_duration is None:
+            media_duration = self.scheduler_config.get('default_duration', 600)
+        costs = {
+            f'{STAGE_EXTRACT}_cost': round(
+                media_duration * self.scheduler_config.get('extract_cost_factor', 0.02), 1),
+            f'{STAGE_ASR}_cost': round(
+                whisper_models.estimate_transcribe_seconds(
+                    media_duration, model_name, self.scheduler_config.get('cost_factors')
+                ), 1),
+            f'{STAGE_LLM}_cost': self.scheduler_config.get('fixed_overhead_seconds', 30)
+        }
+        for stage in STAGES:
+            predicted = self.eta_predictor.predict(stage, model_name=model_name, media_duration=media_duration,
+                                                   lang_count=lang_count)
+            if predicted is not None:
+                costs[f'{stage}_cost'] = predicted
+        return costs
+
+    def _record_stage_timing(self, task: Dict, stage: str, seconds: float):
+        """记录阶段的实际耗时，用于训练耗时预测模型"""
+        line_count = token_count = None
+        srt_file = task.get('srt_file')
+        if stage != STAGE_EXTRACT and srt_file and os.path.exists(srt_file):
+            line_count, token_count = srt_statistics(srt_file)
+        self.eta_predictor.record(
+            task['task_id'],
+            stage,
+            round(seconds, 2),
+            model_name=task.get('model_name'),
+            media_duration=task.get('media_duration'),
+            line_count=line_count,
+            token_count=token_count,
+            lang_count=len(task.get('target_langs') or [])
+        )
 
-            # 添加任务到处理队列
-            self.task_queue.put({
-                'task_id': task_id,
-                'file_path': new_file_path,
-                'output_dir': output_dir,
-                'file_type': file_type,
-                'target_lang': target_lang,
-                'keep_original': keep_original,
-                'model_name': model_name
-            })
+    def _stage_progress_callback(self, task_id: str):
+        """生成阶段内进度回调，进度每增加2%写入一次数据库"""
+        last_reported = [0.0]
 
-            queue_position = total_tasks + 1
-            return True, f"任务已添加到队列，位置：{queue_position}"
+        def callback(fraction: float):
+            if fraction - last_reported[0] >= 0.02 or fraction >= 1.0:
+                last_reported[0] = fraction
+                self.db.update_stage_progress(task_id, round(fraction, 3))
+        return callback
+
+    def _queued_count(self) -> int:
+        """各阶段队列中等待的任务总数"""
+        return sum(stage_queue.qsize() for stage_queue in self.stage_queues.values())
+
+    def _active_count(self) -> int:
+        """所有工作进程中正在处理的任务总数"""
+        return sum(stage_queue.active_count() for stage_queue in self.stage_queues.values())
+
+    def _queue_snapshot(self, stage: str) -> List[Dict]:
+        """阶段的排队情况，在状态版本不变时复用"""
+        return self.status_cache.memoize(('queue', stage), self.stage_queues[stage].get_queue_snapshot)
+
+    def _find_queue_position(self, task_id: str) -> Optional[Dict]:
+        """在各阶段队列中查找任务的排队信息"""
+        for stage in STAGES:
+            for item in self._queue_snapshot(stage):
+                if item['task_id'] == task_id:
+                    return dict(item, stage=stage)
+        return None
+
+    def _queue_item_view(self, item: Dict) -> Dict:
+        """将排队信息中的时间戳转换为可读格式"""
+        item = dict(item)
+        item['estimated_start_time'] = datetime.fromtimestamp(
+            item['estimated_start_time']).strftime('%Y-%m-%d %H:%M:%S')
+        return item
+
+    def _estimate_progress(self, task: Dict, queue_wait: float = 0) -> Dict:
+        """
+        根据各阶段的预测耗时估算任务的实际进度和剩余时间
+        :param queue_wait: 任务在当前阶段队列中的预计等待时间（秒）
+        :return: {'progress': ..., 'eta_seconds': ..., 'estimated_completion_time': ..., 'stage_estimates': ...}
+        """
+        task_data = json.loads(task['task_data'] or '{}')
+        stages = STAGES[STAGES.index(self._first_stage(task['file_type'])):]
+        costs = {stage: task_data.get(f'{stage}_cost') or 0 for stage in stages}
+        current = task['stage'] if task['stage'] in stages else stages[0]
+        index = stages.index(current)
+        done = sum(costs[stage] for stage in stages[:index])
+        later = sum(costs[stage] for stage in stages[index + 1:])
+        cost = costs[current]
+
+        now = time.time()
+        fraction = 0.0
+        remaining = cost
+        running = (task['lease_owner'] and (task['lease_expires_at'] or 0) >= now
+                   and task['stage_started_at'])
+        if running:
+            elapsed = now - task['stage_started_at']
+            stage_progress = task.get('stage_progress')
+            if stage_progress and stage_progress >= 0.05:
+                # 语音识别报告了真实进度，按当前速度推算剩余时间
+                fraction = stage_progress
+                remaining = elapsed * (1 - fraction) / fraction
+            elif cost > 0:
+                # 没有阶段内进度时按预测耗时推算，超出预测后保持在95%
+                fraction = min(elapsed / cost, 0.95)
+                remaining = cost * (1 - fraction)
+
+        total = done + cost + later
+        eta_seconds = queue_wait + remaining + later
+        return {
+            'progress': int(100 * (done + cost * fraction) / total) if total > 0 else task['progress'],
+            'eta_seconds': round(eta_seconds, 1),
+            'estimated_completion_time': datetime.fromtimestamp(now + eta_seconds).strftime('%Y-%m-%d %H:%M:%S'),
+            'stage_estimates': costs
+        }
 
     def get_status(self, task_id: str) -> Optional[Dict]:
-        """获取任务状态"""
-        return self.db.get_task(task_id)
+        """获取任务状态，未完成的任务附带预计进度和剩余时间，排队中的任务附带队列位置和预计开始时间"""
+        task = self.status_cache.get_task(task_id)
+        if not task or task['status'] in TERMINAL_STATUSES or not task['stage']:
+            return task
+        queue_wait = 0
+        if task['status'] == 'queued':
+            position = self._find_queue_position(task_id)
+            if position:
+                queue_wait = position['estimated_wait_seconds']
+                task.update(self._queue_item_view(position))
+        task.update(self._estimate_progress(task, queue_wait))
+        return task
+
+    def get_status_etag(self, task_id: str) -> Optional[str]:
+        """
+        任务状态的 ETag，无需生成状态内容即可判断是否变化
+        已结束的任务取任务自身的状态版本号；未结束的任务的排队位置取决于其他任务，取全局状态版本号，
+        并附加 estimate_refresh_interval 时间分段，使预计进度和剩余时间定期更新
+        :return: 任务不存在时返回None
+        """
+        version = self.status_cache.refresh()
+        task = self.status_cache.get_task(task_id)
+        if not task:
+            return None
+        if task['status'] in TERMINAL_STATUSES or not task['stage']:
+            return f"t{task['status_version'] or 0}"
+        return f"v{version}-{int(time.time() // max(1, self.estimate_refresh_interval))}"
+
+    def get_all_status_version(self) -> int:
+        """所有任务状态的版本号，用作 /status/all 的 ETag"""
+        return self.status_cache.refresh()
 
     def get_all_status(self) -> List[Dict]:
-        """获取所有任务状态"""
-        return self.db.get_all_tasks()
+        """获取所有任务状态（最近创建的任务），在状态版本不变时复用"""
+        return self.status_cache.memoize('all_status', self.db.get_all_tasks)
+
+    def get_status_changes(self, since: int) -> Dict:
+        """
+        获取状态版本号大于 since 的任务
+        :return: {'version': 当前版本号, 'tasks': 变化的任务列表}，客户端以返回的 version 作为下一次的 since
+        """
+        version, tasks = self.status_cache.changes_since(since)
+        return {'version': version, 'tasks': tasks}
+
+    def list_tasks(self, limit: int = 50, cursor: Optional[str] = None,
+                   statuses: Optional[List[str]] = None, **filters) -> Dict:
+        """
+        分页查询任务列表
+        :param limit: 每页任务数
+        :param cursor: 上一页返回的 next_cursor
+        :param statuses: 只返回这些状态的任务
+        :param filters: model_name、lang、created_after、created_before
+        :return: {'tasks', 'next_cursor', 'total', 'status_counts'}，
+                 status_counts 为不按状态过滤时各状态的任务数，total 为满足所有过滤条件的任务数
+        :raises ValueError: 游标格式无效
+        """
+        tasks, next_cursor = self.db.query_tasks(
+            limit=limit,
+            cursor=decode_cursor(cursor) if cursor else None,
+            statuses=statuses,
+            **filters
+        )
+        status_counts = self.db.count_tasks_by_status(**filters)
+        total = sum(count for status, count in status_counts.items()
+                    if not statuses or status in statuses)
+        return {
+            'tasks': tasks,
+            'next_cursor': encode_cursor(next_cursor) if next_cursor else None,
+            'total': total,
+            'status_counts': status_counts
+        }
+
+    def update_queue_metrics(self):
+        """从数据库刷新各阶段的队列深度和处理中任务数（统计所有工作进程）"""
+        for stage in STAGES:
+            waiting, running = self.db.get_stage_tasks(stage)
+            QUEUE_DEPTH.labels(stage=stage).set(len(waiting))
+            STAGE_ACTIVE.labels(stage=stage).set(len(running))
 
     def get_queue_info(self) -> Dict:
-        """获取队列信息"""
+        """获取队列信息（统计所有共享数据库的工作进程），在状态版本不变时复用"""
+        info = dict(self.status_cache.memoize('queue_info', self._build_queue_info))
+        info['models'] = self.model_pool.get_stats()
+        return info
+
+    def _build_queue_info(self) -> Dict:
+        queue = []
+        stages = {}
+        for stage in STAGES:
+            stage_queue = self.stage_queues[stage]
+            snapshot = self._queue_snapshot(stage)
+            for item in snapshot:
+                queue.append(self._queue_item_view(dict(item, stage=stage)))
+            stages[stage] = {
+                'workers': self.pool_sizes[stage],
+                'active': stage_queue.active_count(),
+                'queued': len(snapshot)
+            }
+        active_tasks = sum(info['active'] for info in stages.values())
         return {
-            'active_tasks': self.active_tasks,
-            'queued_tasks': self.task_queue.qsize(),
-            'max_tasks': self.max_active_tasks
-        } 
\ No newline at end of file
+            'active_tasks': active_tasks,
+            'queued_tasks': len(queue),
+            'max_tasks': self.max_backlog,
+            'backlog_exceeded': active_tasks + len(queue) >= self.max_backlog,
+            'policy': self.scheduler_config.get('policy', 'sjf'),
+            'stages': stages,
+            'queue': queue
+        }
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# 测试从项目根目录导入模块（与 python app.py 的运行方式相同）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+@pytest.fixture
+def db(tmp_path):
+    """临时数据库，进度更新同步写入"""
+    database = Database(str(tmp_path / 'tasks.db'), flush_interval=0)
+    yield database
+    database.close()
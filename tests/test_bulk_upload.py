@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+# 任务处理器依赖 whisper，未安装时跳过
+pytest.importorskip('whisper')
+
+from task_processor import TaskProcessor
+
+@pytest.fixture
+def processor(tmp_path):
+    processor = TaskProcessor(run_workers=False, db_file=str(tmp_path / 'tasks.db'))
+    yield processor
+    processor.shutdown(timeout=1)
+    processor.db.close()
+
+def make_file(path):
+    with open(path, 'wb') as f:
+        f.write(b'media')
+    return str(path)
+
+def test_tasks_keep_their_filename_when_other_files_fail(processor, tmp_path):
+    output_dir = tmp_path / 'uploads'
+    output_dir.mkdir()
+    paths = [make_file(tmp_path / '.upload_1_notes.txt'), str(tmp_path / '.upload_2_gone.mp4'),
+             make_file(tmp_path / '.upload_3_talk.mp4')]
+
+    success, _, tasks, errors = processor.add_tasks_bulk(
+        paths, str(output_dir), original_filenames=['notes.txt', 'gone.mp4', 'talk.mp4']
+    )
+
+    assert success
+    assert [(task['file'], task['original_filename']) for task in tasks] == [(paths[2], 'talk.mp4')]
+    assert [(error['file'], error['original_filename']) for error in errors] == [
+        (paths[0], 'notes.txt'), (paths[1], 'gone.mp4')
+    ]
+    row = processor.db.get_task(tasks[0]['task_id'])
+    assert row['original_filename'] == 'talk.mp4'
+    assert row['stage'] == 'extract'
+    assert os.listdir(output_dir) == [row['stored_filename']]
+    assert not os.path.exists(paths[2])
+
+def test_failed_transaction_restores_moved_files(processor, tmp_path, monkeypatch):
+    output_dir = tmp_path / 'uploads'
+    output_dir.mkdir()
+    paths = [make_file(tmp_path / 'a.mp4'), make_file(tmp_path / 'b.wav')]
+    monkeypatch.setattr(processor.db, 'add_tasks_bulk', lambda tasks, files: False)
+
+    success, _, tasks, errors = processor.add_tasks_bulk(paths, str(output_dir))
+
+    assert not success
+    assert tasks == []
+    assert [error['original_filename'] for error in errors] == ['a.mp4', 'b.wav']
+    assert all(os.path.exists(path) for path in paths)
+    assert os.listdir(output_dir) == []
+
+def test_registered_files_are_referenced_in_place(processor, tmp_path):
+    path = make_file(tmp_path / 'lecture.mp3')
+
+    success, _, tasks, errors = processor.add_tasks_bulk([path], str(tmp_path / 'uploads'), move=False)
+
+    assert success and not errors
+    assert tasks[0]['file_type'] == 'audio'
+    assert processor.db.get_task(tasks[0]['task_id'])['stage'] == 'asr'
+    assert os.path.exists(path)
@@ -0,0 +1,26 @@
+import socket
+import threading
+import types
+
+import pytest
+
+# events 依赖任务处理器（whisper），未安装时跳过
+pytest.importorskip('whisper')
+
+from events import EventStream
+
+def make_stream(port):
+    processor = types.SimpleNamespace(status_cache=types.SimpleNamespace(version=0))
+    return EventStream(processor, host='127.0.0.1', port=port, poll_interval=0.05)
+
+def test_start_fails_fast_when_port_is_in_use():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()
+        stream = make_stream(sock.getsockname()[1])
+        result = []
+        starter = threading.Thread(target=lambda: result.append(stream.start(timeout=5)))
+        starter.start()
+        starter.join(3)
+        assert result == [False]
+        stream.stop()
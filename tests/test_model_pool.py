@@ -0,0 +1,79 @@
+import time
+
+from model_pool import ModelPool
+
+def make_pool(**kwargs):
+    loaded = []
+
+    def loader(model_name):
+        loaded.append(model_name)
+        return object()
+
+    options = {'model_memory': {'small': 1000, 'large': 5000}, 'idle_seconds': 600, 'loader': loader}
+    options.update(kwargs)
+    return ModelPool(**options), loaded
+
+def use(pool, task_id, model_name):
+    assert pool.reserve(task_id, model_name) == model_name
+    pool.acquire(task_id, model_name)
+    pool.release(task_id)
+
+def test_loaded_model_is_reused_while_fresh():
+    pool, loaded = make_pool()
+    use(pool, 'a', 'small')
+    use(pool, 'b', 'small')
+    assert loaded == ['small']
+    assert pool.evict_idle() == 0
+    assert len(pool.get_stats()['loaded_models']) == 1
+
+def test_idle_models_are_evicted_without_budget():
+    pool, loaded = make_pool(budget_mb=0, idle_seconds=0.05)
+    use(pool, 'a', 'small')
+    use(pool, 'b', 'large')
+    time.sleep(0.1)
+    assert pool.evict_idle() == 2
+    assert pool.get_stats()['loaded_models'] == []
+    assert pool.get_stats()['committed_mb'] == 0
+
+def test_models_in_use_are_not_evicted():
+    pool, _ = make_pool(idle_seconds=0)
+    pool.reserve('a', 'small')
+    pool.acquire('a', 'small')
+    pool.reserve('b', 'large')
+    time.sleep(0.01)
+    assert pool.evict_idle() == 0
+    pool.release('a')
+    pool.release('b')
+    time.sleep(0.01)
+    assert pool.evict_idle() == 1
+
+def test_budget_rejects_model_that_does_not_fit():
+    pool, _ = make_pool(budget_mb=4000)
+    assert not pool.fits_budget('large')
+    use(pool, 'a', 'small')
+    assert pool.reserve('b', 'large') is None
+
+def test_device_memory_limits_admission_across_processes():
+    # 其他进程已占用设备内存，只剩 3000 MB
+    pool, loaded = make_pool(device_memory=lambda: (3000, 16000))
+    assert pool.reserve('a', 'large') is None
+    assert pool.reserve('b', 'small') == 'small'
+    # 已预留但尚未加载的模型同样计入
+    assert pool.reserve('c', 'small') == 'small'
+    assert pool.reserve('d', 'small') == 'small'
+    assert pool.reserve('e', 'small') is None
+
+def test_device_memory_keeps_reserve_margin():
+    pool, _ = make_pool(device_memory=lambda: (5500, 16000), device_reserve_mb=1000)
+    assert pool.reserve('a', 'large') is None
+    assert pool.reserve('b', 'small') == 'small'
+
+def test_device_smaller_than_model_is_not_enforced():
+    pool, _ = make_pool(device_memory=lambda: (2000, 4000))
+    assert pool.reserve('a', 'large') == 'large'
+
+def test_unknown_device_memory_falls_back_to_budget():
+    pool, _ = make_pool(budget_mb=6000, device_memory=lambda: None)
+    assert pool.reserve('a', 'large') == 'large'
+    assert pool.reserve('b', 'small') == 'small'
+    assert pool.reserve('c', 'small') is None
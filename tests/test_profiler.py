@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from profiler import read_folded, profile_call
+
+def busy_in_pool():
+    time.sleep(0.2)
+
+def stage_work():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(tracing.bind(busy_in_pool)) for _ in range(2)]
+        for future in futures:
+            future.result()
+
+def unbound_work():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(busy_in_pool).result()
+
+def test_sampling_includes_bound_pool_threads(tmp_path):
+    path = str(tmp_path / 'profile.folded')
+    assert profile_call(stage_work, path, root='llm', interval=0.005)
+    samples = read_folded(path)
+    pool_samples = sum(count for stack, count in samples.items() if 'busy_in_pool' in stack)
+    assert pool_samples > 0
+    assert all(stack.startswith('llm;') for stack in samples)
+
+def test_unbound_threads_are_not_sampled(tmp_path):
+    path = str(tmp_path / 'profile.folded')
+    profile_call(unbound_work, path, root='llm', interval=0.005)
+    assert not any('busy_in_pool' in stack for stack in read_folded(path))
+
+def test_stages_merge_into_one_file(tmp_path):
+    path = str(tmp_path / 'profile.folded')
+    profile_call(lambda: time.sleep(0.05), path, root='extract', interval=0.005)
+    profile_call(lambda: time.sleep(0.05), path, root='asr', interval=0.005)
+    roots = {stack.split(';', 1)[0] for stack in read_folded(path)}
+    assert roots == {'extract', 'asr'}
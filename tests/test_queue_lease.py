@@ -0,0 +1,109 @@
+import time
+
+def oldest(candidates, now):
+    return candidates[0] if candidates else None
+
+def enqueue(db, task_id, stage='extract'):
+    db.add_task(task_id, f'{task_id}.mp4', f'{task_id}.mp4', 'video')
+    assert db.enqueue_stage(task_id, stage, {'file_path': f'/tmp/{task_id}.mp4'}, 1.0, 0, '排队中')
+
+def expire_lease(db, task_id):
+    with db._connect() as conn:
+        conn.execute('UPDATE tasks SET lease_expires_at = ? WHERE task_id = ?', (time.time() - 1, task_id))
+        conn.commit()
+
+def test_claim_leases_task_and_parses_task_data(db):
+    enqueue(db, 't1')
+    task = db.claim_task('extract', 'worker-a', 60, oldest)
+    assert task['task_id'] == 't1'
+    assert task['lease_owner'] is None  # 领取前的行
+    assert task['file_path'] == '/tmp/t1.mp4'
+    assert db.get_task('t1')['lease_owner'] == 'worker-a'
+    # 租约有效期内其他进程领取不到
+    assert db.claim_task('extract', 'worker-b', 60, oldest) is None
+
+def test_claim_only_returns_tasks_of_requested_stage(db):
+    enqueue(db, 't1', stage='asr')
+    assert db.claim_task('extract', 'worker-a', 60, oldest) is None
+    assert db.claim_task('asr', 'worker-a', 60, oldest)['task_id'] == 't1'
+
+def test_expired_lease_is_reclaimed(db):
+    enqueue(db, 't1')
+    db.claim_task('extract', 'worker-a', 60, oldest)
+    expire_lease(db, 't1')
+    task = db.claim_task('extract', 'worker-b', 60, oldest)
+    assert task['task_id'] == 't1'
+    assert task['lease_owner'] == 'worker-a'
+    row = db.get_task('t1')
+    assert row['lease_owner'] == 'worker-b'
+    assert row['attempts'] == 2
+
+def test_task_gives_up_after_max_attempts(db):
+    enqueue(db, 't1')
+    for attempt in range(2):
+        assert db.claim_task('extract', f'worker-{attempt}', 60, oldest, max_attempts=2)
+        expire_lease(db, 't1')
+    assert db.claim_task('extract', 'worker-x', 60, oldest, max_attempts=2) is None
+    row = db.get_task('t1')
+    assert row['status'] == 'error'
+    assert row['lease_owner'] is None
+
+def test_stale_worker_cannot_overwrite_new_owner(db):
+    enqueue(db, 't1')
+    db.claim_task('extract', 'worker-a', 60, oldest)
+    expire_lease(db, 't1')
+    db.claim_task('extract', 'worker-b', 60, oldest)
+
+    assert not db.update_task_status('t1', 'error', 0, '处理失败', error_message='boom', lease_owner='worker-a')
+    assert not db.update_task_status('t1', 'completed', 100, '处理完成', lease_owner='worker-a')
+    assert not db.enqueue_stage('t1', 'asr', {}, 1.0, 30, '等待识别', lease_owner='worker-a')
+    row = db.get_task('t1')
+    assert row['status'] == 'queued'
+    assert row['stage'] == 'extract'
+    assert row['lease_owner'] == 'worker-b'
+
+    assert db.update_task_status('t1', 'completed', 100, '处理完成', lease_owner='worker-b')
+    row = db.get_task('t1')
+    assert row['status'] == 'completed'
+    assert row['lease_owner'] is None
+
+def test_renew_extends_only_own_leases(db):
+    enqueue(db, 't1')
+    enqueue(db, 't2')
+    db.claim_task('extract', 'worker-a', 60, oldest)
+    db.claim_task('extract', 'worker-b', 60, oldest)
+    expire_lease(db, 't1')
+    expire_lease(db, 't2')
+    assert db.renew_leases('worker-a', 60) == 1
+    assert db.claim_task('extract', 'worker-c', 60, oldest)['task_id'] == 't2'
+
+def enqueue_many(db, count, stage_cost=100.0, priority=0):
+    rows = [{'task_id': f'bulk-{i}', 'original_filename': 'a.mp4', 'stored_filename': 'a.mp4',
+             'file_type': 'video', 'status': 'queued', 'stage': 'extract', 'task_data': {},
+             'stage_cost': stage_cost, 'priority': priority, 'enqueued_at': time.time() - 60 + i * 0.001}
+            for i in range(count)]
+    assert db.add_tasks_bulk(rows, [])
+
+def test_sjf_sees_short_task_beyond_claim_window(db):
+    from scheduler import TaskScheduler
+    enqueue_many(db, 50)
+    enqueue(db, 'short')
+    with db._connect() as conn:
+        conn.execute("UPDATE tasks SET stage_cost = 1 WHERE task_id = 'short'")
+        conn.commit()
+    scheduler = TaskScheduler(db, 'extract', policy='sjf', sjf_aging_factor=0.01, claim_window=10)
+    assert scheduler.get('worker-a')['task_id'] == 'short'
+
+def test_priority_and_urgent_order_in_database(db):
+    from scheduler import TaskScheduler
+    enqueue_many(db, 50)
+    enqueue(db, 'high')
+    enqueue(db, 'urgent')
+    with db._connect() as conn:
+        conn.execute("UPDATE tasks SET priority = 5 WHERE task_id = 'high'")
+        conn.execute("UPDATE tasks SET priority = 20, stage_cost = 1000 WHERE task_id = 'urgent'")
+        conn.commit()
+    scheduler = TaskScheduler(db, 'extract', policy='priority', claim_window=5, urgent_priority=10)
+    assert scheduler.get('worker-a')['task_id'] == 'urgent'
+    assert scheduler.get('worker-a')['task_id'] == 'high'
+    assert scheduler.get('worker-a')['task_id'] == 'bulk-0'
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import types
+
+from retention import RetentionSweeper, create_retention_sweeper
+
+DAY = 86400
+
+def make_file(path, age_days=0, content=b'data'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    if age_days:
+        past = time.time() - age_days * DAY
+        os.utime(path, (past, past))
+    return path
+
+def add_task_with_file(db, task_id, path, status='completed', finished_days_ago=0, file_type='video'):
+    db.add_task(task_id, os.path.basename(path), os.path.basename(path), file_type)
+    db.add_file(f'file-{task_id}', task_id, file_type, os.path.basename(path), os.path.basename(path), path)
+    if status != 'queued':
+        db.update_task_status(task_id, status, 100, status)
+    if finished_days_ago:
+        finished_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - finished_days_ago * DAY))
+        with db._connect() as conn:
+            conn.execute('UPDATE tasks SET completed_at = ?, updated_at = ? WHERE task_id = ?',
+                         (finished_at, finished_at, task_id))
+            conn.commit()
+
+def make_sweeper(db, upload_dir, **kwargs):
+    options = {'keep_days': {'original': 7}, 'orphan_grace_hours': 24, 'archive_after_days': 0,
+               'vacuum_interval_hours': 0}
+    options.update(kwargs)
+    return RetentionSweeper(types.SimpleNamespace(db=db), str(upload_dir), **options)
+
+def test_disabled_by_default(tmp_path):
+    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json')
+    with open(config_path, 'r', encoding='utf-8') as f:
+        shipped = json.load(f)['retention']
+    assert shipped['enabled'] is False
+    assert create_retention_sweeper(None, shipped, str(tmp_path)) is None
+    assert create_retention_sweeper(None, {}, str(tmp_path)) is None
+
+def test_expired_files_of_finished_tasks_only(db, tmp_path):
+    upload_dir = tmp_path / 'uploads'
+    old = make_file(str(upload_dir / 'old.mp4'))
+    recent = make_file(str(upload_dir / 'recent.mp4'))
+    running = make_file(str(upload_dir / 'running.mp4'))
+    add_task_with_file(db, 'old', old, finished_days_ago=10)
+    add_task_with_file(db, 'recent', recent, finished_days_ago=1)
+    add_task_with_file(db, 'running', running, status='processing')
+
+    make_sweeper(db, upload_dir).sweep_once()
+
+    assert not os.path.exists(old)
+    assert db.get_task_files('old') == []
+    assert os.path.exists(recent)
+    assert os.path.exists(running)
+    assert len(db.get_task_files('running')) == 1
+
+def test_files_outside_upload_dir_are_never_deleted(db, tmp_path):
+    upload_dir = tmp_path / 'uploads'
+    upload_dir.mkdir()
+    registered = make_file(str(tmp_path / 'library' / 'movie.mp4'))
+    add_task_with_file(db, 'registered', registered, finished_days_ago=30)
+
+    make_sweeper(db, upload_dir).sweep_once()
+
+    assert os.path.exists(registered)
+    assert len(db.get_task_files('registered')) == 1
+
+def test_orphans_skip_render_cache_and_upload_temp_files(db, tmp_path):
+    upload_dir = tmp_path / 'uploads'
+    orphan = make_file(str(upload_dir / 'orphan.srt'), age_days=2)
+    new_orphan = make_file(str(upload_dir / 'new.srt'))
+    referenced = make_file(str(upload_dir / 'kept.mp4'), age_days=2)
+    upload_temp = make_file(str(upload_dir / '.upload_abc_clip.mp4'), age_days=2)
+    cache_recent = make_file(str(upload_dir / '.render_cache' / 'aa' / 'recent.vtt'), age_days=2)
+    cache_stale = make_file(str(upload_dir / '.render_cache' / 'bb' / 'stale.vtt'), age_days=10)
+    add_task_with_file(db, 'kept', referenced)
+
+    result = make_sweeper(db, upload_dir, render_cache_days=7).sweep_once()
+
+    assert not os.path.exists(orphan)
+    assert os.path.exists(new_orphan)
+    assert os.path.exists(referenced)
+    assert os.path.exists(upload_temp)
+    assert os.path.exists(cache_recent)
+    assert not os.path.exists(cache_stale)
+    assert result['orphans_removed'] == 1
+    assert result['render_cache_removed'] == 1
+
+def test_render_cache_kept_when_pruning_disabled(db, tmp_path):
+    upload_dir = tmp_path / 'uploads'
+    cache_stale = make_file(str(upload_dir / '.render_cache' / 'bb' / 'stale.vtt'), age_days=100)
+
+    make_sweeper(db, upload_dir, render_cache_days=0).sweep_once()
+
+    assert os.path.exists(cache_stale)
@@ -0,0 +1,58 @@
+import types
+
+import pytest
+
+# AIService 依赖 openai，未安装时跳过
+pytest.importorskip('openai')
+
+from ai_service import _parse_numbered
+from benchmarks.fixtures import make_srt
+from benchmarks.stubs import StubClient, install_ai_client, install_stub_ai
+from translator import Translator
+
+def read_blocks(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read().strip().split('\n\n')
+
+def test_parse_numbered_keeps_multiline_items():
+    assert _parse_numbered('[1] a\n[2] b\nc', 2) == ['a', 'b\nc']
+    # 模型在编号前附加的前缀不影响解析
+    assert _parse_numbered('[英语][1] a\n[英语][2] b', 2) == ['a', 'b']
+
+def test_parse_numbered_rejects_mismatched_items():
+    assert _parse_numbered('[1] a', 2) is None
+    assert _parse_numbered('[1] a\n[3] b', 2) is None
+    assert _parse_numbered('a\nb', 2) is None
+
+def test_each_batch_is_one_request(tmp_path):
+    client = install_stub_ai()
+    srt_file = tmp_path / 'input.srt'
+    srt_file.write_text(make_srt(60), encoding='utf-8')
+    translator = Translator()
+    batches = translator._split_batches(read_blocks(srt_file))
+
+    output = translator.translate_srt(str(srt_file), '英语')
+
+    assert 1 < len(batches) < 60
+    assert client.chat.completions.calls == len(batches)
+    assert read_blocks(output) == read_blocks(srt_file)
+
+def test_mismatched_batch_falls_back_to_single_lines(tmp_path):
+    client = StubClient()
+    create = client.chat.completions.create
+
+    def drop_numbering(model, messages, **kwargs):
+        # 批量请求只返回一行，逐条请求正常返回
+        response = create(model, messages, **kwargs)
+        if '条字幕' in messages[-1]['content']:
+            response.choices[0].message.content = '无法对应的结果'
+        return response
+
+    client.chat.completions = types.SimpleNamespace(create=drop_numbering)
+    install_ai_client(client)
+    srt_file = tmp_path / 'input.srt'
+    srt_file.write_text(make_srt(8), encoding='utf-8')
+
+    output = Translator().translate_srt(str(srt_file), '英语')
+
+    assert read_blocks(output) == read_blocks(srt_file)
@@ -0,0 +1,145 @@
+import math
+import threading
+import logging
+from typing import Dict, List, Optional, Sequence
+
+# 中日韩字符按每字约1个token估算，其余字符按每4个字符约1个token估算
+_CJK_RANGES = (
+    (0x3040, 0x30ff),   # 日文假名
+    (0x3400, 0x4dbf),   # 中日韩统一表意文字扩展A
+    (0x4e00, 0x9fff),   # 中日韩统一表意文字
+    (0xac00, 0xd7af),   # 韩文音节
+    (0xff00, 0xffef),   # 全角符号
+)
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return any(start <= code <= end for start, end in _CJK_RANGES)
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数量（无需加载分词器）
+    :param text: 文本
+    :return: 估算的token数
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if _is_cjk(char))
+    other = len(text) - cjk
+    return cjk + math.ceil(other / 4)
+
+def request_tokens(text: str, context_before: Optional[List[str]] = None,
+                   context_after: Optional[List[str]] = None) -> int:
+    """
+    估算一次请求处理的token数（文本及其上下文，不含提示词模板），纠正和翻译使用同一口径
+    :return: 估算的token数
+    """
+    return estimate_tokens(text) + sum(estimate_tokens(line) for line in (context_before or []) + (context_after or []))
+
+def partition_by_tokens(costs: Sequence[int], budget: int) -> List[List[int]]:
+    """
+    将连续的工作项按token开销均衡切分
+    先根据总开销和预算确定分组数，再以平均开销为目标贪心切分，使各组开销接近
+    :param costs: 每个工作项的token开销
+    :param budget: 单个分组的token上限
+    :return: 分组列表，每组为工作项下标列表
+    """
+    if not costs:
+        return []
+    total = sum(costs)
+    groups_count = max(1, math.ceil(total / max(1, budget)))
+    target = total / groups_count
+
+    groups = []
+    current = []
+    current_cost = 0
+    for i, cost in enumerate(costs):
+        # 超过预算，或者加入后离目标更远时切分
+        if current and (current_cost + cost > budget or
+                        abs(current_cost + cost - target) > abs(current_cost - target)):
+            groups.append(current)
+            current = []
+            current_cost = 0
+        current.append(i)
+        current_cost += cost
+    if current:
+        groups.append(current)
+    return groups
+
+class LatencyTracker:
+    """
+    记录各模型的请求耗时，估算每个token的延迟，并据此计算单次请求的token预算
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(LatencyTracker, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self, alpha: float = 0.2, min_samples: int = 3):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self._seconds_per_token: Dict[str, float] = {}
+        self._samples: Dict[str, int] = {}
+        self._stats_lock = threading.Lock()
+
+    def record(self, model: str, tokens: int, seconds: float) -> None:
+        """
+        记录一次请求的耗时
+        :param model: 模型名称
+        :param tokens: 请求处理的token数（见 request_tokens）
+        :param seconds: 请求耗时（秒）
+        """
+        if tokens <= 0 or seconds <= 0:
+            return
+        sample = seconds / tokens
+        with self._stats_lock:
+            previous = self._seconds_per_token.get(model)
+            if previous is None:
+                self._seconds_per_token[model] = sample
+            else:
+                self._seconds_per_token[model] = self.alpha * sample + (1 - self.alpha) * previous
+            self._samples[model] = self._samples.get(model, 0) + 1
+
+    def seconds_per_token(self, model: str) -> Optional[float]:
+        """获取模型的每token延迟，样本不足时返回None"""
+        with self._stats_lock:
+            if self._samples.get(model, 0) < self.min_samples:
+                return None
+            return self._seconds_per_token.get(model)
+
+    def token_budget(self, model: str, config: Dict, default_budget: int) -> int:
+        """
+        计算单次请求的token预算
+        :param model: 模型名称
+        :param config: 阶段配置，读取 target_request_seconds / min_request_tokens / max_request_tokens / token_budget
+        :param default_budget: 未配置 token_budget 且无观测数据时使用的预算
+        :return: token预算
+        """
+        budget = config.get('token_budget', default_budget)
+        min_tokens = config.get('min_request_tokens', 100)
+        max_tokens = config.get('max_request_tokens', 4000)
+        target_seconds = config.get('target_request_seconds')
+
+        per_token = self.seconds_per_token(model)
+        if target_seconds and per_token:
+            budget = int(target_seconds / per_token)
+        budget = max(min_tokens, min(max_tokens, budget))
+        logging.debug(f"模型 {model} 的请求token预算: {budget}")
+        return budget
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取各模型的延迟统计"""
+        with self._stats_lock:
+            return {
+                model: {
+                    'seconds_per_token': self._seconds_per_token[model],
+                    'samples': self._samples.get(model, 0)
+                }
+                for model in self._seconds_per_token
+            }
@@ -0,0 +1,116 @@
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from profiler import run_sampled
+
+# 当前线程（或复制了上下文的线程池任务）所属的追踪和父 span
+_current = contextvars.ContextVar('trace_context', default=None)
+
+class Span:
+    """一个有起止时间的操作，属性为可序列化为 JSON 的简单值"""
+    __slots__ = ('span_id', 'parent_id', 'name', 'start', 'end', 'attrs')
+
+    def __init__(self, name: str, parent_id: Optional[str], attrs: Dict):
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """添加或更新属性"""
+        self.attrs.update(attrs)
+
+    def to_row(self) -> List:
+        """紧凑的存储格式：[id, 父id, 名称, 开始, 结束, 属性]，时间精确到毫秒"""
+        return [self.span_id, self.parent_id, self.name, round(self.start, 3),
+                round(self.end if self.end is not None else time.time(), 3), self.attrs]
+
+class _NullSpan:
+    """未在追踪中时使用，忽略所有属性"""
+
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Trace:
+    """一个任务在一次阶段执行期间记录的 span，结束时一次写入"""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def rows(self) -> List[List]:
+        with self._lock:
+            return [span.to_row() for span in self.spans]
+
+@contextmanager
+def start_trace(task_id: str, sink: Callable[[str, List[List]], object]):
+    """
+    在当前线程中开始记录任务的追踪，结束时将所有 span 交给 sink(task_id, rows) 保存
+    """
+    trace = Trace(task_id)
+    token = _current.set((trace, None))
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        rows = trace.rows()
+        if rows:
+            sink(task_id, rows)
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    记录一个 span，嵌套的 span 以其为父节点；不在追踪中时不做任何事
+    抛出异常时记录异常类型
+    """
+    context = _current.get()
+    if context is None:
+        yield _NULL_SPAN
+        return
+    trace, parent_id = context
+    current = Span(name, parent_id, attrs)
+    if 'thread' not in attrs:
+        current.attrs['thread'] = threading.current_thread().name
+    token = _current.set((trace, current.span_id))
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        current.end = time.time()
+        _current.reset(token)
+        trace.add(current)
+
+def record(name: str, start: float, end: float, **attrs):
+    """记录一个已结束的 span（如根据已知的起止时间补记排队等待）"""
+    context = _current.get()
+    if context is None:
+        return
+    trace, parent_id = context
+    current = Span(name, parent_id, attrs)
+    current.attrs.setdefault('thread', threading.current_thread().name)
+    current.start = start
+    current.end = end
+    trace.add(current)
+
+def bind(func: Callable) -> Callable:
+    """
+    复制当前的上下文，使 func 在线程池中执行时记录的 span（及大模型用量等其他上下文变量）归属于当前任务
+    任务正在采样分析时，执行 func 的线程同样被采样
+    每次提交都需要单独调用，同一个上下文不能同时在多个线程中进入
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(run_sampled, func, *args, **kwargs)
@@ -5,6 +5,9 @@ from concurrent.futures import ThreadPoolExecutor
 import concurrent.futures
 from config_manager import ConfigManager
 from ai_service import AIService
+from token_budget import LatencyTracker, estimate_tokens, partition_by_tokens, request_tokens
+from cancellation import cancel_futures
+import tracing
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,7 +20,9 @@ class Translator:
         self.max_workers = config.get('max_workers', 5)
         self.context_window = config.get('context_window', 3)
         self.batch_size = config.get('batch_size', 10)
+        self.config = config
         self.ai_service = AIService()
+        self.latency_tracker = LatencyTracker()
         self.word_dict = {}  # 初始化替换词典
         
     def set_word_dict(self, dict_path):
@@ -45,12 +50,14 @@ class Translator:
             text = text.replace(source, target)
         return text
 
-    def translate_srt(self, srt_file: str, target_lang: str, keep_original: bool = False) -> str:
+    def translate_srt(self, srt_file: str, target_lang: str, keep_original: bool = False,
+                      cancel_token=None) -> str:
         """
         翻译SRT文件
         :param srt_file: SRT文件路径
         :param target_lang: 目标语言
         :param keep_original: 是否保留原文（生成双语字幕）
+        :param cancel_token: 取消令牌，取消时丢弃尚未开始的批次
         :return: 翻译后的SRT文件路径
         """
         logging.info(f"开始翻译文件: {srt_file} 到 {target_lang}")
@@ -62,33 +69,41 @@ class Translator:
             # 将SRT内容分成块
             blocks = content.strip().split('\n\n')
             
-            # 将blocks分成多个批次
-            batches = []
-            for i in range(0, len(blocks), self.batch_size):
-                batch = blocks[i:i + self.batch_size]
-                batch_info = self._prepare_batch(batch, i, blocks)
-                if batch_info:
-                    batches.append(batch_info)
+            # 按token预算将blocks分成开销均衡的批次
+            batches = self._split_batches(blocks)
 
             # 使用线程池并行处理批次
             translated_blocks = []
             with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                # 提交所有批次的处理任务
+                # 提交所有批次的处理任务，开销大的批次先提交以缩短尾部等待
+                submit_order = sorted(range(len(batches)),
+                                      key=lambda i: self._batch_tokens(batches[i]),
+                                      reverse=True)
                 future_to_batch = {
-                    executor.submit(self._process_batch, batch, target_lang, keep_original): i 
-                    for i, batch in enumerate(batches)
+                    executor.submit(tracing.bind(self._process_batch_traced), batches[i], target_lang, keep_original,
+                                    cancel_token): i
+                    for i in submit_order
                 }
+                cancel_pending = cancel_futures(future_to_batch)
+                if cancel_token:
+                    cancel_token.add_callback(cancel_pending)
 
                 # 收集结果
                 all_results = []
-                for future in concurrent.futures.as_completed(future_to_batch):
-                    batch_index = future_to_batch[future]
-                    try:
-                        result = future.result()
-                        all_results.append((batch_index, result))
-                    except Exception as e:
-                        logging.error(f"处理批次 {batch_index} 时出错: {str(e)}")
-                        raise
+                try:
+                    for future in concurrent.futures.as_completed(future_to_batch):
+                        if cancel_token:
+                            cancel_token.check()
+                        batch_index = future_to_batch[future]
+                        try:
+                            result = future.result()
+                            all_results.append((batch_index, result))
+                        except Exception as e:
+                            logging.error(f"处理批次 {batch_index} 时出错: {str(e)}")
+                            raise
+                finally:
+                    if cancel_token:
+                        cancel_token.remove_callback(cancel_pending)
 
                 # 按原始顺序排序结果
                 all_results.sort(key=lambda x: x[0])
@@ -108,6 +123,31 @@ class Translator:
             logging.error(f"翻译过程中出错: {str(e)}")
             raise
 
+    def _split_batches(self, blocks: List[str]) -> List[List[Dict]]:
+        """
+        按token预算切分批次，每个批次作为一个翻译请求，使各请求的开销接近
+        预算根据模型观测到的每token延迟计算，并受 max_request_tokens 限制；预算包含批次首尾的上下文
+        """
+        block_infos = self._prepare_batch(blocks, 0, blocks)
+        # 未配置预算且没有观测数据时，按 batch_size 条平均开销的字幕估算
+        average_tokens = sum(block['tokens'] for block in block_infos) / max(1, len(block_infos))
+        token_budget = self.latency_tracker.token_budget(
+            self.ai_service.stage_model('translate'), self.config, default_budget=int(self.batch_size * average_tokens)
+        )
+        # 为批次首尾的上下文预留预算
+        context_tokens = max((block['context_tokens'] for block in block_infos), default=0)
+        text_budget = max(token_budget // 2, token_budget - context_tokens)
+        groups = partition_by_tokens([block['tokens'] for block in block_infos], text_budget)
+        batches = [[block_infos[i] for i in group] for group in groups]
+        logging.info(f"共 {len(block_infos)} 条字幕，token预算 {token_budget}，分为 {len(batches)} 个批次")
+        return batches
+
+    def _batch_tokens(self, batch_blocks: List[Dict]) -> int:
+        """计算批次请求的token数（字幕文本及批次首尾的上下文）"""
+        return request_tokens('', batch_blocks[0]['context_before'], batch_blocks[-1]['context_after']) + sum(
+            block['tokens'] for block in batch_blocks
+        )
+
     def _prepare_batch(self, batch: List[str], batch_start_index: int, all_blocks: List[str]) -> List[Dict]:
         """
         准备批次数据，包括上下文信息
@@ -145,26 +185,42 @@ class Translator:
                 'timestamp': timestamp,
                 'text': text,
                 'context_before': context_before,
-                'context_after': context_after
+                'context_after': context_after,
+                'tokens': estimate_tokens(text) + 1,  # 编号和换行符
+                'context_tokens': request_tokens('', context_before, context_after)
             })
         
         return batch_blocks
 
-    def _process_batch(self, batch_blocks: List[Dict], target_lang: str, keep_original: bool) -> List[str]:
+    def _process_batch_traced(self, batch_blocks: List[Dict], target_lang: str, keep_original: bool,
+                              cancel_token=None) -> List[str]:
+        """处理单个批次，并在任务追踪中记录为一个 span"""
+        with tracing.span('batch', lang=target_lang, lines=len(batch_blocks),
+                          tokens=self._batch_tokens(batch_blocks)):
+            return self._process_batch(batch_blocks, target_lang, keep_original, cancel_token)
+
+    def _process_batch(self, batch_blocks: List[Dict], target_lang: str, keep_original: bool,
+                       cancel_token=None) -> List[str]:
         """
-        处理单个批次
+        处理单个批次，整个批次在一个请求中翻译；返回的条目与原文对不上时逐条翻译，取消后不再发起新的请求
         """
         try:
+            if cancel_token:
+                cancel_token.check()
             # 获取翻译文本
             texts = [block['text'] for block in batch_blocks]
-            contexts_before = [block['context_before'] for block in batch_blocks]
-            contexts_after = [block['context_after'] for block in batch_blocks]
-
-            translated_texts = []
-            for text, ctx_before, ctx_after in zip(texts, contexts_before, contexts_after):
-                translated_text = self.ai_service.translate_text(text, target_lang, ctx_before, ctx_after)
-                translated_text = self.apply_word_dict(translated_text)
-                translated_texts.append(translated_text)
+            translated_texts = self.ai_service.translate_batch(
+                texts, target_lang, batch_blocks[0]['context_before'], batch_blocks[-1]['context_after']
+            )
+            if translated_texts is None:
+                translated_texts = []
+                for block in batch_blocks:
+                    if cancel_token:
+                        cancel_token.check()
+                    translated_texts.append(self.ai_service.translate_text(
+                        block['text'], target_lang, block['context_before'], block['context_after']
+                    ))
+            translated_texts = [self.apply_word_dict(text) for text in translated_texts]
             
             # 重建字幕块
             translated_blocks = []
@@ -0,0 +1,31 @@
+# Whisper 模型的元数据
+# 与推理代码（genSrt）分开，Web 进程校验模型名称、估算耗时和内存时无需导入 whisper 和 torch
+
+# 支持的模型列表
+# cost_factor: 转录1秒音频的预计耗时（秒），用于调度时估算任务开销
+# memory_mb: 加载后常驻内存（或显存）的估算值（MB），用于按内存预算控制同时加载的模型
+AVAILABLE_MODELS = {
+    'tiny': {'name': 'tiny', 'description': '最小模型，速度最快，准确度较低', 'cost_factor': 0.05, 'memory_mb': 1000},
+    'base': {'name': 'base', 'description': '基础模型，速度较快，准确度一般', 'cost_factor': 0.1, 'memory_mb': 1000},
+    'small': {'name': 'small', 'description': '小型模型，速度和准确度均衡', 'cost_factor': 0.3, 'memory_mb': 2000},
+    'medium': {'name': 'medium', 'description': '中型模型，准确度较高，速度较慢', 'cost_factor': 0.8, 'memory_mb': 5000},
+    'large-v3': {'name': 'large-v3', 'description': '大型模型，最高准确度，速度最慢', 'cost_factor': 1.5, 'memory_mb': 10000},
+    'large-v3-turbo': {'name': 'large-v3-turbo', 'description': '大型模型，在保留准确度的同时，速度更快', 'cost_factor': 0.5, 'memory_mb': 6000},
+}
+
+def get_available_models():
+    """获取可用的模型列表"""
+    return AVAILABLE_MODELS
+
+def estimate_transcribe_seconds(duration, model_name, cost_factors=None):
+    """
+    估算转录耗时
+    :param duration: 媒体时长（秒）
+    :param model_name: 模型名称
+    :param cost_factors: 覆盖默认 cost_factor 的配置 {模型名称: 系数}
+    :return: 预计耗时（秒）
+    """
+    cost_factor = (cost_factors or {}).get(model_name)
+    if cost_factor is None:
+        cost_factor = AVAILABLE_MODELS.get(model_name, {}).get('cost_factor', 1.0)
+    return duration * cost_factor
@@ -0,0 +1,98 @@
+import argparse
+import logging
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config_manager import ConfigManager
+from metrics import REGISTRY
+from ingest import create_folder_watcher
+from retention import create_retention_sweeper
+from task_processor import TaskProcessor, STAGE_EXTRACT, STAGE_ASR, STAGE_LLM
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='字幕任务处理进程，从共享的 tasks.db 队列中领取任务')
+    parser.add_argument('--extract-workers', type=int, help='音频提取线程数')
+    parser.add_argument('--asr-workers', type=int, help='语音识别线程数')
+    parser.add_argument('--llm-workers', type=int, help='字幕纠正与翻译线程数')
+    parser.add_argument('--shutdown-timeout', type=float, default=30,
+                        help='退出时等待正在处理的阶段完成的时间（秒）')
+    parser.add_argument('--watch-dir', help='监视的投放目录，覆盖配置中的 ingest.watch_dir')
+    parser.add_argument('--metrics-port', type=int,
+                        help='在指定端口以 Prometheus 格式暴露本进程的指标（/metrics）')
+    return parser.parse_args()
+
+def start_metrics_server(port: int, processor: TaskProcessor) -> ThreadingHTTPServer:
+    """在后台线程中启动指标服务"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            processor.update_queue_metrics()
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"指标服务已启动: http://0.0.0.0:{port}/metrics")
+    return server
+
+def main():
+    args = parse_args()
+    pool_sizes = {
+        stage: size for stage, size in [
+            (STAGE_EXTRACT, args.extract_workers),
+            (STAGE_ASR, args.asr_workers),
+            (STAGE_LLM, args.llm_workers)
+        ] if size is not None
+    }
+
+    processor = TaskProcessor(
+        num_workers=ConfigManager().get_translation_config().get('max_workers', 2),
+        run_workers=True,
+        pool_sizes=pool_sizes
+    )
+
+    metrics_server = start_metrics_server(args.metrics_port, processor) if args.metrics_port else None
+
+    ingest_config = ConfigManager().get_config('ingest')
+    folder_watcher = create_folder_watcher(processor, ingest_config, ingest_config.get('output_dir', 'uploads'),
+                                           watch_dir=args.watch_dir)
+    if folder_watcher:
+        folder_watcher.start()
+    retention_sweeper = create_retention_sweeper(processor, ConfigManager().get_config('retention'),
+                                                 ingest_config.get('output_dir', 'uploads'))
+    if retention_sweeper:
+        retention_sweeper.start()
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logging.info(f"收到信号 {signum}，准备退出...")
+        stop.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    while not stop.wait(1):
+        pass
+    if folder_watcher:
+        folder_watcher.stop()
+    if retention_sweeper:
+        retention_sweeper.stop()
+    processor.shutdown(timeout=args.shutdown_timeout)
+    if metrics_server:
+        metrics_server.shutdown()
+    logging.info("工作进程已退出")
+
+if __name__ == '__main__':
+    main()